@@ -31,23 +31,94 @@ float calibration_factor = 21900;
 #define LOADCELL_DOUT_PIN  3
 #define LOADCELL_SCK_PIN  2
 
+//1 = framed binary output (loadcell.py default), 0 = the old "kg,calibration" text lines (loadcell.py --ascii)
+//for 80 SPS the RATE pin on the HX711 board has to be pulled high.
+#define BINARY_MODE 1
+#define BINARY_BAUD 115200
+#define ASCII_BAUD 9600
+
+//binary frame, 14 bytes little endian:
+//  0xA5 0x5A | type | seq (uint16) | micros (uint32) | value (int32 or float) | crc8 of bytes 2-12
+//type 'D' = raw counts with the tare offset removed, 'C' = calibration factor as a float
+#define FRAME_SYNC1 0xA5
+#define FRAME_SYNC2 0x5A
+#define FRAME_DATA 'D'
+#define FRAME_CALIBRATION 'C'
+#define FRAME_SIZE 14
+
+//resend the calibration every so often so a reader that connects late still gets it
+#define CALIBRATION_INTERVAL 1000
+
 HX711 scale;
 
+uint16_t sequence = 0;
+unsigned long last_calibration = 0;
+
+uint8_t crc8(const uint8_t *data, uint8_t len) {
+  uint8_t crc = 0;
+  while (len--) {
+    crc ^= *data++;
+    for (uint8_t i = 0; i < 8; i++)
+      crc = (crc & 0x80) ? (crc << 1) ^ 0x07 : (crc << 1);
+  }
+  return crc;
+}
+
+void send_frame(uint8_t type, const void *value) {
+  uint8_t frame[FRAME_SIZE];
+  uint32_t now = micros();
+
+  frame[0] = FRAME_SYNC1;
+  frame[1] = FRAME_SYNC2;
+  frame[2] = type;
+  memcpy(frame + 3, &sequence, 2);
+  memcpy(frame + 5, &now, 4);
+  memcpy(frame + 9, value, 4);
+  frame[13] = crc8(frame + 2, 11);
+
+  Serial.write(frame, FRAME_SIZE);
+  sequence++;
+}
+
+void send_calibration() {
+  send_frame(FRAME_CALIBRATION, &calibration_factor);
+  last_calibration = millis();
+}
+
 void setup() {
-  Serial.begin(9600);
+#if BINARY_MODE
+  Serial.begin(BINARY_BAUD);
+#else
+  Serial.begin(ASCII_BAUD);
+#endif
   //Serial.println("HX711 Scale v1.0");
   //Serial.println("Kilograms,Calibration Factor"); //You can change this to kg but you'll need to refactor the calibration_factor
 
   scale.begin(LOADCELL_DOUT_PIN, LOADCELL_SCK_PIN);
   scale.set_scale(calibration_factor); //This value is obtained by using the SparkFun_HX711_Calibration sketch
   scale.tare();	//Assuming there is no weight on the scale at start up, reset the scale to 0
+
+#if BINARY_MODE
+  send_calibration();
+#endif
 }
 
 void loop() {
+#if BINARY_MODE
+  //one frame per conversion, no averaging, no delay
+  if (scale.is_ready()) {
+    int32_t counts = scale.read() - scale.get_offset();
+    send_frame(FRAME_DATA, &counts);
+  }
+
+  if (millis() - last_calibration > CALIBRATION_INTERVAL)
+    send_calibration();
+#else
   Serial.print(scale.get_units(), 4); //scale.get_units() returns a float
   Serial.print(",");
   Serial.print(calibration_factor);
   Serial.println();
+#endif
 
   if(Serial.available())
   {
@@ -58,7 +129,14 @@ void loop() {
       calibration_factor -= 10;
     else if (temp == 't')
       scale.tare();  //Assuming there is no weight on the scale at start up, reset the scale to 0
+
+    scale.set_scale(calibration_factor);
+#if BINARY_MODE
+    send_calibration();
+#endif
   }
 
+#if !BINARY_MODE
   delay(1);
+#endif
 }
@@ -0,0 +1,221 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import argparse
+import math
+import numpy as np
+from statistics import NormalDist
+
+#adaptive search for the brake current giving the most power, instead of a fixed grid.  a few coarse
+#points first, then a parabola through the ones around the best so far; its vertex is the estimate
+#of the peak, and the next setpoint is whichever candidate would shrink the uncertainty of that
+#vertex the most.  stops once the peak is known to +-tolerance at the given confidence.
+
+class AdaptivePeak():
+
+	def __init__(self, low = 1.0, high = 60.0, tolerance = 1.0, coarse = 5, max_runs = 15, confidence = 0.95, noise = 0.01, resolution = None):
+		self.low = low
+		self.high = high
+		self.tolerance = tolerance
+		#setpoints come out rounded to this, what the rig actually runs, so add() gets the same value
+		self.resolution = resolution
+		self.coarse = [self.snap(current) for current in np.linspace(low, high, coarse)]
+		self.max_runs = max_runs
+		self.z = NormalDist().inv_cdf((1 + confidence) / 2)
+		#relative to the best power, the least measurement noise assumed when there are too few
+		#points to tell from the residuals
+		self.noise = noise
+
+		self.x = []
+		self.y = []
+		self.reason = None
+
+	def snap(self, current):
+		if self.resolution is None:
+			return float(current)
+		return round(round(current / self.resolution) * self.resolution, 10)
+
+	def add(self, current, power):
+		#power None / nan for a setpoint that gave nothing usable (never settled, faulted)
+		self.x.append(float(current))
+		self.y.append(float('nan') if power is None else float(power))
+
+	def measured(self):
+		x = np.asarray(self.x)
+		y = np.asarray(self.y)
+		ok = np.isfinite(y)
+		return x[ok], y[ok]
+
+	def local(self, fraction = 0.6):
+		#the points near enough the top to look like a parabola: within fraction of the best power,
+		#or failing three of those, the best point and its nearest neighbours either side
+		x, y = self.measured()
+		if len(x) == 0:
+			return x, y
+		keep = y >= fraction * y.max()
+		if len(np.unique(x[keep])) >= 3:
+			return x[keep], y[keep]
+
+		distinct = np.unique(x)
+		best = np.searchsorted(distinct, x[np.argmax(y)])
+		lo = max(0, best - 1)
+		hi = min(len(distinct), lo + 3)
+		lo = max(0, hi - 3)
+		keep = (x >= distinct[lo]) & (x <= distinct[hi - 1])
+		return x[keep], y[keep]
+
+	def fit(self):
+		#(peak, standard deviation, fit) from the parabola, None if it doesn't have a maximum
+		#inside (or within tolerance of) the points it was fitted to
+		x, y = self.local()
+		if len(np.unique(x)) < 3:
+			return None
+
+		centre = x[np.argmax(y)]
+		X = np.column_stack([(x - centre) ** 2, x - centre, np.ones(len(x))])
+		coef, *_ = np.linalg.lstsq(X, y, rcond=None)
+		a, b, c = coef
+		if a >= 0:
+			return None
+		peak = centre - b / (2 * a)
+		if peak < max(x.min() - self.tolerance, self.low) or peak > min(x.max() + self.tolerance, self.high):
+			return None
+
+		residual = y - X @ coef
+		floor = self.noise * max(abs(y.max()), 1e-9)
+		sigma = max(math.sqrt((residual @ residual) / (len(x) - 3)) if len(x) > 3 else 0.0, floor)
+
+		information = X.T @ X
+		gradient = np.array([b / (2 * a * a), -1 / (2 * a), 0.0])
+		sd = math.sqrt(max(gradient @ np.linalg.pinv(information) @ gradient, 0.0)) * sigma
+		return (peak, sd, {'centre': centre, 'information': information, 'gradient': gradient, 'sigma': sigma})
+
+	def peak(self):
+		#best estimate so far: the vertex if there is one, otherwise the best measured point
+		f = self.fit()
+		if f is not None:
+			return (f[0], f[1])
+		x, y = self.measured()
+		if len(x) == 0:
+			return (None, math.inf)
+		return (x[np.argmax(y)], math.inf)
+
+	def bracket(self):
+		#the gap either side of the best measured point, the next point goes in the wider one
+		x, y = self.measured()
+		distinct = np.unique(np.concatenate([x, [self.low, self.high]]))
+		best = x[np.argmax(y)]
+		i = np.searchsorted(distinct, best)
+		left = distinct[i - 1] if i > 0 else best
+		right = distinct[i + 1] if i + 1 < len(distinct) else best
+		if right - best >= best - left:
+			return (best, right)
+		return (left, best)
+
+	def next(self):
+		#the next brake current to run, or None once done (self.reason says why)
+		tried = set(self.x)
+		for current in self.coarse:
+			if current not in tried:
+				return current
+
+		if len(self.x) >= self.max_runs:
+			self.reason = "run limit"
+			return None
+
+		x, y = self.measured()
+		if len(x) == 0:
+			self.reason = "no usable runs"
+			return None
+
+		f = self.fit()
+		if f is None:
+			#no vertex yet (peak at an edge, or not enough curvature): halve the bigger gap next to the best point
+			a, b = self.bracket()
+			if b - a <= self.tolerance:
+				self.reason = "bracketed"
+				return None
+			return self.snap((a + b) / 2)
+
+		peak, sd, detail = f
+		if self.z * sd <= self.tolerance:
+			self.reason = "converged"
+			return None
+
+		#where one more run would leave the vertex least uncertain
+		#kept to about where the parabola was fitted, it says little about anywhere further out
+		x, y = self.local()
+		low = max(self.low, x.min() - self.tolerance, peak - 2 * sd - self.tolerance)
+		high = min(self.high, x.max() + self.tolerance, peak + 2 * sd + self.tolerance)
+		candidates = np.linspace(low, high, 41)
+		failed = np.asarray([cx for cx, cy in zip(self.x, self.y) if not np.isfinite(cy)])
+		best = None
+		for candidate in candidates:
+			if len(failed) and np.min(np.abs(failed - candidate)) < self.tolerance / 2:
+				continue
+			row = np.array([(candidate - detail['centre']) ** 2, candidate - detail['centre'], 1.0])
+			g = detail['gradient']
+			variance = g @ np.linalg.pinv(detail['information'] + np.outer(row, row)) @ g
+			if best is None or variance < best[0]:
+				best = (variance, candidate)
+
+		if best is None:
+			self.reason = "no candidates left"
+			return None
+		return self.snap(best[1])
+
+	def run(self, measure):
+		#measure(current) -> power, until done
+		while True:
+			current = self.next()
+			if current is None:
+				return self.peak()
+			self.add(current, measure(current))
+
+def grid_peak(currents, powers):
+	#what the fixed sweep gives: the vertex through the best grid point and its neighbours
+	i = int(np.argmax(powers))
+	if 0 < i < len(currents) - 1:
+		x = np.asarray(currents[i - 1:i + 2], dtype=np.float64)
+		y = np.asarray(powers[i - 1:i + 2], dtype=np.float64)
+		a, b, c = np.polyfit(x, y, 2)
+		if a < 0:
+			return -b / (2 * a)
+	return currents[i]
+
+#the fixed brake current steps from test_generator_motor
+GRID = list(range(1, 10)) + list(range(10, 61, 5))
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Compare the adaptive peak search with the fixed sweep on the mppt.py generator model')
+	parser.add_argument('--flows', help='Comma separated water speeds to try (1.0 = the rig)', default='0.7,0.85,1.0,1.15,1.3')
+	parser.add_argument('--tolerance', help='Brake current tolerance on the peak (A)', type=float, default=1.0)
+	parser.add_argument('--noise', help='Relative noise on each measured power', type=float, default=0.01)
+	parser.add_argument('--max_runs', type=int, default=15)
+	parser.add_argument('--trials', help='Noisy repeats per flow', type=int, default=20)
+	parser.add_argument('--seed', type=int, default=0)
+
+	args = parser.parse_args()
+
+	from mppt import GeneratorModel
+	model = GeneratorModel()
+	rng = np.random.default_rng(args.seed)
+
+	def measure(flow, current):
+		w = model.equilibrium(flow, current)
+		return max(model.power(w, current), 0.0) * (1 + args.noise * rng.standard_normal())
+
+	print ("{:>6} {:>8} {:>16} {:>16} {:>6}".format("Flow", "Peak A", "Grid error A", "Adaptive err A", "Runs"))
+	for flow in [float(f) for f in args.flows.split(',')]:
+		truth = model.optimal_current(flow)
+		grid_errors = []
+		adaptive_errors = []
+		runs = []
+		for trial in range(args.trials):
+			grid_errors.append(abs(grid_peak(GRID, [measure(flow, c) for c in GRID]) - truth))
+			search = AdaptivePeak(GRID[0], GRID[-1], args.tolerance, max_runs = args.max_runs, noise = args.noise)
+			peak, sd = search.run(lambda current: measure(flow, current))
+			adaptive_errors.append(abs(peak - truth))
+			runs.append(len(search.x))
+		print ("{:>6.2f} {:>8.2f} {:>16.2f} {:>16.2f} {:>6.1f}".format(flow, truth, np.mean(grid_errors), np.mean(adaptive_errors), np.mean(runs)))
+	print ("Fixed grid: {} runs per flow".format(len(GRID)))
@@ -0,0 +1,140 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import pathlib
+import numpy as np
+import pandas as pd
+
+#puts the VESC run, the shunts and the load cell onto one common time base so they can be
+#compared sample for sample (efficiency from the shunts, drag vs wattage, ...).
+
+#source name -> prefix for its columns in the aligned frame
+SOURCES = {
+	'run': '',
+	'generator_shunt_data': 'Generator Shunt ',
+	'battery_shunt_data': 'Battery Shunt ',
+	'loadcell_data': 'Loadcell '
+}
+
+def to_seconds(t):
+	t = np.asarray(t)
+	if np.issubdtype(t.dtype, np.datetime64):
+		return t.astype('datetime64[ns]').astype(np.int64) / 1e9
+	return t.astype(np.float64)
+
+def resample(t, values, grid, tolerance):
+	#linear interpolation of every column onto grid.  grid points further than tolerance
+	#from the nearest real sample are NaN rather than made up.
+	order = np.argsort(t, kind='stable')
+	t = t[order]
+
+	idx = np.searchsorted(t, grid)
+	before = np.abs(grid - t[np.clip(idx - 1, 0, len(t) - 1)])
+	after = np.abs(t[np.clip(idx, 0, len(t) - 1)] - grid)
+	too_far = np.minimum(before, after) > tolerance
+
+	out = {}
+	for name, v in values.items():
+		v = np.asarray(v, dtype=np.float64)[order]
+		ok = np.isfinite(v)
+		if ok.sum() < 2:
+			out[name] = np.full(len(grid), np.nan)
+			continue
+		col = np.interp(grid, t[ok], v[ok], left=np.nan, right=np.nan)
+		col[too_far] = np.nan
+		out[name] = col
+	return out
+
+def estimate_offset(t_a, a, t_b, b, max_lag = 5.0, rate = 10.0):
+	#seconds to add to b's clock so it lines up best with a, by cross correlation
+	start = max(t_a.min(), t_b.min())
+	end = min(t_a.max(), t_b.max())
+	if end - start < 2 * max_lag:
+		return 0.0
+
+	grid = np.arange(start, end, 1.0 / rate)
+	x = np.interp(grid, t_a, a)
+	y = np.interp(grid, t_b, b)
+	x = x - x.mean()
+	y = y - y.mean()
+	if not x.any() or not y.any():
+		return 0.0
+
+	lags = int(max_lag * rate)
+	corr = np.correlate(x, y[lags:len(y) - lags], mode='valid')
+	return (np.argmax(corr) - lags) / rate
+
+def align(df, extras, rate = 10.0, tolerance = 1.0, offsets = None, auto_offset = False):
+	#df is the run (Time as datetime), extras the shunt / load cell frames from parse-stats.
+	#offsets are seconds added to each source's timestamps, auto_offset estimates the
+	#generator shunt's from its wattage against the generator VESC's.
+	offsets = dict(offsets or {})
+	sources = {'run': df}
+	sources.update(extras)
+
+	t_run = to_seconds(df.Time)
+	grid = np.arange(t_run.min(), t_run.max() + 0.5 / rate, 1.0 / rate)
+
+	shunt = extras.get('generator_shunt_data')
+	if auto_offset and shunt is not None and len(shunt) > 1 and 'generator_shunt_data' not in offsets:
+		offsets['generator_shunt_data'] = estimate_offset(t_run, df['Gen Wattage'].to_numpy(dtype=np.float64),
+			to_seconds(shunt.Time), shunt['Wattage'].to_numpy(dtype=np.float64))
+
+	columns = {}
+	for name, data in sources.items():
+		if data is None or len(data) < 2:
+			continue
+		t = to_seconds(data.Time) + offsets.get(name, 0.0)
+		values = {SOURCES.get(name, name + ' ') + col: data[col] for col in data.columns if col != 'Time'}
+		columns.update(resample(t, values, grid, tolerance))
+
+	aligned = pd.DataFrame(columns)
+	aligned.insert(0, 'Time', pd.to_datetime(grid, unit='s'))
+	aligned.attrs['offsets'] = offsets
+	return aligned
+
+def cache_filename(filename):
+	p = pathlib.Path(filename)
+	return str(p.parent / "aligned" / (p.stem + ".feather"))
+
+def write_frame(df, filename):
+	try:
+		df.to_feather(filename)
+	except ImportError:
+		#no pyarrow, fall back to something pandas can always do
+		df.to_pickle(filename)
+
+def read_frame(filename):
+	try:
+		return pd.read_feather(filename)
+	except Exception:
+		return pd.read_pickle(filename)
+
+def load_aligned(filename, df, extras, extras_files = (), rate = 10.0, tolerance = 1.0, offsets = None, auto_offset = False):
+	#aligned frame for a run, from the cache next to it if nothing it depends on has changed
+	cached = cache_filename(filename)
+	meta = cached + ".json"
+
+	key = {'rate': rate, 'tolerance': tolerance, 'offsets': offsets or {}, 'auto_offset': auto_offset, 'files': {}}
+	for f in [filename] + list(extras_files):
+		st = os.stat(f)
+		key['files'][os.path.basename(f)] = [st.st_size, st.st_mtime]
+	key = json.loads(json.dumps(key))
+
+	try:
+		with open(meta) as f:
+			if json.load(f) == key:
+				return read_frame(cached)
+	except (OSError, ValueError):
+		pass
+
+	aligned = align(df, extras, rate, tolerance, offsets, auto_offset)
+
+	pathlib.Path(cached).parent.mkdir(parents=True, exist_ok=True)
+	write_frame(aligned, cached)
+	with open(meta, "w") as f:
+		json.dump(key, f)
+
+	return aligned
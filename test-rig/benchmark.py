@@ -0,0 +1,317 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import argparse
+import csv
+import importlib.util
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+import numpy as np
+import simvesc
+
+#how fast the acquisition path is, on the rig or against simvesc.  results go to a json file
+#so a slower sample rate shows up when comparing with an earlier run (--baseline).
+
+here = os.path.dirname(os.path.realpath(__file__))
+
+#the Trampa V60s from thot-experiment.py
+DRIVER_UUID = 0x5300450011504d4143323520
+GENERATOR_UUID = 0x1b00420012504D4143323520
+
+def load_script(name):
+	#the experiment scripts have dashes in their names, so no plain import
+	spec = importlib.util.spec_from_file_location(name.replace('-', '_'), os.path.join(here, name + ".py"))
+	module = importlib.util.module_from_spec(spec)
+	spec.loader.exec_module(module)
+	return module
+
+def distribution(samples):
+	#summary of a list of durations, in milliseconds
+	a = np.asarray(samples, dtype=np.float64) * 1000
+	if len(a) == 0:
+		return {'count': 0}
+	return {
+		'count': len(a),
+		'mean': float(a.mean()),
+		'min': float(a.min()),
+		'p50': float(np.percentile(a, 50)),
+		'p90': float(np.percentile(a, 90)),
+		'p99': float(np.percentile(a, 99)),
+		'max': float(a.max()),
+		'histogram': [int(n) for n in np.histogram(a, bins=[0, 1, 2, 5, 10, 20, 50, 100, 200, 500, np.inf])[0]]
+	}
+
+def connect(VESC):
+	ports = [VESC.get_vesc_serial_port_by_uuid(uuid) for uuid in (DRIVER_UUID, GENERATOR_UUID)]
+	if None in ports:
+		raise RuntimeError("could not find both VESCs")
+	return [VESC(serial_port = port) for port in ports]
+
+def bench_latency(driver, generator, count = 1000):
+	#round trip of each command.  the set commands only ask for 0A / 0A brake, which is safe on the rig.
+	commands = {
+		'get_measurements': lambda m: m.get_measurements(),
+		'get_rpm': lambda m: m.get_rpm(),
+		'set_current': lambda m: m.set_current(0),
+		'set_brake_current': lambda m: m.set_brake_current(0)
+	}
+
+	results = {}
+	for name, motor in (('driver', driver), ('generator', generator)):
+		for command, call in commands.items():
+			times = []
+			timeouts = 0
+			for i in range(count):
+				start = time.perf_counter()
+				r = call(motor)
+				times.append(time.perf_counter() - start)
+				if command == 'get_measurements' and r is None:
+					timeouts += 1
+			d = distribution(times)
+			d['timeouts'] = timeouts
+			d['rate'] = count / sum(times) if sum(times) else 0
+			results[name + "." + command] = d
+	return results
+
+def bench_loops(thot, driver, generator, duration = 10):
+	#achieved sample rate of each test function, short runs into a scratch output/ directory
+	tests = {
+		'characterise_generator_at_rpm': lambda: thot.characterise_generator_at_rpm(driver, generator, 2000, 0, 5, duration),
+		'characterise_generator_at_brake_current': lambda: thot.characterise_generator_at_brake_current(driver, generator, 2, 1000, 3000, duration),
+		'characterise_generator_at_drive_current': lambda: thot.characterise_generator_at_drive_current(driver, generator, 3, 0, 2, duration),
+		'test_mppt': lambda: thot.test_mppt(driver, generator, 3, duration)
+	}
+
+	results = {}
+	for name, test in tests.items():
+		start = time.perf_counter()
+		r = test()
+		r['wall_time'] = time.perf_counter() - start
+		results[name] = r
+	return results
+
+def fake_measurements(i):
+	return SimpleNamespace(rpm = 7000 + i % 100, v_in = 48.0, avg_input_current = 3.0, temp_fet = 30.0, temp_motor = 30.0, mc_fault_code = 0)
+
+def bench_logger(thot, count = 50000):
+	#cost of logging one sample pair in ThotLogger, no serial involved
+	motor = SimpleNamespace(conf = SimpleNamespace(motor_poles = 14))
+	measurements = [fake_measurements(i) for i in range(100)]
+
+	thotlog = thot.ThotLogger("output/bench_logger.csv", "output/raw_bench_logger.bin")
+	start = time.perf_counter()
+	for i in range(count):
+		thotlog.new_log()
+		thotlog.log('target_rpm', 1000)
+		thotlog.log('brake_current', 5)
+		thotlog.log_motor(motor, 'gen', measurements[i % 100])
+		thotlog.log_motor(motor, 'drv', measurements[(i + 50) % 100])
+		thotlog.log_efficiency()
+		thotlog.write_raw_csv()
+	elapsed = time.perf_counter() - start
+	thotlog.close()
+
+	return {
+		'samples': count,
+		'per_sample_us': elapsed / count * 1e6,
+		'rate': count / elapsed,
+		'writer': thotlog.get_writer_stats()
+	}
+
+def bench_writers(count = 200000):
+	#rows/s through each way we write logs, all behind the BackgroundWriter
+	from writerthread import BackgroundWriter
+	from rawlog import RawLogWriter
+	from timeindex import IndexedCsv
+
+	names = {"c{}".format(i): "C{}".format(i) for i in range(15)}
+	row = [time.time()] + [float(i) for i in range(15)]
+
+	def csv_writer(filename):
+		f = open(filename, "w", newline='')
+		return csv.writer(f), f
+
+	def raw_writer(filename):
+		w = RawLogWriter(filename, names)
+		return w, w
+
+	def indexed_writer(filename):
+		w = IndexedCsv(filename, ["Time"] + list(names.values()))
+		return w, w
+
+	def parquet_writer(filename):
+		from columnstore import ParquetSink
+		w = ParquetSink(filename, "bench", "bench", ["Time"] + list(names.values()))
+		return w, w
+
+	writers = {'csv': (csv_writer, "bench.csv"), 'rawlog': (raw_writer, "bench.bin"), 'indexed_csv': (indexed_writer, "bench-indexed.csv")}
+	try:
+		import pyarrow
+		writers['parquet'] = (parquet_writer, "store")
+	except ImportError:
+		pass
+
+	results = {}
+	for name, (make, filename) in writers.items():
+		background = BackgroundWriter(max_rows = count + 1)
+		writer, f = make(os.path.join("output", filename))
+		queued = background.wrap(writer, f)
+
+		start = time.perf_counter()
+		for i in range(count):
+			queued.writerow(row)
+		queued_time = time.perf_counter() - start
+		background.close()
+		total = time.perf_counter() - start
+
+		stats = background.get_stats()
+		results[name] = {
+			'rows': count,
+			'enqueue_rate': count / queued_time,
+			'rate': stats['written'] / total,
+			'dropped': stats['dropped']
+		}
+	return results
+
+def bench_parse_stats(filenames, plots = ('voltage', 'wattage', 'amperage', 'rpm_vs_wattage', 'brake_current_vs_wattage')):
+	import matplotlib
+	matplotlib.use('Agg')
+	parse_stats = load_script('parse-stats')
+
+	results = {}
+	for filename in filenames:
+		start = time.perf_counter()
+		r = parse_stats.process_run((filename, {}, [(name, None) for name in plots], dict(parse_stats.options)))
+		results[os.path.basename(filename)] = {
+			'rows': r['rows'],
+			'load_time': r['load_time'],
+			'render_time': r['render_time'],
+			'total_time': time.perf_counter() - start
+		}
+	return results
+
+def git_revision():
+	try:
+		return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=here, capture_output=True, text=True).stdout.strip()
+	except OSError:
+		return None
+
+def compare(results, baseline, tolerance = 0.1):
+	#rates that dropped / times that grew by more than tolerance
+	regressions = []
+
+	def walk(new, old, path):
+		for key, value in new.items():
+			if key not in old:
+				continue
+			if isinstance(value, dict) and isinstance(old[key], dict):
+				walk(value, old[key], path + [key])
+			elif isinstance(value, (int, float)) and isinstance(old[key], (int, float)) and old[key]:
+				change = (value - old[key]) / abs(old[key])
+				if key.endswith('rate'):
+					worse = change < -tolerance
+				else:
+					worse = change > tolerance and (key.endswith('_time') or key in ('p50', 'p99', 'per_sample_us'))
+				if worse:
+					regressions.append(("/".join(path + [key]), old[key], value, change))
+
+	walk(results, baseline, [])
+	return regressions
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Benchmark the acquisition path')
+	simvesc.add_arguments(parser)
+	parser.add_argument('--out', help='Where to write the results', default='output/benchmark.json')
+	parser.add_argument('--baseline', help='Earlier results to compare against', default=None)
+	parser.add_argument('--only', help='Comma separated: latency,loops,logger,writers,parse_stats', default='latency,loops,logger,writers,parse_stats')
+	parser.add_argument('--count', help='Calls per command for the latency test', type=int, default=1000)
+	parser.add_argument('--duration', help='Seconds per test function in the loop test', type=float, default=10)
+
+	args = parser.parse_args()
+	only = args.only.split(',')
+
+	if args.sim:
+		VESC = simvesc.install(args.sim_speed, args.sim_latency, args.sim_timeouts, args.sim_faults)
+	else:
+		from pyvesc import VESC
+
+	thot = load_script('thot-experiment')
+	thot.VESC = VESC
+
+	results = {
+		'timestamp': time.time(),
+		'backend': 'sim' if args.sim else 'hardware',
+		'sim_speed': args.sim_speed if args.sim else None,
+		'host': platform.node(),
+		'python': platform.python_version(),
+		'revision': git_revision()
+	}
+
+	output = os.path.dirname(os.path.abspath(args.out))
+	os.makedirs(output, exist_ok=True)
+	scratch = tempfile.mkdtemp(prefix="benchmark-")
+	os.makedirs(os.path.join(scratch, "output"))
+	cwd = os.getcwd()
+	os.chdir(scratch)
+	driver = generator = None
+
+	try:
+		if 'latency' in only or 'loops' in only:
+			driver, generator = connect(VESC)
+
+		if 'latency' in only:
+			print ("Command latency...")
+			results['latency'] = bench_latency(driver, generator, args.count)
+
+		if 'loops' in only:
+			print ("Test loop rates...")
+			results['loops'] = bench_loops(thot, driver, generator, args.duration)
+
+		if 'logger' in only:
+			print ("ThotLogger overhead...")
+			results['logger'] = bench_logger(thot)
+
+		if 'writers' in only:
+			print ("Writer throughput...")
+			results['writers'] = bench_writers()
+
+		if 'parse_stats' in only:
+			print ("parse-stats load / render...")
+			runs = [r['filename'] for r in results.get('loops', {}).values()] or ["output/bench_logger.csv"]
+			results['parse_stats'] = bench_parse_stats([f for f in runs if os.path.isfile(f)])
+	finally:
+		os.chdir(cwd)
+		shutil.rmtree(scratch, ignore_errors=True)
+		for motor in (driver, generator):
+			if motor is not None:
+				motor.set_current(0)
+
+	with open(args.out, "w") as f:
+		json.dump(results, f, indent=2, default=float)
+
+	for name, d in results.get('latency', {}).items():
+		print ("{:<32} p50 {:6.2f}ms  p99 {:6.2f}ms  max {:7.2f}ms  {:7.0f}/s".format(name, d['p50'], d['p99'], d['max'], d['rate']))
+	for name, r in results.get('loops', {}).items():
+		print ("{:<40} {:7.1f} samples/s".format(name, r['rate']))
+	if 'logger' in results:
+		print ("ThotLogger: {:.1f}us per sample".format(results['logger']['per_sample_us']))
+	for name, r in results.get('writers', {}).items():
+		print ("{:<12} {:10.0f} rows/s".format(name, r['rate']))
+	for name, r in results.get('parse_stats', {}).items():
+		print ("{:<48} load {:.2f}s render {:.2f}s".format(name, r['load_time'], r['render_time']))
+	print ("Results in {}".format(args.out))
+
+	if args.baseline:
+		with open(args.baseline) as f:
+			regressions = compare(results, json.load(f))
+		for path, old, new, change in regressions:
+			print ("SLOWER {}: {:.4g} -> {:.4g} ({:+.0f}%)".format(path, old, new, change * 100))
+		if regressions:
+			sys.exit(1)
@@ -1,17 +1,23 @@
 #!/usr/bin/python3
 # -*- coding: utf-8 -*-
 
-from pyvesc import VESC
+import argparse
 import time
-import statistics
 from pprint import pprint
 import os
 import csv
 import traceback
 from pathlib import Path
-import subprocess
+from ringstats import RingStats
+from rawlog import RawLogWriter
+from writerthread import BackgroundWriter
+from recorder import Recorder
 import serial
 import serial.tools.list_ports
+import simvesc
+
+#pyvesc.VESC, or simvesc.SimVESC with --sim (pyvesc isn't needed then)
+VESC = None
 
 def test_generator_motor():
 	try:
@@ -35,16 +41,13 @@ def test_generator_motor():
 		#where so save our csv
 		Path("output").mkdir(parents=True, exist_ok=True)
 
+		#shunts get read in the background, in this process
 		dir_path = os.path.dirname(os.path.realpath(__file__))
-		smartshunt_script = dir_path + "/smartshunt.py"
-		
-		battery_shunt_params = [smartshunt_script,"--serial", "VE4YC71B", "--csv", "{}/output/shunt-battery.csv".format(dir_path)]
-		print(" ".join(battery_shunt_params))
-		battery_shunt_proc = subprocess.Popen(battery_shunt_params, stdout=subprocess.DEVNULL)
-		
-		generator_shunt_params = [smartshunt_script,"--serial", "VE4X8ER8", "--csv", "{}/output/shunt.csv".format(dir_path)]
-		print(" ".join(generator_shunt_params))
-		generator_shunt_proc = subprocess.Popen(generator_shunt_params, stdout=subprocess.DEVNULL)
+		recorder = Recorder(dir_path + "/output")
+		if VESC is not simvesc.SimVESC:
+			recorder.add_shunt("shunt-battery", "VE4YC71B")
+			recorder.add_shunt("shunt", "VE4X8ER8")
+		recorder.start()
 		
 		try:
 			test_duration = 30
@@ -70,8 +73,7 @@ def test_generator_motor():
 	# Turn Off the VESC
 	generator.set_current(0)
 	generator.stop_heartbeat()
-	battery_shunt_proc.terminate()
-	generator_shunt_proc.terminate()
+	recorder.stop()
 
 class ThotLogger():
 
@@ -86,6 +88,10 @@ class ThotLogger():
 	}
 
 	def __init__(self, csv_filename, raw_filename):
+		self.csv_filename = csv_filename
+		self.raw_filename = raw_filename
+		self.rows = 0
+		self.stats = RingStats(self.names.keys())
 		self.new_log()
 		self.clear_averages()
 
@@ -94,11 +100,53 @@ class ThotLogger():
 		
 		header = ['Time']
 		header += self.names.values()
-		self.csv_writer.writerow(header)
 
-		self.raw_file = open(raw_filename, "w", newline='')
-		self.raw_writer = csv.writer(self.raw_file)
-		self.raw_writer.writerow(header)
+		#the averages also get the spread of each channel
+		avg_header = header + [label + " StdDev" for label in self.names.values()]
+		self.csv_writer.writerow(avg_header)
+
+		#raw samples go to a binary log unless a csv was asked for
+		if raw_filename.endswith('.csv'):
+			self.raw_file = open(raw_filename, "w", newline='')
+			self.raw_writer = csv.writer(self.raw_file)
+			self.raw_writer.writerow(header)
+		else:
+			self.raw_writer = RawLogWriter(raw_filename, self.names)
+			self.raw_file = self.raw_writer
+
+		#from here on rows are written by a background thread
+		self.writer = BackgroundWriter()
+		self.csv_writer = self.writer.wrap(self.csv_writer, self.csv_file)
+		self.raw_writer = self.writer.wrap(self.raw_writer, self.raw_file)
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
+
+	def close(self):
+		self.writer.close()
+
+		stats = self.writer.get_stats()
+		if stats['dropped']:
+			print ("Dropped {} of {} rows (max queue depth {})".format(stats['dropped'], stats['written'] + stats['dropped'], stats['max_depth']))
+
+	def get_writer_stats(self):
+		return self.writer.get_stats()
+
+	def results(self, start_time, samples):
+		#what a test function hands back: where its data went and how fast it sampled
+		duration = time.time() - start_time
+		return {
+			'filename': self.csv_filename,
+			'raw_filename': self.raw_filename,
+			'samples': samples,
+			'rows': self.rows,
+			'duration': duration,
+			'rate': self.rows / duration if duration > 0 else 0,
+			'writer': self.get_writer_stats()
+		}
 
 	def log_motor(self, motor, mt = 'gen'):
 		measurements = motor.get_measurements()
@@ -130,20 +178,26 @@ class ThotLogger():
 
 	def log(self, name, value):
 		self.lastlog[name] = value;
-		if name not in self.averages:
-			self.averages[name] = []
-		self.averages[name].append(value)
+		self.stats.push(name, value)
 		return
 		
 	def get_averages(self):
 		rvals = {}
-		for key, avg_array in self.averages.items():
-			if avg_array:
-				avg = statistics.mean(avg_array)
-			else:
-				#todo: make this support being None
-				avg = 0
-			rvals[key] = avg
+		for key in self.stats.names:
+			rvals[key] = self.stats.mean(key)
+
+		return rvals
+
+	def get_stats(self):
+		rvals = {}
+		for key in self.stats.names:
+			rvals[key] = {
+				'mean': self.stats.mean(key),
+				'min': self.stats.min(key),
+				'max': self.stats.max(key),
+				'stddev': self.stats.stddev(key),
+				'count': self.stats.count(key)
+			}
 
 		return rvals
 
@@ -152,11 +206,13 @@ class ThotLogger():
 		row = [date_string]
 		row += self.lastlog.values()
 		self.raw_writer.writerow(row)
+		self.rows += 1
 	
 	def write_avg_csv(self):
 		date_string = time.time()
 		row = [date_string]
 		row += self.get_averages().values()
+		row += [self.stats.stddev(key) for key in self.names.keys()]
 		self.csv_writer.writerow(row)
 
 	def print_line(self, vals = None):
@@ -179,9 +235,7 @@ class ThotLogger():
 			self.lastlog[key] = None
 		
 	def clear_averages(self):
-		self.averages = {}
-		for key in self.names.keys():
-			self.averages[key] = []
+		self.stats.reset()
 
 def wait_for_motor_temp(motor, temperature = 46):
 
@@ -207,7 +261,7 @@ def characterise_generator_at_brake_current(generator, test_current, test_durati
 
 	if filename is None:
 		filename = "output/generator_current_{:.0f}a_{:.0f}s.csv".format(test_current, test_duration)
-		raw_filename = "output/raw_generator_current_{:.0f}a_{:.0f}s.csv".format(test_current, test_duration)
+		raw_filename = "output/raw_generator_current_{:.0f}a_{:.0f}s.bin".format(test_current, test_duration)
 	
 	thotlog = ThotLogger(filename, raw_filename)
 	
@@ -221,40 +275,54 @@ def characterise_generator_at_brake_current(generator, test_current, test_durati
 	next_display_time = start_time + 0.5
 	samples = 0
 	
-	while time.time() <= end_time:
-		try:
-			thotlog.new_log()
+	try:
+		while time.time() <= end_time:
+			try:
+				thotlog.new_log()
 
-			thotlog.log('brake_current', test_current)
-			thotlog.log_motor(generator, 'gen')
+				thotlog.log('brake_current', test_current)
+				thotlog.log_motor(generator, 'gen')
 			
-			thotlog.write_raw_csv()
+				thotlog.write_raw_csv()
 
-			#do we want to display it?
-			if time.time() > next_display_time:
-				avg = thotlog.get_averages()
-				thotlog.print_line()
-				thotlog.write_avg_csv()
-				thotlog.clear_averages()
+				#do we want to display it?
+				if time.time() > next_display_time:
+					avg = thotlog.get_averages()
+					thotlog.print_line()
+					thotlog.write_avg_csv()
+					thotlog.clear_averages()
 
-				next_display_time = time.time() + 0.25
+					next_display_time = time.time() + 0.25
 				
-				#if we hit the end of the power curve, exit
-				if avg['gen_wattage'] < 0 and time.time() - start_time > test_duration/2:
-					print ("End of power curve.")					
-					break
-
-			samples += 1
-
-			#okay, write it to our csv...
-		except AttributeError as e:
-			print (e)
-			continue
-					
+					#if we hit the end of the power curve, exit
+					if avg['gen_wattage'] < 0 and time.time() - start_time > test_duration/2:
+						print ("End of power curve.")					
+						break
+
+				samples += 1
+
+				#okay, write it to our csv...
+			except AttributeError as e:
+				print (e)
+				continue
+	finally:
+		thotlog.close()
+
 	#turn it off
 	generator.set_brake_current(0)
 
 	print ("Finished test with {} samples.".format(samples))
+	return thotlog.results(start_time, samples)
 
 if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Generator tests on the boat')
+	simvesc.add_arguments(parser)
+	parser.add_argument('--sim_flow', help='Simulated water speed, 1.0 = about what the rig drives', type=float, default=1.0)
+	args = parser.parse_args()
+
+	if args.sim:
+		VESC = simvesc.install(args.sim_speed, args.sim_latency, args.sim_timeouts, args.sim_faults, flow = args.sim_flow)
+	else:
+		from pyvesc import VESC
+
 	test_generator_motor()
\ No newline at end of file
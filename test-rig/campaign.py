@@ -0,0 +1,317 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import argparse
+import hashlib
+import itertools
+import json
+import os
+import time
+import traceback
+import zlib
+from pathlib import Path
+from benchmark import load_script
+from recorder import Recorder
+import simvesc
+
+#test campaigns as data instead of a for loop in test_generator_motor.  a campaign is a json file of
+#steps (a thot-experiment.py test function and its arguments), run with an append-only journal
+#next to the output: every step's start, finish or failure, its output files and their checksums.
+#a failed step is retried after reconnecting to the VESCs by uuid, and running the campaign again
+#skips everything the journal says finished (as long as the files are still what was written).
+#
+#	{
+#		"name": "brake-current-sweep",
+#		"driver_uuid": "0x5300450011504d4143323520",
+#		"generator_uuid": "0x1b00420012504D4143323520",
+#		"shunts": {"battery-shunt": "VE4X8ER8", "generator-shunt": "VE4YC71B"},
+#		"loadcell": "7583033303835111E012",
+#		"max_error_fraction": 0.05,
+#		"steps": [
+#			{"test": "characterise_generator_at_brake_current", "args": {"start_rpm": 500, "end_rpm": 3000, "test_duration": 30},
+#			 "vary": {"test_current": [1, 2, 3, 4, 5]}}
+#		]
+#	}
+#
+#"vary" expands one entry into a step per combination of the listed values.  a step also counts as
+#failed if it recorded nothing, or if missed samples + poll errors come to more than
+#"max_error_fraction" of its polls (default MAX_ERROR_FRACTION).  a few retried polls on a lossy
+#link still leave complete data, a dead port doesn't.
+
+MAX_ERROR_FRACTION = 0.05
+
+def expand(entry):
+	args = entry.get('args', {})
+	vary = entry.get('vary', {})
+	names = list(vary.keys())
+	for values in itertools.product(*[vary[name] for name in names]):
+		step = {'test': entry['test'], 'args': dict(args)}
+		step['args'].update(zip(names, values))
+		yield step
+
+def step_id(step):
+	#from what the step does, not where it is, so editing the campaign keeps finished steps finished
+	canonical = json.dumps({'test': step['test'], 'args': step['args']}, sort_keys=True)
+	return hashlib.sha1(canonical.encode()).hexdigest()[:12]
+
+def load_campaign(filename):
+	with open(filename) as f:
+		campaign = json.load(f)
+	campaign.setdefault('name', Path(filename).stem)
+	steps = []
+	for entry in campaign['steps']:
+		for step in expand(entry):
+			step['id'] = step_id(step)
+			steps.append(step)
+	campaign['steps'] = steps
+	return campaign
+
+def checksum(filename):
+	h = hashlib.sha256()
+	with open(filename, "rb") as f:
+		for block in iter(lambda: f.read(1 << 20), b""):
+			h.update(block)
+	return h.hexdigest()
+
+class Journal():
+
+	#one json record per line, each with a crc of the rest of the line.  only ever appended to and
+	#fsynced after every record; a line torn by a crash fails its crc and is ignored.
+
+	def __init__(self, filename):
+		self.filename = filename
+		self.records = self.read()
+		self.file = open(filename, "a")
+		#a record torn off by a crash must not run into the next one
+		if self.file.tell() > 0:
+			with open(filename, "rb") as f:
+				f.seek(-1, os.SEEK_END)
+				if f.read(1) != b"\n":
+					self.file.write("\n")
+
+	def read(self):
+		records = []
+		if not os.path.isfile(self.filename):
+			return records
+		with open(self.filename) as f:
+			for number, line in enumerate(f, 1):
+				try:
+					record = json.loads(line)
+					crc = record.pop('crc')
+					if crc != zlib.crc32(json.dumps(record, sort_keys=True).encode()):
+						raise ValueError("bad crc")
+				except (ValueError, KeyError) as e:
+					print ("Journal {} line {} ignored: {}".format(self.filename, number, e))
+					continue
+				records.append(record)
+		return records
+
+	def append(self, **record):
+		record['time'] = time.time()
+		line = json.dumps(record, sort_keys=True)
+		record['crc'] = zlib.crc32(line.encode())
+		self.file.write(json.dumps(record, sort_keys=True) + "\n")
+		self.file.flush()
+		os.fsync(self.file.fileno())
+		del record['crc']
+		self.records.append(record)
+
+	def close(self):
+		self.file.close()
+
+	def last(self):
+		#latest record of every step
+		state = {}
+		for record in self.records:
+			if 'step' in record:
+				state[record['step']] = record
+		return state
+
+	def finished(self, step):
+		#done, and every file it wrote still has the checksum it had then
+		record = self.last().get(step['id'])
+		if record is None or record['status'] != 'done':
+			return False
+		for filename, digest in record.get('files', {}).items():
+			if not os.path.isfile(filename) or checksum(filename) != digest:
+				print ("{} changed or missing, step {} will run again".format(filename, step['id']))
+				return False
+		return True
+
+class CampaignRunner():
+
+	def __init__(self, campaign, journal, thot, VESC, retries = 2, reconnect_timeout = 60):
+		self.campaign = campaign
+		self.journal = journal
+		self.thot = thot
+		self.VESC = VESC
+		self.retries = retries
+		self.reconnect_timeout = reconnect_timeout
+		self.driver = None
+		self.generator = None
+		self.recorder = None
+
+	def connect(self):
+		#find both VESCs by uuid, waiting a while for a USB port that dropped out to come back
+		deadline = time.time() + self.reconnect_timeout
+		while True:
+			driver_port = self.VESC.get_vesc_serial_port_by_uuid(int(self.campaign.get('driver_uuid', '0x5300450011504d4143323520'), 16))
+			generator_port = self.VESC.get_vesc_serial_port_by_uuid(int(self.campaign.get('generator_uuid', '0x1b00420012504D4143323520'), 16))
+			if driver_port and generator_port:
+				break
+			if time.time() > deadline:
+				raise RuntimeError("could not find both VESCs")
+			print ("Waiting for the VESCs...")
+			time.sleep(2)
+
+		self.driver = self.VESC(serial_port = driver_port)
+		self.generator = self.VESC(serial_port = generator_port)
+		print ("Connected: driver {}, generator {}".format(driver_port, generator_port))
+
+	def disconnect(self):
+		for motor in (self.driver, self.generator):
+			if motor is None:
+				continue
+			try:
+				motor.set_current(0)
+			except Exception:
+				pass
+			try:
+				motor.stop_heartbeat()
+				if hasattr(motor.serial_port, 'close'):
+					motor.serial_port.close()
+			except Exception:
+				pass
+		self.driver = None
+		self.generator = None
+
+	def start_recorder(self):
+		Path("output").mkdir(parents=True, exist_ok=True)
+		self.recorder = Recorder("output")
+		if self.VESC is not simvesc.SimVESC:
+			for name, serial_number in self.campaign.get('shunts', {}).items():
+				self.recorder.add_shunt(name, serial_number)
+			if self.campaign.get('loadcell'):
+				self.recorder.add_loadcell("loadcell", self.campaign['loadcell'])
+		self.recorder.start()
+		self.thot.recorder = self.recorder
+
+	def stop_recorder(self):
+		if self.recorder is not None:
+			self.recorder.stop()
+			self.recorder = None
+			self.thot.recorder = None
+
+	def run_step(self, step):
+		results = getattr(self.thot, step['test'])(self.driver, self.generator, **step['args'])
+
+		#a test that ran its time out on a dead connection returns normally, but isn't done
+		if isinstance(results, dict):
+			if results.get('rows') == 0:
+				raise IOError("no rows recorded")
+			missed = results.get('missed', 0)
+			errors = results.get('poll_errors', 0)
+			polls = results.get('rows', 0) + missed
+			if polls and (missed + errors) / polls > self.campaign.get('max_error_fraction', MAX_ERROR_FRACTION):
+				raise IOError("{} missed samples, {} poll errors in {} polls".format(missed, errors, polls))
+
+		files = {}
+		if isinstance(results, dict):
+			for key in ('filename', 'raw_filename'):
+				if results.get(key) and os.path.isfile(results[key]):
+					files[results[key]] = checksum(results[key])
+		return results, files
+
+	def run(self):
+		steps = [step for step in self.campaign['steps'] if not self.journal.finished(step)]
+		print ("Campaign {}: {} steps, {} left".format(self.campaign['name'], len(self.campaign['steps']), len(steps)))
+		if not steps:
+			return True
+
+		self.journal.append(event = 'resume' if self.journal.records else 'start', campaign = self.campaign['name'], remaining = len(steps))
+		failed = []
+		try:
+			self.start_recorder()
+			self.connect()
+			for number, step in enumerate(steps, 1):
+				for attempt in range(self.retries + 1):
+					print ("[{}/{}] {} {}".format(number, len(steps), step['test'], step['args']))
+					self.journal.append(step = step['id'], status = 'started', test = step['test'], args = step['args'], attempt = attempt)
+					try:
+						results, files = self.run_step(step)
+					except KeyboardInterrupt:
+						raise
+					except Exception as e:
+						traceback.print_exc()
+						self.journal.append(step = step['id'], status = 'failed', error = "{}: {}".format(type(e).__name__, e), attempt = attempt)
+						#whatever it was (fault code, usb), start the next attempt from a fresh connection
+						self.disconnect()
+						self.connect()
+						continue
+
+					summary = {key: results[key] for key in ('samples', 'rows', 'duration', 'rate', 'missed', 'poll_errors', 'settled') if isinstance(results, dict) and key in results}
+					self.journal.append(step = step['id'], status = 'done', files = files, results = summary, attempt = attempt)
+					break
+				else:
+					failed.append(step)
+					print ("Giving up on {} for now, the next run will try it again".format(step['id']))
+
+				time.sleep(0.5)
+
+		except KeyboardInterrupt:
+			self.journal.append(event = 'interrupted')
+			print ("Interrupted, run the campaign again to carry on")
+			return False
+		except Exception as e:
+			#the VESCs didn't come back, nothing more we can do this run
+			traceback.print_exc()
+			self.journal.append(event = 'aborted', error = "{}: {}".format(type(e).__name__, e))
+			return False
+		finally:
+			self.disconnect()
+			self.stop_recorder()
+
+		self.journal.append(event = 'finished', failed = [step['id'] for step in failed])
+		return not failed
+
+	def status(self):
+		state = self.journal.last()
+		for step in self.campaign['steps']:
+			record = state.get(step['id'])
+			status = record['status'] if record else '-'
+			if status == 'done' and not self.journal.finished(step):
+				status = 'changed'
+			print ("{} {:<8} {} {}".format(step['id'], status, step['test'], step['args']))
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Run (or carry on with) a test campaign')
+	parser.add_argument('campaign', help='Campaign json file')
+	parser.add_argument('--journal', help='Journal file, output/<campaign name>.journal.jsonl by default', default=None)
+	parser.add_argument('--retries', help='Attempts at a failing step after the first, per run', type=int, default=2)
+	parser.add_argument('--status', dest='status', action='store_true', help='Show where the campaign is up to and exit')
+	parser.set_defaults(status=False)
+	simvesc.add_arguments(parser)
+
+	args = parser.parse_args()
+
+	campaign = load_campaign(args.campaign)
+	Path("output").mkdir(parents=True, exist_ok=True)
+	journal = Journal(args.journal or os.path.join("output", campaign['name'] + ".journal.jsonl"))
+
+	if args.sim:
+		VESC = simvesc.install(args.sim_speed, args.sim_latency, args.sim_timeouts, args.sim_faults)
+	elif not args.status:
+		from pyvesc import VESC
+	else:
+		VESC = None
+
+	thot = load_script('thot-experiment')
+	thot.VESC = VESC
+
+	runner = CampaignRunner(campaign, journal, thot, VESC, args.retries)
+	if args.status:
+		runner.status()
+	else:
+		ok = runner.run()
+		journal.close()
+		raise SystemExit(0 if ok else 1)
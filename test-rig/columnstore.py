@@ -0,0 +1,232 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import argparse
+import glob
+import os
+import pathlib
+import re
+import time
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+#typed, compressed parquet files for everything the rig records, laid out as
+#	<store>/run=<run>/instrument=<instrument>/part-00000.parquet
+#parquet keeps min / max statistics for every column of every row group, so a time filter
+#only touches the row groups that overlap it.  Time is epoch seconds like in the csv files.
+
+ROW_GROUP_SIZE = 10000
+ROWS_PER_PART = 200000
+#seconds, a slow instrument (a shunt at 1Hz) would otherwise keep hours of rows in an unfinished part
+FLUSH_INTERVAL = 60.0
+
+def run_name(name):
+	#partition values end up in directory names
+	return re.sub(r'[^A-Za-z0-9_.-]+', '_', str(name))
+
+class ParquetSink():
+
+	#row at a time writer, same calls as csv.writer so it can sit behind BackgroundWriter.
+	#rows are buffered into row groups and the part file is finished (footer and all) every
+	#ROWS_PER_PART rows or FLUSH_INTERVAL seconds, whichever comes first, so a crash costs at most
+	#the rows of the last FLUSH_INTERVAL.
+
+	def __init__(self, store, run, instrument, columns, row_group_size = ROW_GROUP_SIZE, rows_per_part = ROWS_PER_PART, flush_interval = FLUSH_INTERVAL):
+		self.directory = os.path.join(store, "run=" + run_name(run), "instrument=" + run_name(instrument))
+		pathlib.Path(self.directory).mkdir(parents=True, exist_ok=True)
+
+		self.columns = list(columns)
+		self.schema = pa.schema([(name, pa.float64()) for name in self.columns])
+		self.row_group_size = row_group_size
+		self.rows_per_part = rows_per_part
+		self.flush_interval = flush_interval
+
+		self.pending = []
+		self.part = len(glob.glob(os.path.join(self.directory, "part-*.parquet")))
+		self.part_rows = 0
+		self.file = None
+		self.writer = None
+		#when the oldest row not yet in a finished part came in
+		self.started = None
+		#for fsync between parts, see fileno()
+		self.directory_fd = None
+
+	def open_part(self):
+		filename = os.path.join(self.directory, "part-{:05d}.parquet".format(self.part))
+		self.file = open(filename, "wb")
+		self.writer = pq.ParquetWriter(self.file, self.schema, compression='zstd')
+		self.part += 1
+		self.part_rows = 0
+
+	def close_part(self):
+		if self.writer is not None:
+			self.writer.close()
+			self.file.close()
+			self.writer = None
+			self.file = None
+		self.started = None
+
+	def due(self):
+		return self.started is not None and time.monotonic() - self.started >= self.flush_interval
+
+	def write_group(self):
+		if not self.pending:
+			return
+
+		if self.writer is None:
+			self.open_part()
+
+		columns = list(zip(*self.pending))
+		arrays = [pa.array([None if v is None or v == '' else float(v) for v in col], type=pa.float64()) for col in columns]
+		self.writer.write_table(pa.Table.from_arrays(arrays, schema=self.schema), row_group_size=self.row_group_size)
+
+		self.part_rows += len(self.pending)
+		self.pending = []
+
+		if self.part_rows >= self.rows_per_part or self.due():
+			self.close_part()
+
+	def writerow(self, row):
+		if self.started is None:
+			self.started = time.monotonic()
+		self.pending.append(row)
+		if len(self.pending) >= self.row_group_size or self.due():
+			self.write_group()
+
+	def writerows(self, rows):
+		for row in rows:
+			self.writerow(row)
+
+	def write_table(self, table):
+		#bulk path for the migration, skips the row buffer
+		if self.writer is None:
+			self.open_part()
+		self.writer.write_table(table.select(self.columns).cast(self.schema), row_group_size=self.row_group_size)
+		self.part_rows += table.num_rows
+		if self.part_rows >= self.rows_per_part:
+			self.close_part()
+
+	def flush(self):
+		#a parquet file is only readable once its footer is written, so flushing means finishing
+		#the part, which only happens once it is due.  until then just push out what's written.
+		if self.due():
+			self.write_group()
+			self.close_part()
+		elif self.file is not None:
+			self.file.flush()
+
+	def fileno(self):
+		#for BackgroundWriter's fsync: the part being written, or between parts the directory,
+		#which makes the finished parts' directory entries durable.  never starts a part.
+		if self.file is not None:
+			return self.file.fileno()
+		if self.directory_fd is None:
+			self.directory_fd = os.open(self.directory, os.O_RDONLY)
+		return self.directory_fd
+
+	def close(self):
+		self.write_group()
+		self.close_part()
+		if self.directory_fd is not None:
+			os.close(self.directory_fd)
+			self.directory_fd = None
+
+PARTITIONING = ds.partitioning(pa.schema([('run', pa.string()), ('instrument', pa.string())]), flavor='hive')
+
+def part_files(store, instrument = '*', run = '*'):
+	pattern = os.path.join(store, "run=" + (run if run == '*' else run_name(run)), "instrument=" + instrument, "part-*.parquet")
+	return sorted(glob.glob(pattern))
+
+def dataset(store, instrument = '*', run = '*'):
+	#runs can have different columns (old logs, the boat tester), so take the union of them
+	files = part_files(store, instrument, run)
+	if not files:
+		return None
+	schema = pa.unify_schemas([pq.read_schema(f) for f in files])
+	return ds.dataset(files, schema=schema, format='parquet', partitioning=PARTITIONING, partition_base_dir=store)
+
+def read(store, instrument, columns = None, start_time = None, end_time = None, run = None):
+	#only the requested columns, and only row groups that overlap the time window get read
+	d = dataset(store, instrument, '*' if run is None else run)
+	if d is None:
+		return pd.DataFrame()
+
+	expr = None
+	if start_time is not None:
+		expr = ds.field('Time') >= start_time
+	if end_time is not None:
+		e = ds.field('Time') <= end_time
+		expr = e if expr is None else expr & e
+
+	if columns is not None:
+		columns = [name for name in d.schema.names if name == 'Time' or name in columns]
+	else:
+		columns = [name for name in d.schema.names if name not in ('run', 'instrument')]
+
+	df = d.to_table(columns=columns, filter=expr).to_pandas()
+	if 'Time' in df:
+		df = df.sort_values('Time', kind='stable').reset_index(drop=True)
+	return df
+
+def runs(store, instrument = '*'):
+	return sorted(set(pathlib.Path(f).parent.parent.name[len("run="):] for f in part_files(store, instrument)))
+
+#legacy output/ files -> (run, instrument)
+def classify(filename):
+	stem = pathlib.Path(filename).stem
+	if stem in ('battery-shunt', 'generator-shunt', 'loadcell', 'shunt', 'shunt-battery', 'generator-vesc', 'driver-vesc'):
+		return ('legacy', stem)
+	if stem.startswith('raw_'):
+		return (stem[4:], 'vesc-raw')
+	return (stem, 'vesc-avg')
+
+def migrate(filenames, store, chunksize = 200000):
+	from rawlog import read_dataframe
+
+	for filename in filenames:
+		start = time.time()
+		run, instrument = classify(filename)
+
+		if filename.endswith('.bin'):
+			chunks = [read_dataframe(filename)]
+		else:
+			header = pd.read_csv(filename, nrows=0).columns
+			chunks = pd.read_csv(filename, chunksize=chunksize, dtype={name: 'float64' for name in header})
+
+		sink = None
+		rows = 0
+		for chunk in chunks:
+			if sink is None:
+				sink = ParquetSink(store, run, instrument, chunk.columns)
+			sink.write_table(pa.Table.from_pandas(chunk, preserve_index=False))
+			rows += len(chunk)
+		if sink is not None:
+			sink.close()
+
+		print ("{} -> run={} instrument={}: {} rows in {:.1f}s".format(filename, run_name(run), instrument, rows, time.time() - start))
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Parquet session store')
+	parser.add_argument('--store', help='Store directory', default='output/store')
+	sub = parser.add_subparsers(dest='command')
+
+	p = sub.add_parser('migrate', help='Copy existing csv / raw logs into the store')
+	p.add_argument('filenames', nargs='+', help='Files to migrate (wildcards ok)')
+
+	p = sub.add_parser('runs', help='List the runs in the store')
+	p.add_argument('--instrument', default='*')
+
+	args = parser.parse_args()
+
+	if args.command == 'migrate':
+		filenames = []
+		for pattern in args.filenames:
+			filenames += [f for f in sorted(glob.glob(pattern)) if f.endswith('.csv') or f.endswith('.bin')]
+		migrate(filenames, args.store)
+	elif args.command == 'runs':
+		for run in runs(args.store, args.instrument):
+			print (run)
+	else:
+		parser.print_help()
@@ -0,0 +1,89 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+#downsampling for long time series before they go to matplotlib.  both methods return the
+#indexes of the points to keep, so the caller can pick them out of any x type (datetimes too).
+
+def as_float(x):
+	x = np.asarray(x)
+	if np.issubdtype(x.dtype, np.datetime64):
+		return x.astype('datetime64[ns]').astype(np.int64).astype(np.float64)
+	return x.astype(np.float64)
+
+def target_points(ax, dpi = None):
+	#one point per horizontal pixel of the axes in the saved image
+	fig = ax.figure
+	if dpi is None:
+		dpi = fig.dpi
+	return max(int(fig.get_figwidth() * dpi * ax.get_position().width), 10)
+
+def lttb(x, y, n):
+	#largest triangle three buckets: keeps the first and last point, and from every bucket in
+	#between the point making the biggest triangle with the previous pick and the next bucket's mean
+	length = len(x)
+	if n >= length or n < 3:
+		return np.arange(length)
+
+	x = as_float(x)
+	y = np.asarray(y, dtype=np.float64)
+
+	edges = np.linspace(1, length - 1, n - 1).astype(np.int64)
+	keep = np.empty(n, dtype=np.int64)
+	keep[0] = 0
+	keep[-1] = length - 1
+
+	#mean of every bucket up front, for the "next bucket" corner of the triangle
+	counts = np.diff(edges)
+	mean_x = np.add.reduceat(x[:length - 1], edges[:-1]) / counts
+	mean_y = np.add.reduceat(y[:length - 1], edges[:-1]) / counts
+	mean_x = np.append(mean_x, x[-1])
+	mean_y = np.append(mean_y, y[-1])
+
+	a = 0
+	for i in range(n - 2):
+		start = edges[i]
+		end = edges[i + 1]
+		bx = x[start:end]
+		by = y[start:end]
+		area = np.abs((x[a] - mean_x[i + 1]) * (by - y[a]) - (x[a] - bx) * (mean_y[i + 1] - y[a]))
+		a = start + int(np.nanargmax(area)) if np.isfinite(area).any() else start
+		keep[i + 1] = a
+
+	return keep
+
+def minmax(x, y, n):
+	#min and max of each of n/2 buckets, in time order.  keeps every spike.
+	length = len(y)
+	buckets = n // 2
+	if buckets < 1 or length <= n:
+		return np.arange(length)
+
+	y = np.asarray(y, dtype=np.float64)
+	size = length // buckets
+	full = size * buckets
+
+	#nan never wins a min / max
+	lo = np.where(np.isnan(y), np.inf, y)
+	hi = np.where(np.isnan(y), -np.inf, y)
+
+	offsets = np.arange(buckets) * size
+	mins = offsets + lo[:full].reshape(buckets, size).argmin(axis=1)
+	maxs = offsets + hi[:full].reshape(buckets, size).argmax(axis=1)
+
+	keep = [mins, maxs]
+	if full < length:
+		keep.append([full + lo[full:].argmin(), full + hi[full:].argmax()])
+
+	return np.unique(np.concatenate(keep))
+
+METHODS = {
+	'lttb': lttb,
+	'minmax': minmax
+}
+
+def decimate(x, y, n, method = 'lttb'):
+	if method is None or method == 'none':
+		return np.arange(len(y))
+	return METHODS[method](x, y, n)
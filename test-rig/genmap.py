@@ -0,0 +1,226 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import argparse
+import glob
+import numpy as np
+import pandas as pd
+from scipy.ndimage import gaussian_filter
+from rawlog import read_dataframe
+
+#combines every characterisation sweep into one RPM x brake current map of generator power and
+#efficiency, so we can see whether the optimum is a speed, a brake current or a moving target.
+#the map is saved as a small .npz lookup table: the best brake current at a given rpm is then
+#one array index (see GeneratorMap.optimal_current), cheap enough for the MPPT loop.
+
+COLUMNS = ('Gen RPM', 'Brake Current', 'Gen Wattage', 'Efficiency')
+
+def load_samples(filenames):
+	#the averaged csvs or the binary raw logs, only the columns the map needs
+	frames = []
+	for filename in filenames:
+		if filename.endswith('.bin'):
+			df = read_dataframe(filename)
+		else:
+			df = pd.read_csv(filename, usecols=lambda name: name in COLUMNS)
+		if all(name in df for name in COLUMNS):
+			frames.append(df[list(COLUMNS)])
+
+	if not frames:
+		return pd.DataFrame({name: pd.Series(dtype='float64') for name in COLUMNS})
+
+	data = pd.concat(frames, ignore_index=True).astype('float64')
+	data = data[np.isfinite(data).all(axis=1)]
+
+	#coasting / motoring rows say nothing about where the generator works best
+	return data[(data['Gen RPM'] > 0) & (data['Brake Current'] > 0) & (data['Gen Wattage'] > 0)].reset_index(drop=True)
+
+def bin_edges(values, step):
+	#step wide bins on multiples of step, the last one holding the largest value.  always at
+	#least one, a sweep at a single brake current is one column.
+	start = np.floor(values.min() / step) * step
+	bins = int(np.floor((values.max() - start) / step)) + 1
+	return start + step * np.arange(bins + 1)
+
+def bin_grid(x, y, values, x_edges, y_edges):
+	#per cell sums of every value and the sample count, with bincount on the flat cell index
+	nx = len(x_edges) - 1
+	ny = len(y_edges) - 1
+	ix = np.clip(np.searchsorted(x_edges, x, side='right') - 1, 0, nx - 1)
+	iy = np.clip(np.searchsorted(y_edges, y, side='right') - 1, 0, ny - 1)
+	cell = ix * ny + iy
+
+	count = np.bincount(cell, minlength=nx * ny).astype(np.float64).reshape(nx, ny)
+	sums = {name: np.bincount(cell, weights=v, minlength=nx * ny).reshape(nx, ny) for name, v in values.items()}
+	return count, sums
+
+class GeneratorMap():
+
+	#regular grid, rows are rpm and columns brake current, both from cell centres
+
+	def __init__(self, rpm, current, power, efficiency, count, optimal_current, optimal_power):
+		self.rpm = rpm
+		self.current = current
+		self.power = power
+		self.efficiency = efficiency
+		self.count = count
+		self.optimal = optimal_current
+		self.optimal_power = optimal_power
+
+		self.rpm_start = rpm[0]
+		self.rpm_step = rpm[1] - rpm[0] if len(rpm) > 1 else 1.0
+
+	@classmethod
+	def build(cls, data, rpm_step = 100, current_step = 1.0, smoothing = 1.0, min_weight = 0.5):
+		rpm = data['Gen RPM'].to_numpy()
+		current = data['Brake Current'].to_numpy()
+
+		rpm_edges = bin_edges(rpm, rpm_step)
+		current_edges = bin_edges(current, current_step)
+
+		count, sums = bin_grid(rpm, current, {
+			'power': data['Gen Wattage'].to_numpy(),
+			'efficiency': data['Efficiency'].to_numpy()
+		}, rpm_edges, current_edges)
+
+		#smooth the sums and counts with the same kernel and divide (normalised convolution).
+		#empty cells next to measured ones get filled in, cells far from any data stay empty.
+		#min_weight is in samples: a cell needs about that many samples in it or close by.
+		weight = gaussian_filter(count, smoothing, mode='nearest')
+		delta = np.zeros((9, 9))
+		delta[4, 4] = 1
+		valid = weight >= min_weight * gaussian_filter(delta, smoothing)[4, 4]
+		with np.errstate(invalid='ignore', divide='ignore'):
+			power = gaussian_filter(sums['power'], smoothing, mode='nearest') / weight
+			efficiency = gaussian_filter(sums['efficiency'], smoothing, mode='nearest') / weight
+		power[~valid] = np.nan
+		efficiency[~valid] = np.nan
+
+		rpm_centres = (rpm_edges[:-1] + rpm_edges[1:]) / 2
+		current_centres = (current_edges[:-1] + current_edges[1:]) / 2
+
+		optimal_current, optimal_power = cls.ridge(current_centres, power)
+		return cls(rpm_centres, current_centres, power, efficiency, count, optimal_current, optimal_power)
+
+	@staticmethod
+	def ridge(current, power):
+		#brake current with the most power in every rpm row, refined with a parabola through
+		#the best cell and its neighbours.  rows without data are filled from the nearest rows.
+		rows = len(power)
+		optimal = np.full(rows, np.nan)
+		best = np.full(rows, np.nan)
+
+		has = np.isfinite(power).any(axis=1)
+		if not has.any():
+			return optimal, best
+
+		filled = np.where(np.isfinite(power), power, -np.inf)
+		i = np.argmax(filled, axis=1)
+		r = np.arange(rows)
+
+		optimal[has] = current[i[has]]
+		best[has] = filled[r, i][has]
+
+		inner = has & (i > 0) & (i < len(current) - 1)
+		y0 = filled[r[inner], i[inner] - 1]
+		y1 = filled[r[inner], i[inner]]
+		y2 = filled[r[inner], i[inner] + 1]
+		denom = y0 - 2 * y1 + y2
+		with np.errstate(invalid='ignore', divide='ignore'):
+			shift = np.where(np.isfinite(denom) & (denom < 0), 0.5 * (y0 - y2) / denom, 0.0)
+		step = current[1] - current[0] if len(current) > 1 else 0
+		optimal[inner] += np.clip(shift, -0.5, 0.5) * step
+
+		known = np.flatnonzero(has)
+		optimal = np.interp(r, known, optimal[known])
+		best = np.interp(r, known, best[known])
+		return optimal, best
+
+	def lookup(self, table, rpm):
+		#O(1): straight index into the table, linear between the two nearest rows
+		pos = (rpm - self.rpm_start) / self.rpm_step
+		last = len(table) - 1
+		if pos <= 0 or last == 0:
+			return float(table[0])
+		if pos >= last:
+			return float(table[last])
+		i = int(pos)
+		f = pos - i
+		return float(table[i] * (1 - f) + table[i + 1] * f)
+
+	def optimal_current(self, rpm):
+		return self.lookup(self.optimal, rpm)
+
+	def expected_power(self, rpm):
+		return self.lookup(self.optimal_power, rpm)
+
+	def save(self, filename):
+		np.savez_compressed(filename, rpm=self.rpm, current=self.current, power=self.power.astype(np.float32),
+			efficiency=self.efficiency.astype(np.float32), count=self.count.astype(np.uint32),
+			optimal_current=self.optimal, optimal_power=self.optimal_power)
+
+	@classmethod
+	def load(cls, filename):
+		with np.load(filename) as f:
+			return cls(f['rpm'], f['current'], f['power'].astype(np.float64), f['efficiency'].astype(np.float64),
+				f['count'].astype(np.float64), f['optimal_current'], f['optimal_power'])
+
+	def plot(self, title = 'Generator Map'):
+		import matplotlib.pyplot as plt
+
+		fig, axs = plt.subplots(1, 2, figsize=(12, 5), sharey=True)
+		x, y = np.meshgrid(self.current, self.rpm)
+
+		for ax, z, label in ((axs[0], self.power, 'Gen Wattage'), (axs[1], self.efficiency, 'Efficiency (%)')):
+			cs = ax.contourf(x, y, np.ma.masked_invalid(z), levels=20)
+			fig.colorbar(cs, ax=ax, label=label)
+			ax.plot(self.optimal, self.rpm, color='tab:red', linewidth=2, label="Max Power")
+			ax.set(title=label, xlabel="Brake Current (A)")
+			ax.grid(True)
+
+		axs[0].set_ylabel("Gen RPM")
+		axs[0].legend()
+		fig.suptitle(title)
+
+		return fig
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Build an RPM x brake current generator map from sweep runs')
+	parser.add_argument('filenames', nargs='+', help='Sweep CSVs or binary raw logs (wildcards ok)')
+	parser.add_argument('--out', help='Lookup table to write', default='output/generator-map.npz')
+	parser.add_argument('--rpm_step', help='RPM bin size', type=float, default=100)
+	parser.add_argument('--current_step', help='Brake current bin size (A)', type=float, default=1.0)
+	parser.add_argument('--smoothing', help='Surface smoothing, in bins', type=float, default=1.0)
+	parser.add_argument('--plot', help='Save contour plots to this png', default=None)
+	parser.add_argument('--show', dest='show', action='store_true')
+	parser.set_defaults(show=False)
+
+	args = parser.parse_args()
+
+	filenames = []
+	for pattern in args.filenames:
+		filenames += sorted(glob.glob(pattern)) or [pattern]
+
+	data = load_samples(filenames)
+	if len(data) == 0:
+		print ("No generating samples in {} files.".format(len(filenames)))
+		exit(1)
+
+	genmap = GeneratorMap.build(data, args.rpm_step, args.current_step, args.smoothing)
+	genmap.save(args.out)
+
+	print ("{} samples from {} files, {} x {} grid -> {}".format(len(data), len(filenames), len(genmap.rpm), len(genmap.current), args.out))
+	print ("{:>8} {:>10} {:>10}".format("RPM", "Brake A", "Watts"))
+	for rpm, current, power in zip(genmap.rpm, genmap.optimal, genmap.optimal_power):
+		print ("{:>8.0f} {:>10.2f} {:>10.1f}".format(rpm, current, power))
+
+	if args.plot or args.show:
+		import matplotlib as mpl
+		if not args.show:
+			mpl.use('Agg')
+		import matplotlib.pyplot as plt
+		fig = genmap.plot()
+		if args.plot:
+			fig.savefig(args.plot, dpi=200)
+		if args.show:
+			plt.show()
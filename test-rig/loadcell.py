@@ -8,6 +8,206 @@ import serial
 import serial.tools.list_ports
 from pprint import pprint
 import re
+import numpy as np
+from timeindex import IndexedCsv
+
+#binary frames from HX711-Reader.ino, see the comment there for the layout
+FRAME_SYNC = (0xA5, 0x5A)
+FRAME_SIZE = 14
+FRAME_DATA = ord('D')
+FRAME_CALIBRATION = ord('C')
+
+def crc8_table(poly = 0x07):
+	table = np.zeros(256, dtype=np.uint8)
+	for i in range(256):
+		crc = i
+		for bit in range(8):
+			crc = ((crc << 1) ^ poly) if crc & 0x80 else (crc << 1)
+		table[i] = crc & 0xFF
+	return table
+
+CRC8_TABLE = crc8_table()
+
+class BinaryDecoder():
+
+	#decodes a whole read worth of frames at once with numpy.  frames that fail the crc are
+	#skipped, and gaps in the sequence numbers are counted as lost frames.
+
+	def __init__(self):
+		self.buffer = bytearray()
+		self.calibration_factor = None
+		self.last_sequence = None
+		self.frames = 0
+		self.lost = 0
+		self.crc_errors = 0
+
+		#device micros() -> host clock
+		self.last_micros = None
+		self.micros_wraps = 0
+		self.clock_offset = None
+
+	def decode(self, data, t):
+		#returns (times, counts, kg) arrays for the data frames in this chunk
+		self.buffer += data
+		buf = np.frombuffer(bytes(self.buffer), dtype=np.uint8)
+		n = len(buf)
+		empty = (np.zeros(0), np.zeros(0, dtype=np.int32), np.zeros(0))
+
+		if n < FRAME_SIZE:
+			return empty
+
+		starts = np.flatnonzero((buf[:-1] == FRAME_SYNC[0]) & (buf[1:] == FRAME_SYNC[1]))
+		starts = starts[starts + FRAME_SIZE <= n]
+		frames = buf[starts[:, None] + np.arange(FRAME_SIZE)]
+
+		crc = np.zeros(len(starts), dtype=np.uint8)
+		for i in range(2, FRAME_SIZE - 1):
+			crc = CRC8_TABLE[crc ^ frames[:, i]]
+		valid = crc == frames[:, FRAME_SIZE - 1]
+
+		#a sync pattern inside a payload can pass the crc by chance, drop anything overlapping a good frame
+		good = []
+		next_free = 0
+		for i in np.flatnonzero(valid):
+			if starts[i] >= next_free:
+				good.append(i)
+				next_free = starts[i] + FRAME_SIZE
+
+		self.crc_errors += int(np.count_nonzero(~valid))
+
+		#everything before a frame that could still be incomplete has been dealt with
+		consumed = max(next_free, n - FRAME_SIZE + 1)
+		del self.buffer[:consumed]
+
+		if not good:
+			return empty
+
+		frames = np.ascontiguousarray(frames[good])
+		types = frames[:, 2]
+		sequence = frames[:, 3:5].copy().view('<u2').ravel().astype(np.int64)
+		micros = frames[:, 5:9].copy().view('<u4').ravel().astype(np.int64)
+		values = frames[:, 9:13].copy()
+
+		self.frames += len(frames)
+
+		#lost frames from the sequence gaps, including the gap to the previous chunk
+		if self.last_sequence is not None:
+			sequence = np.concatenate(([self.last_sequence], sequence))
+		gaps = (np.diff(sequence) - 1) % 65536
+		self.lost += int(gaps.sum())
+		self.last_sequence = int(sequence[-1])
+
+		calibration = values[types == FRAME_CALIBRATION]
+		if len(calibration):
+			self.calibration_factor = float(calibration.view('<f4').ravel()[-1])
+
+		data = types == FRAME_DATA
+		counts = values[data].view('<i4').ravel()
+		micros = micros[data]
+
+		if not len(counts):
+			return empty
+
+		#micros() wraps every ~71 minutes
+		if self.last_micros is not None:
+			micros = np.concatenate(([self.last_micros], micros))
+		wraps = np.cumsum(np.diff(micros) < 0) + self.micros_wraps
+		if self.last_micros is None:
+			wraps = np.concatenate(([self.micros_wraps], wraps))
+		else:
+			micros = micros[1:]
+		self.last_micros = int(micros[-1])
+		self.micros_wraps = int(wraps[-1])
+		device_time = (micros + wraps * 2**32) * 1e-6
+
+		#the smallest arrival - device time seen so far is the best estimate of the clock offset
+		offset = t - device_time[-1]
+		if self.clock_offset is None or offset < self.clock_offset:
+			self.clock_offset = offset
+		times = device_time + self.clock_offset
+
+		if self.calibration_factor:
+			kg = counts / self.calibration_factor
+		else:
+			kg = np.full(len(counts), np.nan)
+
+		return (times, counts, kg)
+
+class LoadcellReader():
+
+	#reads the HX711-Reader sketch.  blocks on the port instead of polling it, pulls every byte
+	#that has arrived in one go and splits the lines out of one reusable buffer.  every line
+	#completed by a read gets the time those bytes arrived.
+
+	def __init__(self, ser, callback = None, batch_callback = None, clock = time.time, binary = False):
+		self.ser = ser
+		self.callback = callback
+		self.batch_callback = batch_callback
+		self.clock = clock
+		self.buffer = bytearray()
+		self.running = False
+		self.errors = 0
+
+		self.decoder = None
+		if binary:
+			self.decoder = BinaryDecoder()
+
+	def read(self):
+		#blocks until at least one byte shows up (or the port timeout)
+		data = self.ser.read(1)
+		if not data:
+			return []
+
+		waiting = self.ser.in_waiting
+		if waiting:
+			data += self.ser.read(waiting)
+		t = self.clock()
+
+		if self.decoder is not None:
+			times, counts, kg = self.decoder.decode(data, t)
+			return list(zip(times.tolist(), kg.tolist()))
+
+		self.buffer += data
+		buf = self.buffer
+		samples = []
+		start = 0
+
+		while True:
+			end = buf.find(b'\n', start)
+			if end < 0:
+				break
+
+			#first field is the weight, float() is happy with the raw bytes
+			comma = buf.find(b',', start, end)
+			if comma < 0:
+				comma = end
+
+			try:
+				samples.append((t, float(buf[start:comma])))
+			except ValueError:
+				self.errors += 1
+
+			start = end + 1
+
+		del buf[:start]
+		return samples
+
+	def run(self):
+		self.running = True
+		while self.running:
+			samples = self.read()
+			if not samples:
+				continue
+
+			if self.batch_callback:
+				self.batch_callback(samples)
+
+			if self.callback:
+				for t, weight in samples:
+					self.callback(t, weight)
+
+	def stop(self):
+		self.running = False
 
 if __name__ == '__main__':
 	parser = argparse.ArgumentParser(description='Read data from loadcell Arduino script')
@@ -17,6 +217,10 @@ if __name__ == '__main__':
 
 	parser.add_argument('--csv', help='CSV file to output to', type=str, default=None)
 
+	parser.add_argument('--ascii', dest='ascii', action='store_true', help='Sketch is built with BINARY_MODE 0')
+	parser.set_defaults(ascii=False)
+	parser.add_argument('--baud', help='Serial baud rate', type=int, default=None)
+
 	parser.add_argument('--list', dest='list', action='store_true')
 	parser.set_defaults(list=False)
 
@@ -37,41 +241,39 @@ if __name__ == '__main__':
 
 		try: 
 			print ("Opening {}".format(args.port))
-			ser = serial.Serial(port=args.port, baudrate=9600)
+			if args.baud is None:
+				args.baud = 9600 if args.ascii else 115200
+			ser = serial.Serial(port=args.port, baudrate=args.baud, timeout=1)
 			time.sleep(1)
 		except Exception as e:
 			print ("Error opening serial port: " + str(e))
 			exit()	
 		
+		csv_file = None
 		csv_writer = None
 		if args.csv:
-			csv_file = open(args.csv, "w", newline='')
-			csv_writer = csv.writer(csv_file)
-			csv_writer.writerow(("Time", "Force"))
+			csv_file = IndexedCsv(args.csv, ("Time", "Force"))
+			csv_writer = csv_file
+
+		def print_batch(samples):
+			t, weight = samples[-1]
+			output = "[{}] {:6.3f}KG".format(time.ctime(t), weight)
+			if reader.decoder:
+				output += " ({} frames, {} lost, {} bad)".format(reader.decoder.frames, reader.decoder.lost, reader.decoder.crc_errors)
+			print(output)
+
+			if csv_writer:
+				csv_writer.writerows(samples)
 
 		if ser.isOpen():
 			ser.flushInput()
 			ser.flushOutput()
+			reader = LoadcellReader(ser, batch_callback = print_batch, binary = not args.ascii)
 			try:
-				while True:
-					if ser.inWaiting() > 0:
-						line = ser.readline().decode('ascii')
-						line = line.strip()
-						data = line.split(',')
-
-						try:
-							weight = float(data[0])
-							print("[{}] {:6.3f}KG".format(time.ctime(), weight))
-							
-							if csv_writer:
-								csv_writer.writerow((time.time(), weight))
-
-						except ValueError:
-							continue
-					else:
-						time.sleep(0.01)
+				reader.run()
 			except KeyboardInterrupt:
-				csv_file.close()
+				if csv_file:
+					csv_file.close()
 				ser.close()
 		else:
 			print ("Exiting.")
@@ -0,0 +1,377 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import argparse
+import glob
+import math
+import time
+from collections import namedtuple
+import numpy as np
+
+#MPPT controllers for the generator brake current, and an offline harness that replays them
+#against a generator model fitted from the sweep runs so they can be compared without the rig.
+#
+#a controller gets one averaged Reading per control tick and returns the next brake current.
+
+Reading = namedtuple('Reading', ['time', 'rpm', 'wattage', 'voltage', 'current'])
+
+class Controller():
+
+	name = 'controller'
+
+	def __init__(self, start_current = 1.0, min_current = 0.0, max_current = 60.0):
+		self.start_current = start_current
+		self.min_current = min_current
+		self.max_current = max_current
+		self.reset()
+
+	def reset(self, brake_current = None):
+		self.brake_current = self.start_current if brake_current is None else brake_current
+
+	def clamp(self, current):
+		return max(self.min_current, min(self.max_current, current))
+
+	def update(self, reading):
+		raise NotImplementedError
+
+class PerturbObserve(Controller):
+
+	#what test_mppt always did: back off when power or rpm drops, and creep up after a quiet
+	#spell that gets shorter every time creeping up worked
+
+	name = 'perturb-observe'
+
+	def __init__(self, start_current = 1.0, percent = 0.005, step_down = 0.02, step_up = 0.01, interval = 5, **kwargs):
+		self.percent = percent
+		self.step_down = step_down
+		self.step_up = step_up
+		self.interval = interval
+		Controller.__init__(self, start_current, **kwargs)
+
+	def reset(self, brake_current = None):
+		Controller.reset(self, brake_current)
+		self.last_rpm = 0
+		self.last_wattage = 0
+		self.last_change = None
+		self.send_interval = self.interval
+
+	def observe_from(self, reading):
+		self.last_rpm = reading.rpm
+		self.last_wattage = reading.wattage
+		self.last_change = reading.time
+		self.send_interval = self.interval
+
+	def update(self, reading):
+		if self.last_change is None:
+			self.last_change = reading.time
+
+		if reading.wattage < self.last_wattage * (1.0 - self.percent) or reading.rpm < self.last_rpm * (1.0 - self.percent):
+			self.brake_current -= self.step_down
+			self.observe_from(reading)
+
+		if reading.time - self.last_change > self.send_interval:
+			self.brake_current += self.step_up
+			self.last_rpm = reading.rpm
+			self.last_wattage = reading.wattage
+			self.last_change = reading.time
+			self.send_interval = max(1, self.send_interval - 1)
+
+		self.brake_current = self.clamp(self.brake_current)
+		return self.brake_current
+
+class IncrementalConductance(Controller):
+
+	#at the power peak dP/dI = V + I dV/dI = 0, so compare dV/dI with -V/I and step towards it
+
+	name = 'incremental-conductance'
+
+	def __init__(self, start_current = 1.0, step = 0.05, deadband = 0.01, **kwargs):
+		self.step = step
+		self.deadband = deadband
+		Controller.__init__(self, start_current, **kwargs)
+
+	def reset(self, brake_current = None):
+		Controller.reset(self, brake_current)
+		self.last = None
+
+	def update(self, reading):
+		last = self.last
+		self.last = reading
+		if last is None:
+			self.brake_current = self.clamp(self.brake_current + self.step)
+			return self.brake_current
+
+		dv = reading.voltage - last.voltage
+		di = reading.current - last.current
+
+		if abs(di) < 1e-6:
+			#current didn't move, follow the voltage: more voltage means more power is on offer
+			if abs(dv) > self.deadband * max(abs(reading.voltage), 1e-6):
+				self.brake_current += self.step if dv > 0 else -self.step
+			else:
+				self.brake_current += self.step
+		elif reading.current > 0:
+			error = dv / di + reading.voltage / reading.current
+			if abs(error) > self.deadband * reading.voltage / reading.current:
+				self.brake_current += self.step if error > 0 else -self.step
+
+		self.brake_current = self.clamp(self.brake_current)
+		return self.brake_current
+
+class AdaptiveHillClimb(Controller):
+
+	#hill climbing on power with a step proportional to the slope: big steps far from the peak,
+	#small ones near it
+
+	name = 'adaptive-hill-climb'
+
+	def __init__(self, start_current = 1.0, gain = 0.002, min_step = 0.01, max_step = 2.0, **kwargs):
+		self.gain = gain
+		self.min_step = min_step
+		self.max_step = max_step
+		Controller.__init__(self, start_current, **kwargs)
+
+	def reset(self, brake_current = None):
+		Controller.reset(self, brake_current)
+		self.last = None
+		self.direction = 1
+
+	def update(self, reading):
+		last = self.last
+		self.last = reading
+		step = self.min_step
+
+		if last is not None:
+			dp = reading.wattage - last.wattage
+			di = reading.current - last.current
+			if abs(di) > 1e-6:
+				slope = dp / di
+				self.direction = 1 if slope > 0 else -1
+				step = min(self.max_step, max(self.min_step, self.gain * abs(slope)))
+			elif dp < 0:
+				self.direction = -self.direction
+
+		self.brake_current = self.clamp(self.brake_current + self.direction * step)
+		return self.brake_current
+
+class TableDriven(Controller):
+
+	#feed forward from a generator map (genmap.py), with perturb and observe trimming around it.
+	#a big rpm change is the water speed changing, so the table follows it and observing restarts.
+	#start_current has no default, it should come from the map at the generator's measured rpm.
+
+	name = 'table-driven'
+
+	def __init__(self, genmap, start_current, limit = 0.2, rebase = 0.05, trim = None, **kwargs):
+		self.genmap = genmap
+		self.limit = limit
+		self.rebase = rebase
+		self.inner = trim if trim is not None else PerturbObserve(0.0, min_current = -1e9)
+		Controller.__init__(self, start_current, **kwargs)
+
+	def reset(self, brake_current = None):
+		Controller.reset(self, brake_current)
+		self.inner.reset(0.0)
+		self.trim = 0.0
+
+	def update(self, reading):
+		inner = self.inner
+		if abs(reading.rpm - inner.last_rpm) > inner.last_rpm * self.rebase:
+			inner.observe_from(reading)
+		else:
+			last = inner.brake_current
+			self.trim += inner.update(reading) - last
+
+		feed_forward = self.genmap.optimal_current(reading.rpm)
+		self.trim = max(-self.limit * feed_forward, min(self.limit * feed_forward, self.trim))
+		self.brake_current = self.clamp(feed_forward + self.trim)
+		return self.brake_current
+
+CONTROLLERS = {
+	PerturbObserve.name: PerturbObserve,
+	IncrementalConductance.name: IncrementalConductance,
+	AdaptiveHillClimb.name: AdaptiveHillClimb
+}
+
+class GeneratorModel():
+
+	#quasi-static model of the turbine + generator, first order in rpm from one tick to the next.
+	#	turbine torque		T = flow^2 * a - flow * b * w	(w in rad/s, flow 1.0 = the rig's drive)
+	#	generator			V = kt * w - R * I, P = V * I, torque kt * I
+	#the shaft settles towards where the two torques match with time constant tau.
+
+	def __init__(self, kt = 0.1, resistance = 0.05, a = 8.0, b = 0.02, tau = 0.8):
+		self.kt = kt
+		self.resistance = resistance
+		self.a = a
+		self.b = b
+		self.tau = tau
+
+	@staticmethod
+	def rad_s(rpm):
+		return rpm * (2 * math.pi / 60)
+
+	@classmethod
+	def fit(cls, data, tau = 0.8):
+		#least squares on the sweep rows:
+		#	Gen Wattage = kt * I * w - R * I^2			-> kt, R
+		#	Driver Wattage / w = a - b * w				-> a, b at the rig's flow of 1.0
+		w = cls.rad_s(data['Gen RPM'].to_numpy())
+		current = data['Brake Current'].to_numpy()
+		power = data['Gen Wattage'].to_numpy()
+
+		(kt, resistance), *_ = np.linalg.lstsq(np.column_stack([current * w, -current * current]), power, rcond=None)
+		if kt <= 0:
+			raise ValueError("sweeps don't fit a generator (kt = {:.4f})".format(kt))
+		model = cls(kt = float(kt), resistance = max(float(resistance), 0.0), tau = tau)
+
+		if 'Driver Wattage' in data:
+			ok = w > 1
+			torque = data['Driver Wattage'].to_numpy()[ok] / w[ok]
+			(a, b), *_ = np.linalg.lstsq(np.column_stack([np.ones(ok.sum()), -w[ok]]), torque, rcond=None)
+			if a > 0 and b > 0:
+				model.a = float(a)
+				model.b = float(b)
+
+		return model
+
+	def equilibrium(self, flow, current):
+		#shaft speed (rad/s) where turbine and generator torque match
+		if flow <= 0:
+			return 0.0
+		return max(0.0, (self.a * flow * flow - self.kt * current) / (self.b * flow))
+
+	def optimal_current(self, flow):
+		#dP/dI = 0 with w at equilibrium
+		if flow <= 0:
+			return 0.0
+		return self.kt * self.a * flow * flow / (2 * (self.kt * self.kt + self.resistance * self.b * flow))
+
+	def power(self, w, current):
+		return (self.kt * w - self.resistance * current) * current
+
+	def optimal_power(self, flow):
+		current = self.optimal_current(flow)
+		return self.power(self.equilibrium(flow, current), current)
+
+#water speed over time, as a multiple of the rig's drive
+def steady(t):
+	return 1.0
+
+def steps(t, period = 120.0, levels = (1.0, 0.7, 1.2, 0.9)):
+	return levels[int(t // period) % len(levels)]
+
+def sine(t, period = 300.0, depth = 0.3):
+	return 1.0 + depth * math.sin(2 * math.pi * t / period)
+
+def gusts(seed = 0, sigma = 0.01, revert = 0.01):
+	#mean reverting random walk around 1.0, one value per second
+	rng = np.random.default_rng(seed)
+	state = {'t': 0, 'flow': 1.0}
+
+	def flow(t):
+		while state['t'] < t:
+			state['flow'] += revert * (1.0 - state['flow']) + sigma * rng.standard_normal()
+			state['t'] += 1
+		return max(state['flow'], 0.1)
+
+	return flow
+
+PROFILES = {
+	'steady': lambda seed: steady,
+	'steps': lambda seed: steps,
+	'sine': lambda seed: sine,
+	'gusts': gusts
+}
+
+def replay(controller, model, flow, duration, tick = 1.0, noise = 0.0, seed = 0, start_current = None):
+	#run a controller against the model for duration (simulated) seconds, one control tick at a
+	#time like test_mppt.  noise is the relative standard deviation added to each (averaged) reading.
+	rng = np.random.default_rng(seed)
+	alpha = 1.0 - math.exp(-tick / model.tau) if model.tau > 0 else 1.0
+
+	controller.reset(start_current)
+	current = controller.brake_current
+	w = model.equilibrium(flow(0), current)
+
+	energy = 0.0
+	available = 0.0
+	error = 0.0
+	ticks = int(duration / tick)
+	for i in range(ticks):
+		t = i * tick
+		f = flow(t)
+
+		w += (model.equilibrium(f, current) - w) * alpha
+		voltage = max(model.kt * w - model.resistance * current, 0.0)
+		power = voltage * current
+
+		energy += power * tick
+		available += model.optimal_power(f) * tick
+		error += abs(current - model.optimal_current(f))
+
+		if noise:
+			n = 1.0 + noise * rng.standard_normal(3)
+			reading = Reading(t, w * (60 / (2 * math.pi)) * n[0], power * n[1] * n[2], voltage * n[1], current * n[2])
+		else:
+			reading = Reading(t, w * (60 / (2 * math.pi)), power, voltage, current)
+
+		current = controller.update(reading)
+
+	return {
+		'controller': controller.name,
+		'energy': energy / 3600.0,
+		'available': available / 3600.0,
+		'tracking': energy / available if available > 0 else float('nan'),
+		'current_error': error / ticks if ticks else float('nan')
+	}
+
+def rank(controllers, model, profile = 'gusts', duration = 3600.0, tick = 1.0, noise = 0.0, seed = 0):
+	#everyone starts where test_mppt does, at 30% of the (here known) optimum
+	start_current = 0.3 * model.optimal_current(1.0)
+
+	results = []
+	for controller in controllers:
+		start = time.time()
+		r = replay(controller, model, PROFILES[profile](seed), duration, tick, noise, seed, start_current)
+		r['wall_time'] = time.time() - start
+		results.append(r)
+	return sorted(results, key=lambda r: r['energy'], reverse=True)
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Compare MPPT controllers against a generator model fitted from sweep runs')
+	parser.add_argument('filenames', nargs='*', help='Sweep CSVs or binary raw logs to fit the model from (wildcards ok)')
+	parser.add_argument('--map', help='Generator map (genmap.py) for the table driven controller', default=None)
+	parser.add_argument('--profile', help='Water speed profile', choices=list(PROFILES.keys()), default='gusts')
+	parser.add_argument('--minutes', help='Simulated minutes per controller', type=float, default=600)
+	parser.add_argument('--tick', help='Control tick (s)', type=float, default=1.0)
+	parser.add_argument('--noise', help='Relative measurement noise', type=float, default=0.002)
+	parser.add_argument('--seed', type=int, default=0)
+
+	args = parser.parse_args()
+
+	model = GeneratorModel()
+	if args.filenames:
+		from genmap import load_samples
+		filenames = []
+		for pattern in args.filenames:
+			filenames += sorted(glob.glob(pattern)) or [pattern]
+		try:
+			model = GeneratorModel.fit(load_samples(filenames))
+		except ValueError as e:
+			print ("Could not fit the sweeps, using the default model: {}".format(e))
+	print ("Model: kt={:.4f} R={:.4f} a={:.3f} b={:.5f}, optimum {:.2f}A / {:.1f}W at flow 1.0".format(
+		model.kt, model.resistance, model.a, model.b, model.optimal_current(1.0), model.optimal_power(1.0)))
+
+	controllers = [cls() for cls in CONTROLLERS.values()]
+	if args.map:
+		from genmap import GeneratorMap
+		#rank() starts every controller from the same current anyway
+		controllers.append(TableDriven(GeneratorMap.load(args.map), 0.3 * model.optimal_current(1.0)))
+
+	results = rank(controllers, model, args.profile, args.minutes * 60, args.tick, args.noise, args.seed)
+
+	print ("{:<26} {:>10} {:>10} {:>9} {:>9} {:>12}".format("Controller", "Wh", "Avail Wh", "Tracking", "Err A", "Sim min/s"))
+	for r in results:
+		print ("{:<26} {:>10.1f} {:>10.1f} {:>8.1f}% {:>9.2f} {:>12.0f}".format(r['controller'], r['energy'], r['available'],
+			r['tracking'] * 100, r['current_error'], args.minutes / r['wall_time'] if r['wall_time'] else float('inf')))
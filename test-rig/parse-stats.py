@@ -3,54 +3,116 @@
 
 import argparse, os
 import time
+import glob
+import hashlib
+import json
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
-import matplotlib.pyplot as plt
 import matplotlib as mpl
 #import seaborn as sns
 import numpy as np
-from scipy.interpolate import interp1d
-from scipy.interpolate import make_interp_spline
+from smoothing import smooth_series
+from decimate import decimate, target_points
+from align import load_aligned
 import pathlib
+from rawlog import read_dataframe
+from timeindex import read_window
 
 from pprint import pprint
 
+#matplotlib.pyplot, imported by use_pyplot() once the backend is known
+plt = None
+
 battery_shunt_data = None
 generator_shunt_data = None
 loadcell_data = None
 
+#plot settings, all of them end up in the render cache key
+options = {
+	'dpi': 200,
+	'decimate': 'lttb',		#how long time series get thinned out, see plot_series()
+	'align_rate': 10.0,		#common time base for get_aligned(), in Hz
+	'align_tolerance': 1.0,	#seconds a source may be missing before it goes NaN
+	'auto_offset': False,	#estimate the generator shunt's clock offset
+	'store': None			#parquet store to read the shunts / load cell from instead of the csv files
+}
+
+#the run being plotted and its aligned frame, see get_aligned()
+run_filename = None
+aligned_data = None
+
+def load_window(filename, start_time, end_time, chunksize = 100000):
+	#the shunt and load cell logs can run for days, so read them a chunk at a time and only keep
+	#rows between start_time and end_time (epoch seconds).  rows are written in time order, so
+	#we can stop reading as soon as we are past the end.  if the log has a time index we
+	#jump straight to the window instead.
+	data = read_window(filename, start_time, end_time)
+	if data is not None:
+		data.Time = pd.to_datetime(data.Time, unit='s')
+		return data
+
+	columns = pd.read_csv(filename, nrows=0).columns
+	dtypes = {name: 'float64' for name in columns}
+
+	chunks = []
+	for chunk in pd.read_csv(filename, dtype=dtypes, chunksize=chunksize):
+		t = chunk['Time']
+		if t.iloc[-1] < start_time:
+			continue
+
+		chunks.append(chunk[(t >= start_time) & (t <= end_time)])
+
+		if t.iloc[-1] > end_time:
+			break
+
+	if chunks:
+		data = pd.concat(chunks, ignore_index=True)
+	else:
+		data = pd.DataFrame({name: pd.Series(dtype='float64') for name in columns})
+
+	data.Time = pd.to_datetime(data.Time, unit='s')
+	return data
+
+def plot_series(ax, x, y, **kwargs):
+	#every time series goes through here so hours of samples become about one point per pixel
+	x = np.asarray(x)
+	y = np.asarray(y)
+	keep = decimate(x, y, target_points(ax, options['dpi']), options['decimate'])
+	return ax.plot(x[keep], y[keep], **kwargs)
+
 def plot_voltage(df, graphs_dir):
 	t = df['Time']
 	fig, axs = plt.subplots()
 
-	axs.plot(t, df['Driver Voltage'], label="Driver VESC")
-	axs.plot(t, df['Gen Voltage'], label="Generator VESC")
+	plot_series(axs, t, df['Driver Voltage'], label="Driver VESC")
+	plot_series(axs, t, df['Gen Voltage'], label="Generator VESC")
 	
 	if generator_shunt_data is not None:
-		axs.plot(generator_shunt_data['Time'], generator_shunt_data['Voltage'], label="Generator Shunt")
+		plot_series(axs, generator_shunt_data['Time'], generator_shunt_data['Voltage'], label="Generator Shunt")
 
 	if battery_shunt_data is not None:
-		axs.plot(battery_shunt_data['Time'], battery_shunt_data['Voltage'], label="Battery Shunt")
+		plot_series(axs, battery_shunt_data['Time'], battery_shunt_data['Voltage'], label="Battery Shunt")
 	
 	axs.set(title='Voltage', xlabel="Time (s)", ylabel="Voltage")
 	axs.legend()
 	axs.grid(True)
 
-	#fig.savefig(graphs_dir + "/vesc_voltage.png", dpi=200)
+	return fig
 
 def plot_wattage(df, graphs_dir):
 	fig, ax1 = plt.subplots()
 
 	x = df['Time']
 	y = df['Driver Wattage']
-	ax1.plot(x, y, label="Driver VESC", linewidth=1)
+	plot_series(ax1, x, y, label="Driver VESC", linewidth=1)
 	#plot_cubic(ax1, x, y)
 
 	y = df['Gen Wattage']
-	ax1.plot(x, y, label="Generator VESC", linewidth=1)
+	plot_series(ax1, x, y, label="Generator VESC", linewidth=1)
 	#plot_cubic(ax1, x, y)
 
 	if generator_shunt_data is not None:
-		ax1.plot(generator_shunt_data['Time'], generator_shunt_data['Wattage'], label="Generator Shunt")
+		plot_series(ax1, generator_shunt_data['Time'], generator_shunt_data['Wattage'], label="Generator Shunt")
 
 	ax1.set(title='Power Consumed vs. Generated', xlabel="Time (s)", ylabel="Wattage")
 	ax1.legend(loc='upper center')
@@ -59,89 +121,413 @@ def plot_wattage(df, graphs_dir):
 	ax2 = ax1.twinx()
 	
 	y = df['Efficiency']
-	ax2.plot(x, y, label="Efficiency", color=color)
+	plot_series(ax2, x, y, label="Efficiency", color=color)
 	#plot_cubic(ax2, x, y)
 
 	ax2.set_ylabel('Efficiency (%)', color=color)
 	ax2.tick_params(axis='y', labelcolor=color)
 	ax2.legend(loc='lower center')
-	
-	#fig.savefig(graphs_dir + "/vesc_wattage.png", dpi=200)
+
+	return fig
 
 def plot_amperage(df, graphs_dir):
 	fig, axs = plt.subplots()
 
 	x = df['Time']
 	y = df['Driver Amperage']
-	axs.plot(x, y, label="Driver VESC", linewidth=1)
+	plot_series(axs, x, y, label="Driver VESC", linewidth=1)
 	#plot_cubic(axs, x, y)
 
 	y = df['Gen Amperage']
-	axs.plot(x, y, label="Generator VESC", linewidth=1)
+	plot_series(axs, x, y, label="Generator VESC", linewidth=1)
 	#plot_cubic(axs, x, y)
 
 	if generator_shunt_data is not None:
-		axs.plot(generator_shunt_data['Time'], generator_shunt_data['Amperage'], label="Generator Shunt")
+		plot_series(axs, generator_shunt_data['Time'], generator_shunt_data['Amperage'], label="Generator Shunt")
 
 	if battery_shunt_data is not None:
-		axs.plot(battery_shunt_data['Time'], battery_shunt_data['Amperage'], label="Battery Shunt")
+		plot_series(axs, battery_shunt_data['Time'], battery_shunt_data['Amperage'], label="Battery Shunt")
 
 	axs.set(title='Amperage', xlabel="Time (s)", ylabel="Amperage")
 	axs.legend()
-	
-	#fig.savefig(graphs_dir + "/vesc_wattage.png", dpi=200)
+
+	return fig
 
 def plot_rpm_vs_wattage(df, graphs_dir):
 	fig, axs = plt.subplots()
 
 	x = df['Gen RPM']
 	y = df['Gen Wattage']
-	axs.plot(x, y, label="Generator", linewidth=1)
+	axs.plot(x, y, '.', label="Generator", markersize=2, alpha=0.3)
+	plot_smooth(axs, x, y, label="Generator (smoothed)")
 
 	axs.set(title='RPM vs Wattage', xlabel="RPM", ylabel="Wattage")
 	axs.legend()
-	
-	#fig.savefig(graphs_dir + "/vesc_wattage.png", dpi=200)
+
+	return fig
 
 def plot_brake_current_vs_wattage(df, graphs_dir):
 	fig, ax1 = plt.subplots()
 
 	ax1.set(title='Brake Current vs. Wattage', xlabel="Brake Current (A)", ylabel="Wattage (W)")
-	ax1.plot(df['Brake Current'], df['Gen Wattage'], label="Generator")
+	ax1.plot(df['Brake Current'], df['Gen Wattage'], '.', label="Generator", markersize=2, alpha=0.3)
+	plot_smooth(ax1, df['Brake Current'], df['Gen Wattage'], label="Generator (smoothed)")
 
 	ax1.legend()
-	
-	#fig.savefig(graphs_dir + "/brake_current_vs_wattage.png", dpi=200)
 
-def plot_spline(ax, x, y):
-	# Plotting the graph - spline
-	X_Y_Spline = make_interp_spline(x, y)
-	X_ = np.linspace(x.min(), x.max(), 25)
-	Y_ = X_Y_Spline(X_)
+	return fig
+
+def plot_efficiency_vs_wattage(df, graphs_dir):
+	a = get_aligned(df)
+	fig, ax1 = plt.subplots()
 
-	X_Y_Spline = make_interp_spline(X_, Y_)
-	X2_ = np.linspace(x.min(), x.max(), 500)
-	Y2_ = X_Y_Spline(X2_)
+	ax1.plot(a['Gen Wattage'], a['Efficiency'], '.', label="VESC", markersize=2, alpha=0.3)
+	plot_smooth(ax1, a['Gen Wattage'], a['Efficiency'], label="VESC (smoothed)")
 
-	#ax.plot(X_, Y_)
-	ax.plot(X2_, Y2_)
+	#what actually made it out of the generator, against what the driver put in
+	if 'Generator Shunt Wattage' in a:
+		efficiency = 100 * a['Generator Shunt Wattage'] / a['Driver Wattage'].where(a['Driver Wattage'] != 0)
+		plot_smooth(ax1, a['Generator Shunt Wattage'], efficiency, label="Generator Shunt (smoothed)")
+
+	ax1.set(title='Efficiency vs. Wattage', xlabel="Generated (W)", ylabel="Efficiency (%)")
+	ax1.legend()
+
+	return fig
+
+def plot_drag_vs_wattage(df, graphs_dir):
+	a = get_aligned(df)
+	fig, ax1 = plt.subplots()
+
+	ax1.set(title='Drag vs. Wattage', xlabel="Generated (W)", ylabel="Drag (KG)")
+
+	if 'Loadcell Force' in a:
+		ax1.plot(a['Gen Wattage'], a['Loadcell Force'], '.', label="Load Cell", markersize=2, alpha=0.3)
+		plot_smooth(ax1, a['Gen Wattage'], a['Loadcell Force'], label="Load Cell (smoothed)")
+		ax1.legend()
+	else:
+		ax1.text(0.5, 0.5, "no load cell data", transform=ax1.transAxes, ha='center')
+
+	return fig
+
+def plot_smooth(ax, x, y, label = None, color = None):
+	#binned smoothing spline with a confidence band, copes with unsorted / duplicate x
+	xs, ys, lower, upper = smooth_series(x, y)
+	line, = ax.plot(xs, ys, label=label, color=color, linewidth=2)
+	ax.fill_between(xs, lower, upper, color=line.get_color(), alpha=0.2, linewidth=0)
+
+def plot_spline(ax, x, y):
+	plot_smooth(ax, x, y)
 
 def plot_cubic(ax, x, y):
-	# Plotting the Graph - cubic
-	cubic_interploation_model = interp1d(x, y, kind = "cubic")
-	X_=np.linspace(x.min(), x.max(), 25)
-	Y_=cubic_interploation_model(X_)
+	plot_smooth(ax, x, y)
+
+#--flag -> (plot function, png name)
+PLOTS = {
+	'voltage': (plot_voltage, 'vesc_voltage'),
+	'amperage': (plot_amperage, 'vesc_amperage'),
+	'wattage': (plot_wattage, 'vesc_wattage'),
+	'rpm_vs_wattage': (plot_rpm_vs_wattage, 'rpm_vs_wattage'),
+	'brake_current_vs_wattage': (plot_brake_current_vs_wattage, 'brake_current_vs_wattage'),
+	'efficiency_vs_wattage': (plot_efficiency_vs_wattage, 'efficiency_vs_wattage'),
+	'drag_vs_wattage': (plot_drag_vs_wattage, 'drag_vs_wattage')
+}
+
+#shunt / load cell logs that live next to the run files
+EXTRAS = {
+	'generator_shunt_data': 'generator-shunt.csv',
+	'battery_shunt_data': 'battery-shunt.csv',
+	'loadcell_data': 'loadcell.csv'
+}
+
+def use_pyplot(backend = None):
+	#the backend has to be picked before pyplot is imported
+	global plt
+	if plt is None:
+		if backend is not None:
+			mpl.use(backend)
+		import matplotlib.pyplot
+		plt = matplotlib.pyplot
+	return plt
+
+def load_run(filename):
+	#read our main CSV (or a binary raw log)
+	if filename.endswith('.bin'):
+		df = read_dataframe(filename)
+	else:
+		df = pd.read_csv(filename)
+
+	#window in epoch seconds, used to cut the shunt / load cell logs down
+	start_time = df.Time.min()
+	end_time = df.Time.max()
 
-	cubic_interploation_model = interp1d(X_, Y_, kind = "cubic")
-	X2_=np.linspace(X_.min(), X_.max(), 500)
-	Y2_=cubic_interploation_model(X2_)
+	df.Time = pd.to_datetime(df.Time, unit='s')
 
-	#ax.plot(X_, Y_)
-	ax.plot(X2_, Y2_)
+	return df, start_time, end_time
+
+def run_window(filename):
+	#just the time range of a run, without loading the rest of it
+	if filename.endswith('.bin'):
+		t = read_dataframe(filename).Time
+	else:
+		t = pd.read_csv(filename, usecols=['Time'], dtype='float64').Time
+	return t.min(), t.max()
+
+def instrument_name(basename):
+	return pathlib.Path(basename).stem
+
+def extras_files_for(directory):
+	#the files the shunt / load cell data comes from, for the cache keys
+	if options['store']:
+		from columnstore import part_files
+		return [f for basename in EXTRAS.values() for f in part_files(options['store'], instrument_name(basename))]
+	return [os.path.join(directory, basename) for basename in EXTRAS.values() if os.path.isfile(os.path.join(directory, basename))]
+
+def load_store_window(instrument, start_time, end_time):
+	#only the row groups overlapping the window are read, see columnstore.py
+	from columnstore import read
+	data = read(options['store'], instrument, start_time = start_time, end_time = end_time)
+	if len(data) == 0:
+		return None
+	data.Time = pd.to_datetime(data.Time, unit='s')
+	return data
+
+def load_extras(directory, start_time, end_time):
+	extras = {}
+	for name, basename in EXTRAS.items():
+		filename = os.path.join(directory, basename)
+		if options['store']:
+			extras[name] = load_store_window(instrument_name(basename), start_time, end_time)
+		elif os.path.isfile(filename):
+			extras[name] = load_window(filename, start_time, end_time)
+		else:
+			extras[name] = None
+	return extras
+
+def slice_extras(extras, start_time, end_time):
+	start = pd.to_datetime(start_time, unit='s')
+	end = pd.to_datetime(end_time, unit='s')
+
+	sliced = {}
+	for name, data in extras.items():
+		if data is not None:
+			data = data[(data.Time >= start) & (data.Time <= end)]
+		sliced[name] = data
+	return sliced
+
+def set_extras(extras):
+	global battery_shunt_data, generator_shunt_data, loadcell_data, aligned_data
+	battery_shunt_data = extras.get('battery_shunt_data')
+	generator_shunt_data = extras.get('generator_shunt_data')
+	loadcell_data = extras.get('loadcell_data')
+	aligned_data = None
+
+def get_aligned(df):
+	#the run, shunts and load cell resampled onto one time base, cached next to the run
+	global aligned_data
+	if aligned_data is None:
+		directory = os.path.dirname(run_filename) or '.'
+		extras_files = extras_files_for(directory)
+		extras = {'generator_shunt_data': generator_shunt_data, 'battery_shunt_data': battery_shunt_data, 'loadcell_data': loadcell_data}
+		aligned_data = load_aligned(run_filename, df, extras, extras_files,
+			options['align_rate'], options['align_tolerance'], auto_offset = options['auto_offset'])
+	return aligned_data
+
+def graphs_dir_for(filename):
+	graphs_dir = str(pathlib.Path(filename).parent) + '/graphs'
+	pathlib.Path(graphs_dir).mkdir(parents=True, exist_ok=True)
+	return graphs_dir
+
+def png_name(filename, name):
+	return "{}_{}.png".format(pathlib.Path(filename).stem, PLOTS[name][1])
+
+def file_hash(filename):
+	h = hashlib.sha256()
+	with open(filename, "rb") as f:
+		for block in iter(lambda: f.read(1 << 20), b''):
+			h.update(block)
+	return h.hexdigest()
+
+#everything here the plots are drawn with, columnstore.py is only imported with --store
+PLOT_MODULES = ("parse-stats.py", "smoothing.py", "decimate.py", "align.py", "rawlog.py", "timeindex.py", "columnstore.py")
+code_digest = None
+
+def code_hash():
+	#the code doesn't change under us, hash it once
+	global code_digest
+	if code_digest is None:
+		here = os.path.dirname(os.path.realpath(__file__))
+		code_digest = "".join(file_hash(os.path.join(here, f)) for f in PLOT_MODULES)
+	return code_digest
+
+def extras_hash(extras):
+	#only the shunt / load cell rows inside the run's window, so rows logged during later runs
+	#don't redraw this one
+	h = hashlib.sha256()
+	for name in sorted(extras.keys()):
+		data = extras[name]
+		h.update(name.encode('utf-8'))
+		if data is not None:
+			h.update(",".join(data.columns).encode('utf-8'))
+			h.update(pd.util.hash_pandas_object(data, index=False).to_numpy().tobytes())
+	return h.hexdigest()
+
+def render_key(run_hash, extras_digest, name):
+	#the run file, the part of the shunt / load cell logs it covers, the plot settings and the
+	#plotting code itself, so changing any of them redraws it
+	parts = [name, json.dumps(options, sort_keys=True), run_hash, extras_digest, code_hash()]
+	return hashlib.sha256("|".join(parts).encode('utf-8')).hexdigest()
+
+def load_cache(graphs_dir):
+	try:
+		with open(graphs_dir + "/render-cache.json") as f:
+			return json.load(f)
+	except (OSError, ValueError):
+		return {}
+
+def save_cache(graphs_dir, cache):
+	with open(graphs_dir + "/render-cache.json", "w") as f:
+		json.dump(cache, f, indent=1, sort_keys=True)
+
+def process_run(task):
+	#one run in a batch: load it, draw the requested plots into graphs_dir
+	global options, run_filename
+	filename, extras, plots, options = task
+	run_filename = filename
+	use_pyplot('Agg')
+
+	#perf_counter, the sim clock (simvesc) speeds up time.time under the benchmark
+	start = time.perf_counter()
+	df, start_time, end_time = load_run(filename)
+	loaded = time.perf_counter()
+
+	set_extras(extras)
+	graphs_dir = graphs_dir_for(filename)
+
+	rendered = {}
+	for name, key in plots:
+		fig = PLOTS[name][0](df, graphs_dir)
+		fig.savefig("{}/{}".format(graphs_dir, png_name(filename, name)), dpi=options['dpi'])
+		plt.close(fig)
+		rendered[png_name(filename, name)] = key
+	finished = time.perf_counter()
+
+	return {
+		'filename': filename,
+		'rows': len(df),
+		'duration': end_time - start_time,
+		'peak_wattage': df['Gen Wattage'].max() if 'Gen Wattage' in df else float('nan'),
+		'load_time': loaded - start,
+		'render_time': finished - loaded,
+		'rendered': rendered
+	}
+
+def expand_filenames(patterns):
+	filenames = []
+	for pattern in patterns:
+		matches = sorted(glob.glob(pattern))
+		if not matches and os.path.isfile(pattern):
+			matches = [pattern]
+		for filename in matches:
+			if filename not in filenames:
+				filenames.append(filename)
+	return filenames
+
+def run_batch(filenames, plots, jobs = None, force = False):
+	start = time.perf_counter()
+	if jobs is None:
+		jobs = os.cpu_count() or 1
+
+	directories = {}
+	for filename in filenames:
+		directories.setdefault(str(pathlib.Path(filename).parent), []).append(filename)
+
+	#work out what actually needs drawing.  each shunt / load cell log is loaded once per
+	#directory, covering every run in it, and each run is keyed on its own slice of it
+	caches = {}
+	pending = {}
+	run_extras = {}
+	skipped = 0
+	for directory, runs in directories.items():
+		graphs_dir = graphs_dir_for(runs[0])
+		caches[graphs_dir] = load_cache(graphs_dir)
+
+		windows = {filename: run_window(filename) for filename in runs}
+		extras = load_extras(directory, min(w[0] for w in windows.values()), max(w[1] for w in windows.values()))
+
+		for filename in runs:
+			run_extras[filename] = slice_extras(extras, *windows[filename])
+			run_hash = file_hash(filename)
+			extras_digest = extras_hash(run_extras[filename])
+			for name in plots:
+				key = render_key(run_hash, extras_digest, name)
+				png = png_name(filename, name)
+				if not force and caches[graphs_dir].get(png) == key and os.path.isfile(graphs_dir + "/" + png):
+					skipped += 1
+					continue
+				pending.setdefault(filename, []).append((name, key))
+
+	tasks = []
+	for filename, todo in pending.items():
+		#not enough runs to keep every worker busy, give each figure its own task
+		if len(pending) < jobs:
+			for plot in todo:
+				tasks.append((filename, run_extras[filename], [plot], options))
+		else:
+			tasks.append((filename, run_extras[filename], todo, options))
+
+	results = {}
+	if tasks:
+		with ProcessPoolExecutor(max_workers=jobs) as pool:
+			for r in pool.map(process_run, tasks):
+				if r['filename'] in results:
+					results[r['filename']]['load_time'] += r['load_time']
+					results[r['filename']]['render_time'] += r['render_time']
+					results[r['filename']]['rendered'].update(r['rendered'])
+				else:
+					results[r['filename']] = r
+
+	for r in results.values():
+		graphs_dir = graphs_dir_for(r['filename'])
+		caches[graphs_dir].update(r['rendered'])
+	for graphs_dir, cache in caches.items():
+		save_cache(graphs_dir, cache)
+
+	total = time.perf_counter() - start
+
+	if results:
+		print ("{:<60} {:>8} {:>7} {:>8} {:>8} {:>10} {:>8}".format("Run", "Rows", "Secs", "Load", "Render", "Rows/s", "Peak W"))
+	for r in results.values():
+		busy = r['load_time'] + r['render_time']
+		print ("{:<60} {:>8} {:>7.1f} {:>7.2f}s {:>7.2f}s {:>10.0f} {:>8.1f}".format(
+			r['filename'][-60:], r['rows'], r['duration'], r['load_time'], r['render_time'],
+			r['rows'] / busy if busy else 0, r['peak_wattage']))
+	print ("{} runs, {} plots rendered, {} unchanged, in {:.1f}s".format(
+		len(results), sum(len(r['rendered']) for r in results.values()), skipped, total))
+
+	return list(results.values())
 
 if __name__ == '__main__':
 	parser = argparse.ArgumentParser(description='Process Motor Stats')
-	parser.add_argument('filename', help='Name of CSV file to parse')
+	parser.add_argument('filename', nargs='+', help='CSV files or binary raw logs to parse (wildcards ok, more than one runs a batch)')
+
+	parser.add_argument('--jobs', help='Worker processes for batch / headless mode', type=int, default=None)
+	parser.add_argument('--dpi', help='Resolution of saved graphs', type=int, default=200)
+
+	parser.add_argument('--decimate', help='How to thin out long time series', choices=['lttb', 'minmax', 'none'], default='lttb')
+
+	parser.add_argument('--align_rate', help='Common time base for aligned plots (Hz)', type=float, default=10.0)
+	parser.add_argument('--align_tolerance', help='Max gap (s) before a source counts as missing in aligned plots', type=float, default=1.0)
+
+	parser.add_argument('--auto_offset', dest='auto_offset', action='store_true', help='Estimate the generator shunt clock offset from its wattage')
+	parser.set_defaults(auto_offset=False)
+
+	parser.add_argument('--store', help='Read the shunts / load cell from this parquet store (see columnstore.py)', default=None)
+
+	parser.add_argument('--headless', dest='headless', action='store_true', help='Save every graph to disk (Agg backend) instead of showing it')
+	parser.set_defaults(headless=False)
+
+	parser.add_argument('--force', dest='force', action='store_true', help='Redraw graphs even if their inputs have not changed')
+	parser.set_defaults(force=False)
 
 	parser.add_argument('--show', dest='show', action='store_true')
 	parser.set_defaults(show=False)
@@ -161,6 +547,12 @@ if __name__ == '__main__':
 	parser.add_argument('--brake_current_vs_wattage', dest='brake_current_vs_wattage', action='store_true')
 	parser.set_defaults(brake_current_vs_wattage=False)
 
+	parser.add_argument('--efficiency_vs_wattage', dest='efficiency_vs_wattage', action='store_true')
+	parser.set_defaults(efficiency_vs_wattage=False)
+
+	parser.add_argument('--drag_vs_wattage', dest='drag_vs_wattage', action='store_true')
+	parser.set_defaults(drag_vs_wattage=False)
+
 	args = parser.parse_args()
 
 	pd.set_option('display.max_columns', None)
@@ -168,62 +560,39 @@ if __name__ == '__main__':
 	
 	mpl.rcParams['lines.linewidth'] = 1
 
-	#read our main CSV
-	df = pd.read_csv(args.filename)
-	df.Time = pd.to_datetime(df.Time, unit='s')
-	
+	plots = [name for name in PLOTS.keys() if getattr(args, name)]
+
+	options['dpi'] = args.dpi
+	options['decimate'] = args.decimate
+	options['align_rate'] = args.align_rate
+	options['align_tolerance'] = args.align_tolerance
+	options['auto_offset'] = args.auto_offset
+	options['store'] = args.store
+
+	#more than one run, or no display: render in a process pool and write the graphs to disk
+	filenames = expand_filenames(args.filename)
+	if len(filenames) > 1 or args.headless:
+		use_pyplot('Agg')
+		run_batch(filenames, plots, args.jobs, args.force)
+		exit()
+
+	use_pyplot()
+	filename = filenames[0] if filenames else args.filename[0]
+	run_filename = filename
+	df, start_time, end_time = load_run(filename)
+
 	#pprint(df.head())	
 	#pprint(df.describe())
 
-	start_time = df.Time.min(0)
-	end_time = df.Time.max(0)
-
 	#where to put our graphs
-	p = pathlib.Path(args.filename)
-	graphs_dir = str(p.parent) + '/graphs'
-	pathlib.Path(graphs_dir).mkdir(parents=True, exist_ok=True)
+	graphs_dir = graphs_dir_for(filename)
 
-	#generator shunt?
-	generator_shunt_filename = str(p.parent) + "/generator-shunt.csv"
-	if os.path.isfile(generator_shunt_filename):
-		generator_shunt_data = pd.read_csv(generator_shunt_filename)
-		generator_shunt_data.Time = pd.to_datetime(generator_shunt_data.Time, unit='s')
-		mask = (generator_shunt_data['Time'] >= str(start_time)) & (generator_shunt_data['Time'] <= str(end_time))
-		generator_shunt_data = generator_shunt_data.loc[mask]
-
-	#battery shunt?
-	battery_shunt_filename = str(p.parent) + "/battery-shunt.csv"
-	if os.path.isfile(battery_shunt_filename):
-		battery_shunt_data = pd.read_csv(battery_shunt_filename)
-		battery_shunt_data.Time = pd.to_datetime(battery_shunt_data.Time, unit='s')
-		mask = (battery_shunt_data['Time'] >= str(start_time)) & (battery_shunt_data['Time'] <= str(end_time))
-		battery_shunt_data = battery_shunt_data.loc[mask]
-		#battery_shunt_data['Amperage'] = battery_shunt_data['Amperage'].apply(lambda x: abs(x))
-		
-
-	#load cell?
-	loadcell_filename = str(p.parent) + "/loadcell.csv"
-	if os.path.isfile(loadcell_filename):
-		loadcell_data = pd.read_csv(loadcell_filename)
-		loadcell_data.Time = pd.to_datetime(loadcell_data.Time, unit='s')
-		mask = (loadcell_data['Time'] >= str(start_time)) & (loadcell_data['Time'] <= str(end_time))
-		loadcell_data = loadcell_data.loc[mask]
-
-	if args.voltage:
-		plot_voltage(df, graphs_dir)
-
-	if args.amperage:
-		plot_amperage(df, graphs_dir)
-	
-	if args.wattage:
-		plot_wattage(df, graphs_dir)
+	#generator shunt, battery shunt, load cell?
+	set_extras(load_extras(str(pathlib.Path(filename).parent), start_time, end_time))
+	#battery_shunt_data['Amperage'] = battery_shunt_data['Amperage'].apply(lambda x: abs(x))
 
-	if args.rpm_vs_wattage:
-		plot_rpm_vs_wattage(df, graphs_dir)
-
-	if args.brake_current_vs_wattage:
-		plot_brake_current_vs_wattage(df, graphs_dir)
+	for name in plots:
+		PLOTS[name][0](df, graphs_dir)
 	
 	if (args.show):
 		plt.show()
-
@@ -0,0 +1,120 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import argparse
+import csv
+import glob
+import json
+import math
+import os
+import struct
+import numpy as np
+
+#file layout:
+#	8 bytes   magic
+#	4 bytes   header length (little endian uint32, includes padding)
+#	n bytes   json header: column keys + labels, padded with spaces to a multiple of 8
+#	records   one little endian float64 per column, time first.  missing values are NaN.
+
+MAGIC = b'THOTRAW1'
+VERSION = 1
+
+class RawLogWriter():
+
+	def __init__(self, filename, names, buffer_size = 1 << 16):
+		self.keys = ['time'] + list(names.keys())
+		self.labels = ['Time'] + list(names.values())
+		self.record = struct.Struct('<{}d'.format(len(self.keys)))
+
+		header = json.dumps({'version': VERSION, 'columns': self.keys, 'labels': self.labels}).encode('utf-8')
+		header += b' ' * (-(len(MAGIC) + 4 + len(header)) % 8)
+
+		self.file = open(filename, "wb", buffering=buffer_size)
+		self.file.write(MAGIC)
+		self.file.write(struct.pack('<I', len(header)))
+		self.file.write(header)
+
+	def writerow(self, row):
+		#same call as csv.writer so ThotLogger doesn't care which one it has
+		self.file.write(self.record.pack(*[math.nan if v is None else v for v in row]))
+
+	def writerows(self, rows):
+		for row in rows:
+			self.writerow(row)
+
+	def flush(self):
+		self.file.flush()
+
+	def fileno(self):
+		return self.file.fileno()
+
+	def close(self):
+		self.file.close()
+
+def read_header(filename):
+	with open(filename, "rb") as f:
+		magic = f.read(len(MAGIC))
+		if magic != MAGIC:
+			raise ValueError("{} is not a raw log".format(filename))
+		(length,) = struct.unpack('<I', f.read(4))
+		header = json.loads(f.read(length).decode('utf-8'))
+
+	header['offset'] = len(MAGIC) + 4 + length
+	header['dtype'] = np.dtype([(key, '<f8') for key in header['columns']])
+	return header
+
+def read_raw(filename):
+	#memory maps the records, so opening a huge log costs nothing until you touch the data
+	header = read_header(filename)
+	dtype = header['dtype']
+
+	#a log cut short by a crash may end in a partial record, ignore it
+	count = (os.path.getsize(filename) - header['offset']) // dtype.itemsize
+	if count <= 0:
+		return np.zeros(0, dtype=dtype)
+
+	return np.memmap(filename, dtype=dtype, mode='r', offset=header['offset'], shape=(count,))
+
+def read_dataframe(filename):
+	#same column names as the legacy raw csv
+	import pandas as pd
+
+	header = read_header(filename)
+	data = read_raw(filename)
+	df = pd.DataFrame({label: np.asarray(data[key]) for key, label in zip(header['columns'], header['labels'])})
+	return df
+
+def to_csv(filename, csv_filename = None):
+	if csv_filename is None:
+		csv_filename = os.path.splitext(filename)[0] + ".csv"
+
+	header = read_header(filename)
+	data = read_raw(filename)
+
+	with open(csv_filename, "w", newline='') as f:
+		writer = csv.writer(f)
+		writer.writerow(header['labels'])
+		for record in data.tolist():
+			writer.writerow(['' if math.isnan(v) else v for v in record])
+
+	return csv_filename
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Inspect or convert binary raw logs')
+	parser.add_argument('filenames', nargs='+', help='Raw log files (wildcards ok)')
+
+	parser.add_argument('--csv', dest='csv', action='store_true', help='Write a legacy CSV next to each log')
+	parser.set_defaults(csv=False)
+
+	args = parser.parse_args()
+
+	for pattern in args.filenames:
+		for filename in sorted(glob.glob(pattern)) or [pattern]:
+			if args.csv:
+				print ("{} -> {}".format(filename, to_csv(filename)))
+			else:
+				header = read_header(filename)
+				data = read_raw(filename)
+				print ("{}: {} records, {} columns".format(filename, len(data), len(header['columns'])))
+				if len(data):
+					print ("\t{:.3f}s to {:.3f}s".format(data['time'][0], data['time'][-1]))
@@ -0,0 +1,266 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import argparse
+import json
+import os
+import threading
+import time
+from pathlib import Path
+import serial
+import serial.tools.list_ports
+from writerthread import BackgroundWriter
+from loadcell import LoadcellReader
+from timeindex import IndexedCsv
+
+def find_port(serial_number):
+	for port in serial.tools.list_ports.comports():
+		if port.serial_number == serial_number:
+			return port.device
+	return None
+
+class SessionClock():
+
+	#every instrument stamps its rows from this one monotonic clock.  it is reported as
+	#epoch seconds so the files still line up with anything logged with time.time()
+
+	def __init__(self):
+		self.wall_start = time.time()
+		self.mono_start = time.monotonic()
+
+	def now(self):
+		return self.wall_start + (time.monotonic() - self.mono_start)
+
+class SessionStore():
+
+	#one directory with one (time indexed) csv per stream, all written through a single background writer.
+	#with a parquet store the streams go there instead, as run=<session>/instrument=<stream>
+
+	def __init__(self, directory, clock, parquet = None):
+		self.directory = directory
+		self.clock = clock
+		self.parquet = parquet
+		self.run = time.strftime("%Y%m%d-%H%M%S", time.localtime(clock.wall_start))
+		self.writer = BackgroundWriter()
+		self.streams = {}
+
+		Path(directory).mkdir(parents=True, exist_ok=True)
+
+	def stream(self, name, header):
+		if name not in self.streams:
+			if self.parquet is not None:
+				from columnstore import ParquetSink
+				f = ParquetSink(self.parquet, self.run, name, header)
+			else:
+				f = IndexedCsv(os.path.join(self.directory, name + ".csv"), header)
+			self.streams[name] = self.writer.wrap(f, f)
+		return self.streams[name]
+
+	def write_manifest(self, sources, finished = False):
+		manifest = {
+			'start_time': self.clock.wall_start,
+			'end_time': self.clock.now() if finished else None,
+			'store': self.parquet,
+			'run': self.run,
+			'streams': sorted(self.streams.keys()),
+			'sources': sources,
+			'writer': self.writer.get_stats()
+		}
+		with open(os.path.join(self.directory, "session.json"), "w") as f:
+			json.dump(manifest, f, indent=2)
+
+	def close(self):
+		self.writer.close()
+
+class StopRecording(Exception):
+	pass
+
+class SerialSource(threading.Thread):
+
+	def __init__(self, name, serial_number = None, port = None):
+		threading.Thread.__init__(self, name=name, daemon=True)
+		self.serial_number = serial_number
+		self.port = port
+		self.running = False
+		self.rows = 0
+		self.error = None
+
+	def find(self):
+		if self.port is None and self.serial_number is not None:
+			self.port = find_port(self.serial_number)
+		if self.port is None:
+			print ("{}: could not find {}".format(self.name, self.serial_number))
+		return self.port
+
+	def start(self):
+		self.running = True
+		threading.Thread.start(self)
+
+	def stop(self):
+		self.running = False
+		self.join(timeout = 2)
+
+	def describe(self):
+		return {'type': type(self).__name__, 'serial': self.serial_number, 'port': self.port, 'rows': self.rows, 'error': self.error}
+
+class ShuntSource(SerialSource):
+
+	#a Victron SmartShunt on VE.Direct
+
+	header = ("Time", "Voltage", "Amperage", "Wattage")
+
+	def __init__(self, name, stream, clock, serial_number = None, port = None, timeout = 60):
+		SerialSource.__init__(self, name, serial_number, port)
+		self.stream = stream
+		self.clock = clock
+		self.timeout = timeout
+
+	def run(self):
+		import vedirect
+
+		if not self.find():
+			return
+
+		try:
+			ve = vedirect.Vedirect(self.port, self.timeout)
+			ve.read_data_callback(self.callback)
+		except StopRecording:
+			pass
+		except Exception as e:
+			self.error = str(e)
+			print ("{}: {}".format(self.name, e))
+
+	def callback(self, packet):
+		if not self.running:
+			raise StopRecording()
+
+		t = self.clock.now()
+		voltage = int(packet.get('V', 0)) / 1000.0
+		amperage = int(packet.get('I', 0)) / 1000.0
+		wattage = packet.get('P', 0)
+
+		self.stream.writerow((t, voltage, amperage, wattage))
+		self.rows += 1
+
+class LoadcellSource(SerialSource):
+
+	#the HX711-Reader sketch
+
+	header = ("Time", "Force")
+
+	def __init__(self, name, stream, clock, serial_number = None, port = None, binary = True):
+		SerialSource.__init__(self, name, serial_number, port)
+		self.stream = stream
+		self.clock = clock
+		self.binary = binary
+		self.baudrate = 115200 if binary else 9600
+
+	def run(self):
+		if not self.find():
+			return
+
+		try:
+			ser = serial.Serial(port=self.port, baudrate=self.baudrate, timeout=0.5)
+		except Exception as e:
+			self.error = str(e)
+			print ("{}: error opening serial port: {}".format(self.name, e))
+			return
+
+		ser.reset_input_buffer()
+		reader = LoadcellReader(ser, clock = self.clock.now, binary = self.binary)
+		try:
+			while self.running:
+				samples = reader.read()
+				self.stream.writerows(samples)
+				self.rows += len(samples)
+		finally:
+			ser.close()
+
+class Recorder():
+
+	#reads the shunts, load cell and VESCs in one process, all stamped by one clock
+
+	vesc_header = ("Time", "RPM", "Voltage", "Amperage", "FET Temp", "Motor Temp", "Fault")
+
+	def __init__(self, directory = "output", parquet = None):
+		self.clock = SessionClock()
+		self.store = SessionStore(directory, self.clock, parquet)
+		self.sources = []
+		self.vescs = {}
+
+	def add_shunt(self, name, serial_number = None, port = None):
+		stream = self.store.stream(name, ShuntSource.header)
+		self.sources.append(ShuntSource(name, stream, self.clock, serial_number, port))
+
+	def add_loadcell(self, name, serial_number = None, port = None, binary = True):
+		stream = self.store.stream(name, LoadcellSource.header)
+		self.sources.append(LoadcellSource(name, stream, self.clock, serial_number, port, binary))
+
+	def attach(self, pair):
+		#VESCs are polled by a VescPair, we just listen in and lend it our clock
+		for poller, name in ((pair.generator, "generator-vesc"), (pair.driver, "driver-vesc")):
+			poller.clock = self.clock.now
+			poller.listeners.append(self.vesc_listener(poller, name))
+
+	def vesc_listener(self, poller, name):
+		stream = self.store.stream(name, self.vesc_header)
+		self.vescs[name] = 0
+
+		def listener(timestamp, measurements):
+			rpm = abs(measurements.rpm / (poller.motor.conf.motor_poles / 2))
+			stream.writerow((timestamp, rpm, measurements.v_in, measurements.avg_input_current,
+				measurements.temp_fet, measurements.temp_motor, int(measurements.mc_fault_code)))
+			self.vescs[name] += 1
+
+		return listener
+
+	def start(self):
+		for source in self.sources:
+			source.start()
+		self.store.write_manifest(self.describe())
+
+	def stop(self):
+		for source in self.sources:
+			source.stop()
+		self.store.write_manifest(self.describe(), finished = True)
+		self.store.close()
+
+	def __enter__(self):
+		self.start()
+		return self
+
+	def __exit__(self, *args):
+		self.stop()
+
+	def describe(self):
+		sources = {source.name: source.describe() for source in self.sources}
+		for name, rows in self.vescs.items():
+			sources[name] = {'type': 'VescPoller', 'rows': rows}
+		return sources
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Record shunts and load cell into one session')
+	parser.add_argument('--dir', help='Directory to write the session to', default='output')
+	parser.add_argument('--battery-shunt', help='Serial # of the battery shunt', default=None)
+	parser.add_argument('--generator-shunt', help='Serial # of the generator shunt', default=None)
+	parser.add_argument('--loadcell', help='Serial # of the load cell Arduino', default=None)
+	parser.add_argument('--store', help='Write to this parquet store instead of csv files', default=None)
+
+	args = parser.parse_args()
+
+	recorder = Recorder(args.dir, args.store)
+	if args.battery_shunt:
+		recorder.add_shunt("battery-shunt", args.battery_shunt)
+	if args.generator_shunt:
+		recorder.add_shunt("generator-shunt", args.generator_shunt)
+	if args.loadcell:
+		recorder.add_loadcell("loadcell", args.loadcell)
+
+	recorder.start()
+	try:
+		while True:
+			time.sleep(1)
+			print ("[{}] {}".format(time.ctime(), ", ".join("{}: {}".format(name, s['rows']) for name, s in recorder.describe().items())))
+	except KeyboardInterrupt:
+		pass
+	recorder.stop()
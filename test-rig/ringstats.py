@@ -0,0 +1,112 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import math
+import numpy as np
+
+class RingStats():
+
+	#preallocated ring buffer with one column per channel.  running count / mean / variance (welford)
+	#and min / max are updated on every push, so reading them back is O(1) no matter how many
+	#samples went in.  the ring itself only keeps the most recent `capacity` samples per channel.
+
+	def __init__(self, names, capacity = 4096):
+		self.names = []
+		self.columns = {}
+		self.capacity = capacity
+		self.data = np.full((capacity, 0), np.nan)
+
+		self.heads = []
+		self.counts = []
+		self.means = []
+		self.m2s = []
+		self.mins = []
+		self.maxs = []
+
+		for name in names:
+			self.add_column(name)
+
+	def add_column(self, name):
+		self.columns[name] = len(self.names)
+		self.names.append(name)
+		self.data = np.hstack((self.data, np.full((self.capacity, 1), np.nan)))
+
+		self.heads.append(0)
+		self.counts.append(0)
+		self.means.append(0.0)
+		self.m2s.append(0.0)
+		self.mins.append(math.inf)
+		self.maxs.append(-math.inf)
+
+	def reset(self):
+		for col in range(len(self.names)):
+			self.heads[col] = 0
+			self.counts[col] = 0
+			self.means[col] = 0.0
+			self.m2s[col] = 0.0
+			self.mins[col] = math.inf
+			self.maxs[col] = -math.inf
+
+	def push(self, name, value):
+		if value is None:
+			return
+
+		col = self.columns.get(name)
+		if col is None:
+			self.add_column(name)
+			col = self.columns[name]
+
+		value = float(value)
+
+		head = self.heads[col]
+		self.data[head, col] = value
+		self.heads[col] = (head + 1) % self.capacity
+
+		count = self.counts[col] + 1
+		delta = value - self.means[col]
+		mean = self.means[col] + delta / count
+		self.m2s[col] += delta * (value - mean)
+		self.means[col] = mean
+		self.counts[col] = count
+
+		if value < self.mins[col]:
+			self.mins[col] = value
+		if value > self.maxs[col]:
+			self.maxs[col] = value
+
+	def count(self, name):
+		return self.counts[self.columns[name]]
+
+	def mean(self, name):
+		#None samples (a missed read) are skipped by push(), a channel with nothing in it reads 0
+		return self.means[self.columns[name]]
+
+	def variance(self, name):
+		col = self.columns[name]
+		if self.counts[col] < 2:
+			return 0.0
+		return self.m2s[col] / (self.counts[col] - 1)
+
+	def stddev(self, name):
+		return math.sqrt(self.variance(name))
+
+	def min(self, name):
+		col = self.columns[name]
+		if self.counts[col] == 0:
+			return 0
+		return self.mins[col]
+
+	def max(self, name):
+		col = self.columns[name]
+		if self.counts[col] == 0:
+			return 0
+		return self.maxs[col]
+
+	def values(self, name):
+		#the samples still in the ring, oldest first
+		col = self.columns[name]
+		count = min(self.counts[col], self.capacity)
+		head = self.heads[col]
+		if count < self.capacity:
+			return self.data[:count, col].copy()
+		return np.concatenate((self.data[head:, col], self.data[:head, col]))
@@ -0,0 +1,131 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import math
+import time
+
+#fixed rate loop for the test functions.  ticks sit on a grid of deadlines from one monotonic
+#start time, so they don't drift with how long the work took, and ramps computed from the tick
+#time have the same resolution whatever the serial latency.  reports (averages, print_line) run
+#on their own, slower, grid from the same start.
+
+#histogram bin edges, milliseconds
+BINS = (0, 0.1, 0.2, 0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, math.inf)
+
+class Histogram():
+
+	def __init__(self, bins = BINS):
+		self.bins = bins
+		self.counts = [0] * (len(bins) - 1)
+		self.count = 0
+		self.total = 0.0
+		self.max = 0.0
+
+	def add(self, seconds):
+		ms = seconds * 1000
+		self.count += 1
+		self.total += ms
+		self.max = max(self.max, ms)
+		for i in range(len(self.counts)):
+			if ms < self.bins[i + 1]:
+				self.counts[i] += 1
+				break
+
+	def get_stats(self):
+		return {
+			'count': self.count,
+			'mean_ms': self.total / self.count if self.count else 0.0,
+			'max_ms': self.max,
+			'bins_ms': [b if b != math.inf else None for b in self.bins],
+			'histogram': list(self.counts)
+		}
+
+class RateScheduler():
+
+	def __init__(self, rate, report_rate = 4.0, first_report = None):
+		self.period = 1.0 / rate
+		self.report_period = 1.0 / report_rate
+		self.first_report = self.report_period if first_report is None else first_report
+
+		self.jitter = Histogram()		#how late we woke up for a deadline we waited for
+		self.overrun = Histogram()		#how far past its deadline the work ran, when it did
+		self.ticks = 0
+		self.missed = 0
+		self.reports = 0
+		self.start_time = None
+
+	def now(self):
+		#looked up every time, so simvesc's scaled clock applies
+		return time.monotonic()
+
+	def start(self):
+		self.start_time = self.now()
+		self.index = 0
+		self.next_report = self.first_report
+
+	def elapsed(self):
+		#scheduled time of the current tick since start, not wall time
+		return self.index * self.period
+
+	def wait(self):
+		deadline = self.start_time + self.index * self.period
+		now = self.now()
+		late = now - deadline
+
+		if late > 0:
+			#the work overran into this tick.  skip whole ticks we can't make any more rather
+			#than bunching samples up to catch up
+			self.overrun.add(late)
+			missed = int(late // self.period)
+			if missed:
+				self.missed += missed
+				self.index += missed
+		else:
+			time.sleep(-late)
+			self.jitter.add(max(self.now() - deadline, 0.0))
+
+		self.ticks += 1
+
+	def tick(self):
+		if self.start_time is None:
+			self.start()
+		else:
+			self.index += 1
+		self.wait()
+		return self.elapsed()
+
+	def run(self, duration = None):
+		#one scheduled time per tick, for duration seconds (forever if None)
+		while True:
+			t = self.tick()
+			if duration is not None and t > duration:
+				return
+			yield t
+
+	def report_due(self):
+		#true once per report period, on the same tick grid
+		if self.elapsed() < self.next_report:
+			return False
+		while self.next_report <= self.elapsed():
+			self.next_report += self.report_period
+		self.reports += 1
+		return True
+
+	def get_stats(self):
+		wall = self.now() - self.start_time if self.start_time is not None else 0.0
+		return {
+			'rate': 1.0 / self.period,
+			'report_rate': 1.0 / self.report_period,
+			'ticks': self.ticks,
+			'missed': self.missed,
+			'reports': self.reports,
+			'achieved_rate': self.ticks / wall if wall > 0 else 0.0,
+			'jitter': self.jitter.get_stats(),
+			'overrun': self.overrun.get_stats()
+		}
+
+	def summary(self):
+		s = self.get_stats()
+		return "{:.1f}/{:.0f} Hz, {} ticks, {} overran (max {:.1f}ms), {} missed, jitter mean {:.2f}ms max {:.2f}ms".format(
+			s['achieved_rate'], s['rate'], s['ticks'], s['overrun']['count'], s['overrun']['max_ms'], s['missed'],
+			s['jitter']['mean_ms'], s['jitter']['max_ms'])
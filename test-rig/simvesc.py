@@ -0,0 +1,351 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import math
+import random
+import threading
+import time
+from types import SimpleNamespace
+
+#software in the loop stand in for pyvesc.VESC, so the experiment scripts can run on a laptop.
+#every SimVESC is a motor on one shared shaft (SimRig): the driver spins it, the generator brakes
+#it, and in boat mode a turbine in the water drives it.  a SimClock can run all of it faster than
+#real time by patching time.time / time.monotonic / time.sleep.
+
+#mc_fault_code values, as in the VESC firmware
+FAULT_CODES = [
+	'FAULT_CODE_NONE',
+	'FAULT_CODE_OVER_VOLTAGE',
+	'FAULT_CODE_UNDER_VOLTAGE',
+	'FAULT_CODE_DRV',
+	'FAULT_CODE_ABS_OVER_CURRENT',
+	'FAULT_CODE_OVER_TEMP_FET',
+	'FAULT_CODE_OVER_TEMP_MOTOR',
+	'FAULT_CODE_GATE_DRIVER_OVER_VOLTAGE',
+	'FAULT_CODE_GATE_DRIVER_UNDER_VOLTAGE',
+	'FAULT_CODE_MCU_UNDER_VOLTAGE',
+	'FAULT_CODE_BOOTING_FROM_WATCHDOG_RESET'
+]
+
+FAULT_OVER_TEMP_FET = 5
+FAULT_OVER_TEMP_MOTOR = 6
+
+class SimClock():
+
+	#time.time() and time.monotonic() run speed times faster, time.sleep() sleeps 1/speed as long
+
+	def __init__(self, speed = 1.0):
+		self.speed = speed
+		self.real_time = time.time
+		self.real_monotonic = time.monotonic
+		self.real_sleep = time.sleep
+		self.wall_start = self.real_time()
+		self.mono_start = self.real_monotonic()
+		self.installed = False
+
+	def elapsed(self):
+		return (self.real_monotonic() - self.mono_start) * self.speed
+
+	def time(self):
+		return self.wall_start + self.elapsed()
+
+	def monotonic(self):
+		return self.mono_start + self.elapsed()
+
+	def sleep(self, seconds):
+		if seconds > 0:
+			self.real_sleep(seconds / self.speed)
+
+	def install(self):
+		#threading keeps its own reference to the real monotonic, so lock and queue timeouts
+		#stay in real seconds.  that only makes them more patient.
+		if self.speed != 1.0 and not self.installed:
+			time.time = self.time
+			time.monotonic = self.monotonic
+			time.sleep = self.sleep
+			self.installed = True
+		return self
+
+	def uninstall(self):
+		if self.installed:
+			time.time = self.real_time
+			time.monotonic = self.real_monotonic
+			time.sleep = self.real_sleep
+			self.installed = False
+
+class SimRig():
+
+	#the shaft, the battery and a turbine.  state is advanced lazily whenever a VESC is talked to,
+	#in steps of at most max_step simulated seconds.
+
+	def __init__(self, clock = None, inertia = 0.004, friction = 2e-4, battery_voltage = 48.0, battery_resistance = 0.05,
+		flow = 0.0, turbine_a = 8.0, turbine_b = 0.02, ambient = 25.0, max_step = 0.001):
+		self.clock = clock if clock is not None else SimClock()
+		self.inertia = inertia
+		self.friction = friction
+		self.battery_voltage = battery_voltage
+		self.battery_resistance = battery_resistance
+		self.flow = flow
+		self.turbine_a = turbine_a
+		self.turbine_b = turbine_b
+		self.ambient = ambient
+		self.max_step = max_step
+
+		self.lock = threading.RLock()
+		self.motors = []
+		self.w = 0.0
+		self.v_in = battery_voltage
+		self.last = self.clock.elapsed()
+
+	def add(self, vesc):
+		with self.lock:
+			self.motors.append(vesc)
+
+	def turbine_torque(self):
+		if self.flow <= 0:
+			return 0.0
+		return max(0.0, self.turbine_a * self.flow * self.flow - self.turbine_b * self.flow * self.w)
+
+	def advance(self):
+		with self.lock:
+			now = self.clock.elapsed()
+			gap = now - self.last
+			self.last = now
+			if gap <= 0:
+				return
+
+			#long sleeps at high speed would be a lot of steps, take bigger ones past 20000
+			steps = max(1, min(int(math.ceil(gap / self.max_step)), 20000))
+			dt = gap / steps
+			for _ in range(steps):
+				self.step(dt)
+
+	def step(self, dt):
+		w = self.w
+
+		#everything but the speed controllers
+		torque = self.turbine_torque() - self.friction * w
+		speed = []
+		for m in self.motors:
+			if m.mode == 'rpm' or m.mode == 'duty':
+				speed.append(m)
+			else:
+				torque += m.torque(w)
+
+		#speed controllers make up the difference to reach their target within tau
+		for m in speed:
+			m.speed_torque(w, torque / len(speed), self.inertia, dt)
+			torque += m.current * m.kt
+
+		self.w = max(0.0, w + torque / self.inertia * dt)
+
+		bus = 0.0
+		for m in self.motors:
+			bus += m.electrical(self.w, self.v_in, dt, self.ambient)
+		self.v_in = self.battery_voltage - self.battery_resistance * bus
+
+class SimVESC():
+
+	#the parts of pyvesc.VESC that thot-experiment.py and boat-tester.py use
+
+	fault_codes = FAULT_CODES
+
+	rig = None				#shared shaft for VESCs created with just a serial port
+	latency = 0.002			#serial round trip, seconds (simulated)
+	jitter = 0.0005
+	timeout = 0.1			#how long a lost reply takes to notice
+	timeout_rate = 0.0		#fraction of get_measurements() calls that get no reply
+	fault_rate = 0.0		#chance per call of a random DRV / over current fault
+
+	@staticmethod
+	def get_vesc_serial_port_by_uuid(uuid):
+		return "sim:{:x}".format(uuid)
+
+	def __init__(self, serial_port = None, rig = None, kv = 190, poles = 14, resistance = 0.03, max_current = 60.0,
+		speed_tau = 0.05, thermal_resistance = (0.4, 0.8), thermal_tau = (60.0, 600.0), seed = None):
+		if rig is None:
+			if SimVESC.rig is None:
+				SimVESC.rig = SimRig()
+			rig = SimVESC.rig
+		self.rig = rig
+		self.serial_port = serial_port
+		self.random = random.Random(seed if seed is not None else serial_port)
+		self.uuid = int(serial_port[4:], 16) if serial_port and serial_port.startswith("sim:") else self.random.getrandbits(96)
+
+		self.kt = 60 / (2 * math.pi * kv)
+		self.resistance = resistance
+		self.max_current = max_current
+		self.speed_tau = speed_tau
+		self.conf = SimpleNamespace(motor_poles = poles, l_current_max = max_current, l_current_min = -max_current)
+
+		#fet, motor: temperature rise per watt of loss and time constant
+		self.thermal_resistance = thermal_resistance
+		self.thermal_tau = thermal_tau
+		self.temp_fet = rig.ambient
+		self.temp_motor = rig.ambient
+
+		self.mode = 'off'
+		self.setpoint = 0.0
+		self.current = 0.0
+		self.input_current = 0.0
+		self.fault = 0
+		self.tachometer = 0.0
+
+		rig.add(self)
+
+	def pole_pairs(self):
+		return self.conf.motor_poles / 2
+
+	#physics, called by SimRig with its lock held
+	def torque(self, w):
+		if self.fault:
+			self.current = 0.0
+		elif self.mode == 'current':
+			self.current = max(-self.max_current, min(self.max_current, self.setpoint))
+			#out of voltage, can't push any more current in
+			if self.current > 0 and self.kt * w >= self.rig.v_in:
+				self.current = 0.0
+		elif self.mode == 'brake':
+			self.current = -min(abs(self.setpoint), self.max_current) if w > 0.5 else 0.0
+		else:
+			self.current = 0.0
+		return self.current * self.kt
+
+	def speed_torque(self, w, others, inertia, dt):
+		if self.fault:
+			self.current = 0.0
+			return
+		if self.mode == 'duty':
+			target = self.setpoint * self.rig.v_in / self.kt
+		else:
+			target = self.setpoint / self.pole_pairs() * (2 * math.pi / 60)
+		needed = inertia * (target - w) / max(self.speed_tau, dt) - others
+		self.current = max(-self.max_current, min(self.max_current, needed / self.kt))
+
+	def electrical(self, w, v_in, dt, ambient):
+		#input power = mechanical + copper loss, a generator's is negative
+		loss = self.resistance * self.current * self.current
+		self.input_current = (self.kt * w * self.current + loss) / max(v_in, 1.0)
+		self.tachometer += w * dt / (2 * math.pi) * self.conf.motor_poles * 3
+
+		#conduction about half the copper loss, switching a small part of what goes through
+		fet_loss = 0.5 * loss + 0.002 * abs(self.input_current * v_in)
+		self.temp_fet += (ambient + self.thermal_resistance[0] * fet_loss - self.temp_fet) * dt / self.thermal_tau[0]
+		self.temp_motor += (ambient + self.thermal_resistance[1] * loss - self.temp_motor) * dt / self.thermal_tau[1]
+		if self.temp_fet > 95 and not self.fault:
+			self.fault = FAULT_OVER_TEMP_FET
+		if self.temp_motor > 120 and not self.fault:
+			self.fault = FAULT_OVER_TEMP_MOTOR
+
+		return self.input_current
+
+	#serial side
+	def talk(self):
+		self.rig.advance()
+		delay = self.latency + self.random.gauss(0, self.jitter)
+		time.sleep(max(delay, 0))
+		self.rig.advance()
+		if self.fault_rate and self.random.random() < self.fault_rate:
+			with self.rig.lock:
+				self.fault = self.random.choice((3, 4))
+
+	def command(self, mode, setpoint):
+		self.talk()
+		with self.rig.lock:
+			self.mode = mode
+			self.setpoint = setpoint
+			#like the real thing, a new command clears a latched fault
+			self.fault = 0
+
+	def inject_fault(self, code):
+		with self.rig.lock:
+			self.fault = code
+
+	def get_measurements(self):
+		if self.timeout_rate and self.random.random() < self.timeout_rate:
+			time.sleep(self.timeout)
+			return None
+
+		self.talk()
+		with self.rig.lock:
+			rig = self.rig
+			return SimpleNamespace(
+				temp_fet = self.temp_fet,
+				temp_motor = self.temp_motor,
+				avg_motor_current = self.current,
+				avg_input_current = self.input_current,
+				avg_id = 0.0,
+				avg_iq = self.current,
+				duty_cycle_now = min(1.0, rig.w * self.kt / max(rig.v_in, 1.0)),
+				rpm = rig.w * (60 / (2 * math.pi)) * self.pole_pairs(),
+				v_in = rig.v_in,
+				amp_hours = 0.0,
+				amp_hours_charged = 0.0,
+				watt_hours = 0.0,
+				watt_hours_charged = 0.0,
+				tachometer = int(self.tachometer),
+				tachometer_abs = int(self.tachometer),
+				mc_fault_code = self.fault
+			)
+
+	def get_firmware_version(self):
+		return "sim"
+
+	def get_rpm(self):
+		m = self.get_measurements()
+		return m.rpm if m is not None else 0
+
+	def get_duty_cycle(self):
+		return self.get_measurements().duty_cycle_now
+
+	def get_v_in(self):
+		return self.get_measurements().v_in
+
+	def get_motor_current(self):
+		return self.get_measurements().avg_motor_current
+
+	def get_incoming_current(self):
+		return self.get_measurements().avg_input_current
+
+	def set_rpm(self, new_rpm):
+		self.command('rpm', new_rpm)
+
+	def set_current(self, new_current):
+		self.command('current', new_current)
+
+	def set_brake_current(self, new_current):
+		self.command('brake', new_current)
+
+	def set_duty_cycle(self, new_duty_cycle):
+		self.command('duty', new_duty_cycle)
+
+	def set_servo(self, new_servo_pos):
+		self.talk()
+
+	def start_heartbeat(self):
+		pass
+
+	def stop_heartbeat(self):
+		pass
+
+def install(speed = 1.0, latency = None, timeout_rate = None, fault_rate = None, flow = 0.0):
+	#set up a rig on a (scaled) clock and return the class to use in place of pyvesc.VESC
+	clock = SimClock(speed).install()
+	SimVESC.rig = SimRig(clock, flow = flow)
+	if latency is not None:
+		SimVESC.latency = latency
+		SimVESC.jitter = latency / 4
+	if timeout_rate is not None:
+		SimVESC.timeout_rate = timeout_rate
+	if fault_rate is not None:
+		SimVESC.fault_rate = fault_rate
+	return SimVESC
+
+def add_arguments(parser):
+	#the same simulator switches for every experiment script
+	parser.add_argument('--sim', dest='sim', action='store_true', help='Run against simulated VESCs (simvesc.py) instead of hardware')
+	parser.set_defaults(sim=False)
+	parser.add_argument('--sim_speed', help='How much faster than real time the simulation runs', type=float, default=1.0)
+	parser.add_argument('--sim_latency', help='Simulated serial round trip (s)', type=float, default=None)
+	parser.add_argument('--sim_timeouts', help='Fraction of simulated reads that time out', type=float, default=None)
+	parser.add_argument('--sim_faults', help='Chance per simulated call of a fault', type=float, default=None)
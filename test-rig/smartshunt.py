@@ -10,6 +10,7 @@ import serial
 import serial.tools.list_ports
 import signal
 from pprint import pprint
+from timeindex import IndexedCsv
 
 class GracefulKiller:
 	kill_now = False
@@ -71,9 +72,8 @@ if __name__ == '__main__':
 		ve = vedirect.Vedirect(args.port, args.timeout)
 		
 		if args.csv:
-			csv_file = open(args.csv, "w", newline='')
-			csv_writer = csv.writer(csv_file)
-			csv_writer.writerow(("Time", "Voltage", "Amperage", "Wattage"))
+			csv_file = IndexedCsv(args.csv, ("Time", "Voltage", "Amperage", "Wattage"))
+			csv_writer = csv_file
 
 		try:
 			ve.read_data_callback(print_data_callback)
@@ -0,0 +1,77 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import numpy as np
+from scipy.interpolate import UnivariateSpline
+
+def bin_xy(x, y, bins = 100):
+	#bins y by x with bincount, no sorting needed and duplicate x values are fine.
+	#returns (x centre, mean, standard error, count) for every bin that has samples.
+	x = np.asarray(x, dtype=np.float64)
+	y = np.asarray(y, dtype=np.float64)
+	ok = np.isfinite(x) & np.isfinite(y)
+	x = x[ok]
+	y = y[ok]
+
+	if len(x) == 0:
+		empty = np.zeros(0)
+		return empty, empty, empty, empty
+
+	lo = x.min()
+	hi = x.max()
+	if hi == lo:
+		hi = lo + 1
+
+	idx = ((x - lo) * (bins / (hi - lo))).astype(np.int64)
+	np.clip(idx, 0, bins - 1, out=idx)
+
+	count = np.bincount(idx, minlength=bins).astype(np.float64)
+	sum_x = np.bincount(idx, weights=x, minlength=bins)
+	sum_y = np.bincount(idx, weights=y, minlength=bins)
+	sum_yy = np.bincount(idx, weights=y*y, minlength=bins)
+
+	used = count > 0
+	count = count[used]
+	centres = sum_x[used] / count
+	means = sum_y[used] / count
+
+	#sample variance per bin, bins with one sample get the median error of the others
+	var = np.zeros(len(count))
+	many = count > 1
+	var[many] = np.maximum(sum_yy[used][many] - count[many] * means[many]**2, 0) / (count[many] - 1)
+	sem = np.sqrt(var / count)
+
+	known = sem > 0
+	fill = np.median(sem[known]) if known.any() else max(np.std(means), 1e-9)
+	sem[~known] = fill
+
+	return centres, means, sem, count
+
+def smooth(x, y, bins = 100, points = 500, confidence = 1.96):
+	#one weighted smoothing spline through the binned means.  returns (xs, ys, lower, upper),
+	#the band being +/- confidence standard errors of the binned means around the curve.
+	centres, means, sem, count = bin_xy(x, y, bins)
+
+	if len(centres) == 0:
+		return centres, means, means, means
+
+	if len(centres) < 4:
+		return centres, means, means - confidence * sem, means + confidence * sem
+
+	#with weights of 1/sigma the expected residual sum is about the number of points
+	spline = UnivariateSpline(centres, means, w=1.0 / sem, k=3, s=len(centres))
+
+	xs = np.linspace(centres[0], centres[-1], points)
+	ys = spline(xs)
+	band = confidence * np.interp(xs, centres, sem)
+
+	return xs, ys, ys - band, ys + band
+
+def smooth_series(x, y, **kwargs):
+	#same as smooth() but copes with datetime x values (pandas Time columns)
+	x = np.asarray(x)
+	if np.issubdtype(x.dtype, np.datetime64):
+		seconds = x.astype('datetime64[ns]').astype(np.int64) / 1e9
+		xs, ys, lower, upper = smooth(seconds, y, **kwargs)
+		return (xs * 1e9).astype(np.int64).astype('datetime64[ns]'), ys, lower, upper
+	return smooth(x, y, **kwargs)
@@ -0,0 +1,76 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+from collections import deque
+from statistics import NormalDist
+import numpy as np
+
+#online steady state detection.  every channel keeps the last `window` seconds of samples and
+#counts as settled when, at the given confidence, both
+#	- the trend across the window (least squares slope * window) and
+#	- the uncertainty of the window's mean
+#are inside its tolerance: relative to the mean, plus an absolute floor for values near zero.
+
+class SteadyState():
+
+	def __init__(self, tolerances, window = 3.0, confidence = 0.95, min_samples = 10, absolute = None):
+		self.tolerances = dict(tolerances)
+		self.absolute = dict(absolute or {})
+		self.window = window
+		self.z = NormalDist().inv_cdf((1 + confidence) / 2)
+		self.min_samples = min_samples
+		self.samples = {name: deque() for name in self.tolerances}
+
+	def reset(self):
+		for samples in self.samples.values():
+			samples.clear()
+
+	def push(self, t, values):
+		for name, samples in self.samples.items():
+			v = values.get(name)
+			if v is None:
+				continue
+			samples.append((t, v))
+			while samples and samples[0][0] < t - self.window:
+				samples.popleft()
+
+	def channel(self, name):
+		#(settled, drift, allowed) for one channel, drift being the worst case change
+		#across the window at our confidence
+		samples = self.samples[name]
+		if len(samples) < self.min_samples:
+			return (False, float('inf'), 0.0)
+
+		a = np.asarray(samples, dtype=np.float64)
+		t = a[:, 0] - a[-1, 0]
+		v = a[:, 1]
+		n = len(v)
+		span = t[-1] - t[0]
+		if span < self.window * 0.8:
+			return (False, float('inf'), 0.0)
+
+		mean = v.mean()
+		allowed = self.tolerances[name] * abs(mean) + self.absolute.get(name, 0.0)
+
+		tc = t - t.mean()
+		stt = (tc * tc).sum()
+		slope = (tc * (v - mean)).sum() / stt
+		residual = v - mean - slope * tc
+		sigma = np.sqrt((residual * residual).sum() / max(n - 2, 1))
+
+		trend = (abs(slope) + self.z * sigma / np.sqrt(stt)) * span
+		spread = self.z * sigma / np.sqrt(n)
+		drift = max(trend, spread)
+		return (drift <= allowed, drift, allowed)
+
+	def stable(self):
+		return all(self.channel(name)[0] for name in self.samples)
+
+	def status(self):
+		#the unsettled channels, for printing
+		out = []
+		for name in self.samples:
+			settled, drift, allowed = self.channel(name)
+			if not settled:
+				out.append("{} {:.3g} > {:.3g}".format(name, drift, allowed))
+		return ", ".join(out)
@@ -0,0 +1,23 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pandas as pd
+from genmap import GeneratorMap
+
+#one characterise_generator_at_brake_current run: a single brake current over a range of rpm
+
+def test_single_current_sweep():
+	rpm = np.linspace(500, 3000, 200)
+	data = pd.DataFrame({
+		'Gen RPM': rpm,
+		'Brake Current': np.full(len(rpm), 5.0),
+		'Gen Wattage': rpm * 0.1,
+		'Efficiency': np.full(len(rpm), 80.0)
+	})
+
+	genmap = GeneratorMap.build(data)
+	assert genmap.power.shape == (len(genmap.rpm), 1)
+	assert genmap.current[0] == 5.5
+	assert genmap.optimal_current(1000) == 5.5
+	assert np.isfinite(genmap.expected_power(1000))
@@ -0,0 +1,27 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import pytest
+from thermal import RigThermal, Planner, brake_current_sweep
+
+#the rig's motors have no temperature sensor, so read_temps only ever has the two fets
+
+def test_missing_motor_temperature():
+	planner = Planner(RigThermal())
+	setpoints = brake_current_sweep([5, 60, 10])
+	temps = {'gen_fet_temp': 50.0, 'drv_fet_temp': 30.0}
+
+	result = planner.simulate(setpoints, temps)
+	assert len(result['waits']) == 3
+	assert result['waits'][0] > 0
+	assert len(planner.plan(setpoints, temps)) == 3
+	assert planner.wait(temps, setpoints[0]) == planner.wait(dict(temps, gen_motor_temp = None), setpoints[0])
+
+def test_limit_below_ambient():
+	#a fitted ambient above the limit means the motors never get down to it
+	planner = Planner(RigThermal(ambient = 50.0), limit = 46)
+	setpoints = brake_current_sweep([5, 10])
+	with pytest.raises(ValueError, match="won't cool"):
+		planner.wait({'gen_fet_temp': 60.0}, setpoints[0])
+	with pytest.raises(ValueError):
+		planner.plan(setpoints, {'gen_fet_temp': 60.0})
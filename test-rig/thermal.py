@@ -0,0 +1,354 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import argparse
+import glob
+import math
+import numpy as np
+import pandas as pd
+from rawlog import read_dataframe
+
+#every characterise call waits for both controllers and motors to cool below 46C first, so the
+#order of a sweep decides how long the rig sits idle.  this fits a first order thermal model to
+#each temperature from the logs, predicts what each setpoint will do to them, and orders the
+#setpoints so the hot ones are spread out between cooler ones instead of bunched at the end.
+
+#ThotLogger key: csv / raw log label
+CHANNELS = {
+	'gen_fet_temp': 'Gen FET Temp',
+	'gen_motor_temp': 'Gen Motor Temp',
+	'drv_fet_temp': 'Driver FET Temp',
+	'drv_motor_temp': 'Driver Motor Temp'
+}
+
+#the VESCs report 150C and up when there's no motor sensor, wait_for_motor_temp ignores those too
+NO_SENSOR = 150
+
+class ThermalModel():
+
+	#one temperature:	dT/dt = (ambient + gain * I^2 - T) / tau
+	#with I the brake current.  the driver has to hold the same torque, so at steady speed its
+	#current is about the same and one input does for all four temperatures.
+
+	def __init__(self, tau = 300.0, gain = 0.01, ambient = 25.0):
+		self.tau = tau
+		self.gain = gain
+		self.ambient = ambient
+
+	def final(self, heat):
+		#where the temperature heads for a constant I^2
+		return self.ambient + self.gain * heat
+
+	def step(self, heat, dt):
+		#T(dt) = a * T(0) + b, exact for constant heat
+		e = math.exp(-dt / self.tau)
+		return (e, (1 - e) * self.final(heat))
+
+	def cooldown(self, temperature, limit):
+		#seconds with no load until temperature is down to limit
+		if temperature <= limit:
+			return 0.0
+		if limit <= self.ambient:
+			return math.inf
+		return self.tau * math.log((temperature - self.ambient) / (limit - self.ambient))
+
+	@classmethod
+	def fit(cls, intervals, ambient = None, taus = np.geomspace(5, 5000, 120)):
+		#intervals: start temp, end temp, length and mean I^2 of each.  for a given tau the exact
+		#step is linear in ambient and gain, so least squares for each tau on a log grid and
+		#keep the best.
+		t0, t1, dt, heat = (np.asarray(intervals[key], dtype=np.float64) for key in ('t0', 't1', 'dt', 'heat'))
+		if len(t0) < 10:
+			raise ValueError("only {} intervals".format(len(t0)))
+		if np.ptp(heat) == 0:
+			raise ValueError("the load never changed")
+
+		best = None
+		for tau in taus:
+			e = np.exp(-dt / tau)
+			y = t1 - t0 * e
+			if ambient is None:
+				x = np.column_stack([1 - e, (1 - e) * heat])
+			else:
+				y = y - (1 - e) * ambient
+				x = ((1 - e) * heat)[:, None]
+			coef, *_ = np.linalg.lstsq(x, y, rcond=None)
+			residual = y - x @ coef
+			error = float(residual @ residual)
+			if best is None or error < best[0]:
+				best = (error, tau, coef)
+
+		error, tau, coef = best
+		fitted_ambient, gain = (coef[0], coef[1]) if ambient is None else (ambient, coef[0])
+		if gain <= 0:
+			raise ValueError("temperature doesn't rise with current (gain {:.4g})".format(gain))
+		if tau in (taus[0], taus[-1]):
+			raise ValueError("time constant out of range ({:.0f}s)".format(tau))
+		return cls(float(tau), float(gain), float(fitted_ambient))
+
+	def __repr__(self):
+		return "tau {:.0f}s, {:.4f}C/A^2, ambient {:.1f}C".format(self.tau, self.gain, self.ambient)
+
+#placeholder numbers until there are logs to fit: fets quick and not far above ambient, motors slow
+#and what the limit is really about
+DEFAULTS = {
+	'gen_fet_temp': (60.0, 0.006),
+	'gen_motor_temp': (600.0, 0.024),
+	'drv_fet_temp': (60.0, 0.006),
+	'drv_motor_temp': (600.0, 0.024)
+}
+
+def load_intervals(filenames, interval = 5.0):
+	#temperatures and mean I^2 on an interval grid within each log.  nothing between two logs is
+	#used: the spin up and any load there isn't logged, so it can't be told from cooling down.
+	intervals = {key: {'t0': [], 't1': [], 'dt': [], 'heat': []} for key in CHANNELS}
+	for filename in filenames:
+		if filename.endswith('.bin'):
+			df = read_dataframe(filename)
+		else:
+			df = pd.read_csv(filename, usecols=lambda name: name == 'Time' or name == 'Brake Current' or name in CHANNELS.values())
+		if 'Time' not in df or 'Brake Current' not in df or len(df) == 0:
+			continue
+
+		t = df['Time'].to_numpy(dtype=np.float64)
+		current = np.nan_to_num(df['Brake Current'].to_numpy(dtype=np.float64))
+		bins = ((t - t[0]) // interval).astype(np.int64)
+		count = np.bincount(bins)
+		used = count > 0
+		times = (np.bincount(bins, weights=t) / np.maximum(count, 1))[used]
+		heat = (np.bincount(bins, weights=current * current) / np.maximum(count, 1))[used]
+
+		for key, label in CHANNELS.items():
+			if label not in df:
+				continue
+			temps = df[label].to_numpy(dtype=np.float64)
+			ok = np.isfinite(temps) & (temps < NO_SENSOR)
+			n = np.bincount(bins[ok], minlength=len(count))
+			temp = (np.bincount(bins[ok], weights=temps[ok], minlength=len(count)) / np.maximum(n, 1))[used]
+			valid = (n > 0)[used]
+
+			out = intervals[key]
+			pairs = valid[:-1] & valid[1:]
+			out['t0'] += list(temp[:-1][pairs])
+			out['t1'] += list(temp[1:][pairs])
+			out['dt'] += list(np.diff(times)[pairs])
+			out['heat'] += list(((heat[:-1] + heat[1:]) / 2)[pairs])
+
+	return intervals
+
+class RigThermal():
+
+	#a model for each of the four temperatures, with the defaults for any that couldn't be fitted
+
+	def __init__(self, models = None, ambient = 25.0):
+		self.models = {key: ThermalModel(tau, gain, ambient) for key, (tau, gain) in DEFAULTS.items()}
+		self.models.update(models or {})
+		self.unfitted = {}
+
+	@classmethod
+	def fit(cls, filenames, ambient = None, interval = 5.0):
+		rig = cls()
+		for key, intervals in load_intervals(filenames, interval).items():
+			try:
+				rig.models[key] = ThermalModel.fit(intervals, ambient)
+			except ValueError as e:
+				rig.unfitted[key] = str(e)
+		return rig
+
+	def ambient_temps(self):
+		return {key: model.ambient for key, model in self.models.items()}
+
+class Setpoint():
+
+	#one characterise call: the function in thot-experiment.py and its arguments, how long it
+	#runs and the brake current it goes from and to (constant if end_current is None)
+
+	def __init__(self, test, kwargs, duration, start_current, end_current = None):
+		self.test = test
+		self.kwargs = kwargs
+		self.duration = duration
+		self.start_current = start_current
+		self.end_current = start_current if end_current is None else end_current
+
+	def heat(self, pieces = 10):
+		#(seconds, mean I^2) for a linear ramp in pieces
+		dt = self.duration / pieces
+		out = []
+		for i in range(pieces):
+			a = self.start_current + (self.end_current - self.start_current) * i / pieces
+			b = self.start_current + (self.end_current - self.start_current) * (i + 1) / pieces
+			out.append((dt, (a * a + a * b + b * b) / 3))
+		return out
+
+	def __repr__(self):
+		args = ", ".join("{}={}".format(k, v) for k, v in self.kwargs.items())
+		return "{}({})".format(self.test, args)
+
+#the sweeps from test_generator_motor
+def brake_current_sweep(currents, start_rpm = 500, end_rpm = 3000, test_duration = 60):
+	return [Setpoint('characterise_generator_at_brake_current', {'test_current': current, 'start_rpm': start_rpm, 'end_rpm': end_rpm, 'test_duration': test_duration},
+		test_duration, current) for current in currents]
+
+def rpm_sweep(rpms, start_current = 0, end_current = 60, test_duration = 30):
+	return [Setpoint('characterise_generator_at_rpm', {'test_rpm': rpm, 'start_current': start_current, 'end_current': end_current, 'test_duration': test_duration},
+		test_duration, start_current, end_current) for rpm in rpms]
+
+def drive_current_sweep(drive_currents, start_brake_current = 0, end_brake_current = 60, test_duration = 60):
+	return [Setpoint('characterise_generator_at_drive_current', {'drive_current': current, 'start_brake_current': start_brake_current, 'end_brake_current': end_brake_current, 'test_duration': test_duration},
+		test_duration, start_brake_current, end_brake_current) for current in drive_currents]
+
+class Planner():
+
+	#predicts the cooldown before each setpoint and looks for the order with the least of it.
+	#	limit		what wait_for_motor_temp waits for
+	#	peak_limit	optionally, no setpoint may be predicted to take a temperature past this;
+	#				it then waits for a lower start temperature instead
+	#	gap			seconds between setpoints that aren't the test itself (spin up, sleeps)
+	#	max_wait	longest cooldown that is believed; past it (or never, for a limit at or
+	#				below a model's ambient) the plan can't be run and wait() raises ValueError
+
+	def __init__(self, thermal, limit = 46, peak_limit = None, gap = 5.0, max_wait = 3600):
+		self.thermal = thermal
+		self.limit = limit
+		self.peak_limit = peak_limit
+		self.gap = gap
+		self.max_wait = max_wait
+		self.cache = {}
+
+	def prepare(self, setpoint):
+		#per temperature, the whole run as one affine map of the start temperature plus the
+		#highest start temperature it may begin from
+		key = id(setpoint)
+		if key in self.cache:
+			return self.cache[key][1]
+
+		maps = {}
+		for name, model in self.thermal.models.items():
+			a, b = 1.0, 0.0
+			start_limit = self.limit
+			for dt, heat in setpoint.heat():
+				e, f = model.step(heat, dt)
+				a, b = e * a, e * b + f
+				if self.peak_limit is not None:
+					start_limit = min(start_limit, (self.peak_limit - b) / a)
+			#a setpoint that is too hot to ever fit under the peak limit just runs from the normal one
+			if start_limit <= model.ambient:
+				start_limit = self.limit
+			e, f = model.step(0.0, self.gap)
+			maps[name] = (e * a, e * b + f, start_limit)
+
+		self.cache[key] = (setpoint, maps)
+		return maps
+
+	def temperatures(self, temps = None):
+		#every temperature the models know, ambient for any that wasn't measured (a motor without
+		#a sensor never holds a setpoint up)
+		out = self.thermal.ambient_temps()
+		out.update((name, value) for name, value in (temps or {}).items() if value is not None)
+		return out
+
+	def wait(self, temps, setpoint):
+		temps = self.temperatures(temps)
+		maps = self.prepare(setpoint)
+		seconds = 0.0
+		for name, model in self.thermal.models.items():
+			cooldown = model.cooldown(temps[name], maps[name][2])
+			if not cooldown <= self.max_wait:
+				raise ValueError("{} at {:.1f}C won't cool to {:.1f}C within {:.0f}s (ambient {:.1f}C)".format(
+					name, temps[name], maps[name][2], self.max_wait, model.ambient))
+			seconds = max(seconds, cooldown)
+		#wait_for_motor_temp polls once a second
+		return math.ceil(seconds)
+
+	def run(self, temps, setpoint):
+		#(seconds waited, temperatures after the setpoint and the gap that follows)
+		temps = self.temperatures(temps)
+		maps = self.prepare(setpoint)
+		wait = self.wait(temps, setpoint)
+		after = {}
+		for name, model in self.thermal.models.items():
+			a, b, _ = maps[name]
+			cooled = model.ambient + (temps[name] - model.ambient) * math.exp(-wait / model.tau)
+			after[name] = a * cooled + b
+		return (wait, after)
+
+	def simulate(self, order, temps = None):
+		temps = self.temperatures(temps)
+		waits = []
+		for setpoint in order:
+			wait, temps = self.run(temps, setpoint)
+			waits.append(wait)
+		running = sum(s.duration for s in order) + self.gap * len(order)
+		return {'total': running + sum(waits), 'running': running, 'waiting': sum(waits), 'waits': waits, 'temps': temps}
+
+	def plan(self, setpoints, temps = None, passes = 3):
+		temps = self.temperatures(temps)
+
+		#greedy: whatever needs the least waiting next, and of those the hottest, so the cool ones
+		#are left for when the rig needs to cool down anyway
+		remaining = list(setpoints)
+		order = []
+		current = temps
+		while remaining:
+			waits = [self.wait(current, s) for s in remaining]
+			least = min(waits)
+			best = max((i for i, w in enumerate(waits) if w <= least + 1),
+				key=lambda i: sum(self.prepare(remaining[i])[name][1] for name in self.thermal.models))
+			setpoint = remaining.pop(best)
+			order.append(setpoint)
+			_, current = self.run(current, setpoint)
+
+		#then move single setpoints elsewhere while that helps
+		best_total = self.simulate(order, temps)['waiting']
+		for p in range(passes):
+			improved = False
+			for i in range(len(order)):
+				for j in range(len(order)):
+					if i == j:
+						continue
+					trial = order[:i] + order[i + 1:]
+					trial.insert(j, order[i])
+					total = self.simulate(trial, temps)['waiting']
+					if total < best_total - 0.5:
+						order, best_total, improved = trial, total, True
+			if not improved:
+				break
+
+		return order
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Fit thermal models from the logs and plan a sweep to wait least for cooldowns')
+	parser.add_argument('filenames', nargs='*', help='Sweep CSVs or binary raw logs to fit from (wildcards ok)')
+	parser.add_argument('--sweep', help='Sweep to plan', choices=['brake_current', 'rpm', 'drive_current'], default='brake_current')
+	parser.add_argument('--limit', help='Start temperature limit (C)', type=float, default=46)
+	parser.add_argument('--peak_limit', help='Highest temperature any setpoint may reach (C)', type=float, default=None)
+	parser.add_argument('--ambient', help='Ambient temperature (C), fitted if not given', type=float, default=None)
+	parser.add_argument('--gap', help='Seconds between setpoints', type=float, default=5.0)
+
+	args = parser.parse_args()
+
+	filenames = []
+	for pattern in args.filenames:
+		filenames += sorted(glob.glob(pattern)) or [pattern]
+	thermal = RigThermal.fit(filenames, args.ambient) if filenames else RigThermal(ambient = args.ambient or 25.0)
+
+	for name, model in thermal.models.items():
+		note = " (default: {})".format(thermal.unfitted[name]) if name in thermal.unfitted else ""
+		print ("{:<16} {}{}".format(name, model, note))
+
+	sweeps = {
+		'brake_current': lambda: brake_current_sweep(list(range(1, 10)) + list(range(10, 61, 5))),
+		'rpm': lambda: rpm_sweep(range(500, 3001, 100)),
+		'drive_current': lambda: drive_current_sweep(range(5, 31, 5))
+	}
+	setpoints = sweeps[args.sweep]()
+
+	planner = Planner(thermal, args.limit, args.peak_limit, args.gap)
+	before = planner.simulate(setpoints)
+	order = planner.plan(setpoints)
+	after = planner.simulate(order)
+
+	for setpoint, wait in zip(order, after['waits']):
+		print ("{:>6}s wait  {}".format(wait, setpoint))
+	print ("In order:  {:.0f} min, {:.0f} min of it cooling down".format(before['total'] / 60, before['waiting'] / 60))
+	print ("Planned:   {:.0f} min, {:.0f} min of it cooling down".format(after['total'] / 60, after['waiting'] / 60))
@@ -1,17 +1,40 @@
 #!/usr/bin/python3
 # -*- coding: utf-8 -*-
 
-from pyvesc import VESC
+import argparse
+import glob
 import time
-import statistics
 from pprint import pprint
 import os
 import csv
 import traceback
 from pathlib import Path
-import subprocess
+from ringstats import RingStats
+from rawlog import RawLogWriter
+from writerthread import BackgroundWriter
+from vescpoller import VescPair
+from recorder import Recorder
+from genmap import GeneratorMap
+from mppt import Reading, PerturbObserve, TableDriven
+from scheduler import RateScheduler
+from steadystate import SteadyState
+from thermal import RigThermal, Planner, brake_current_sweep
+from adaptive import AdaptivePeak
+import simvesc
+
+#pyvesc.VESC, or simvesc.SimVESC with --sim (pyvesc isn't needed then)
+VESC = None
+
+#shunts, load cell and VESC readings for the whole session
+recorder = None
+
+#this many samples in a row without a reply and the connection is taken to be gone: the test
+#raises instead of running out its duration on nothing
+MAX_MISSED = 5
 
 def test_generator_motor():
+	global recorder
+
 	try:
 		driver_uuid    = 0x5300450011504d4143323520 # Trampa V60 VESC
 		generator_uuid = 0x1b00420012504D4143323520 # Trampa V60 VESC
@@ -45,16 +68,14 @@ def test_generator_motor():
 		#where so save our csv
 		Path("output").mkdir(parents=True, exist_ok=True)
 
+		#shunts and load cell get read in the background, in this process
 		dir_path = os.path.dirname(os.path.realpath(__file__))
-		smartshunt_script = dir_path + "/smartshunt.py"
-		
-		battery_shunt_params = [smartshunt_script,"--serial", "VE4X8ER8", "--csv", "{}/output/battery-shunt.csv".format(dir_path)]
-		#print(" ".join(battery_shunt_params))
-		battery_shunt_proc = subprocess.Popen(battery_shunt_params, stdout=subprocess.DEVNULL)
-		
-		generator_shunt_params = [smartshunt_script,"--serial", "VE4YC71B", "--csv", "{}/output/generator-shunt.csv".format(dir_path)]
-		#print(" ".join(generator_shunt_params))
-		generator_shunt_proc = subprocess.Popen(generator_shunt_params, stdout=subprocess.DEVNULL)
+		recorder = Recorder(dir_path + "/output")
+		if VESC is not simvesc.SimVESC:
+			recorder.add_shunt("battery-shunt", "VE4X8ER8")
+			recorder.add_shunt("generator-shunt", "VE4YC71B")
+			recorder.add_loadcell("loadcell", "7583033303835111E012")
+		recorder.start()
 		
 		try:
 			min_rpm = 500
@@ -66,6 +87,12 @@ def test_generator_motor():
 			#	characterise_generator_at_rpm(driver, generator, rpm, test_duration = test_duration)
 			#	time.sleep(0.5)
 
+			#or the same sweeps in an order that spends less time waiting to cool down
+			#run_setpoints(driver, generator, brake_current_sweep(list(range(1, 10)) + list(range(10, 61, 5)), min_rpm, max_rpm, test_duration))
+
+			#or only as many setpoints per rpm as it takes to find the peak
+			#adaptive_sweep(driver, generator, range(min_rpm, max_rpm+1, 500))
+
 			#for current in range (1, 10, 1):
 			#	characterise_generator_at_brake_current(driver, generator, current, test_duration = test_duration, start_rpm = min_rpm, end_rpm = max_rpm)
 			#	time.sleep(0.5)
@@ -91,8 +118,9 @@ def test_generator_motor():
 	# Turn Off the VESC
 	driver.set_current(0)
 	generator.set_current(0)
-	battery_shunt_proc.terminate()
-	generator_shunt_proc.terminate()
+	if recorder is not None:
+		recorder.stop()
+		recorder = None
 	driver.stop_heartbeat()
 	generator.stop_heartbeat()
 
@@ -117,6 +145,10 @@ class ThotLogger():
 	}
 
 	def __init__(self, csv_filename, raw_filename):
+		self.csv_filename = csv_filename
+		self.raw_filename = raw_filename
+		self.rows = 0
+		self.stats = RingStats(self.names.keys())
 		self.new_log()
 		self.clear_averages()
 
@@ -125,14 +157,63 @@ class ThotLogger():
 		
 		header = ['Time']
 		header += self.names.values()
-		self.csv_writer.writerow(header)
 
-		self.raw_file = open(raw_filename, "w", newline='')
-		self.raw_writer = csv.writer(self.raw_file)
-		self.raw_writer.writerow(header)
+		#the averages also get the spread of each channel
+		avg_header = header + [label + " StdDev" for label in self.names.values()]
+		self.csv_writer.writerow(avg_header)
 
-	def log_motor(self, motor, mt = 'gen'):
-		measurements = motor.get_measurements()
+		#raw samples go to a binary log unless a csv was asked for
+		if raw_filename.endswith('.csv'):
+			self.raw_file = open(raw_filename, "w", newline='')
+			self.raw_writer = csv.writer(self.raw_file)
+			self.raw_writer.writerow(header)
+		else:
+			self.raw_writer = RawLogWriter(raw_filename, self.names)
+			self.raw_file = self.raw_writer
+
+		#from here on rows are written by a background thread
+		self.writer = BackgroundWriter()
+		self.csv_writer = self.writer.wrap(self.csv_writer, self.csv_file)
+		self.raw_writer = self.writer.wrap(self.raw_writer, self.raw_file)
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
+
+	def close(self):
+		self.writer.close()
+
+		stats = self.writer.get_stats()
+		if stats['dropped']:
+			print ("Dropped {} of {} rows (max queue depth {})".format(stats['dropped'], stats['written'] + stats['dropped'], stats['max_depth']))
+
+	def get_writer_stats(self):
+		return self.writer.get_stats()
+
+	def results(self, start_time, samples, schedule = None, missed = 0, pair = None):
+		#what a test function hands back: where its data went and how fast it sampled
+		duration = time.time() - start_time
+		results = {
+			'filename': self.csv_filename,
+			'raw_filename': self.raw_filename,
+			'samples': samples,
+			'rows': self.rows,
+			'duration': duration,
+			'rate': self.rows / duration if duration > 0 else 0,
+			'missed': missed,
+			'writer': self.get_writer_stats()
+		}
+		if schedule is not None:
+			results['schedule'] = schedule.get_stats()
+		if pair is not None:
+			results['poll_errors'] = pair.errors()
+		return results
+
+	def log_motor(self, motor, mt = 'gen', measurements = None):
+		if measurements is None:
+			measurements = motor.get_measurements()
 		rpm = abs(measurements.rpm / (motor.conf.motor_poles / 2))
 		voltage = measurements.v_in
 		amperage = measurements.avg_input_current
@@ -170,33 +251,43 @@ class ThotLogger():
 
 	def log(self, name, value):
 		self.lastlog[name] = value;
-		if name not in self.averages:
-			self.averages[name] = []
-		self.averages[name].append(value)
+		self.stats.push(name, value)
 		return
 		
 	def get_averages(self):
 		rvals = {}
-		for key, avg_array in self.averages.items():
-			if avg_array:
-				avg = statistics.mean(avg_array)
-			else:
-				#todo: make this support being None
-				avg = 0
-			rvals[key] = avg
+		for key in self.stats.names:
+			rvals[key] = self.stats.mean(key)
 
 		return rvals
 
-	def write_raw_csv(self):
-		date_string = time.time()
+	def get_stats(self):
+		rvals = {}
+		for key in self.stats.names:
+			rvals[key] = {
+				'mean': self.stats.mean(key),
+				'min': self.stats.min(key),
+				'max': self.stats.max(key),
+				'stddev': self.stats.stddev(key),
+				'count': self.stats.count(key)
+			}
+
+		return rvals
+
+	def write_raw_csv(self, timestamp = None):
+		date_string = timestamp
+		if date_string is None:
+			date_string = time.time()
 		row = [date_string]
 		row += self.lastlog.values()
 		self.raw_writer.writerow(row)
+		self.rows += 1
 	
 	def write_avg_csv(self):
 		date_string = time.time()
 		row = [date_string]
 		row += self.get_averages().values()
+		row += [self.stats.stddev(key) for key in self.names.keys()]
 		self.csv_writer.writerow(row)
 
 	def print_line(self, vals = None):
@@ -221,9 +312,14 @@ class ThotLogger():
 			self.lastlog[key] = None
 		
 	def clear_averages(self):
-		self.averages = {}
-		for key in self.names.keys():
-			self.averages[key] = []
+		self.stats.reset()
+
+def start_pair(generator, driver):
+	pair = VescPair(generator, driver)
+	if recorder is not None:
+		recorder.attach(pair)
+	pair.start()
+	return pair
 
 def wait_for_motor_temp(motor, temperature = 46):
 
@@ -247,7 +343,7 @@ def monitor_motor(motor, test_duration = None, filename = None):
 
 	if filename is None:
 		filename = "output/monitor.csv"
-		raw_filename = "output/raw_monitor.csv"
+		raw_filename = "output/raw_monitor.bin"
 	
 	thotlog = ThotLogger(filename, raw_filename)
 	
@@ -257,37 +353,41 @@ def monitor_motor(motor, test_duration = None, filename = None):
 	next_display_time = start_time + 1
 	samples = 0
 
-	while test_duration is None or time.time() <= end_time:
-		try:
-			thotlog.new_log()
-			thotlog.log_motor(motor, 'gen')
-			thotlog.write_raw_csv()
+	try:
+		while test_duration is None or time.time() <= end_time:
+			try:
+				thotlog.new_log()
+				thotlog.log_motor(motor, 'gen')
+				thotlog.write_raw_csv()
 						
-			#do we want to display it?
-			if time.time() > next_display_time:
-				avg = thotlog.get_averages()
-				thotlog.print_line()
-				thotlog.write_avg_csv()
-				thotlog.clear_averages()
-
-				next_display_time = time.time() + 1
+				#do we want to display it?
+				if time.time() > next_display_time:
+					avg = thotlog.get_averages()
+					thotlog.print_line()
+					thotlog.write_avg_csv()
+					thotlog.clear_averages()
+
+					next_display_time = time.time() + 1
 					
-				samples += 1
-		except AttributeError as e:
-			print (e)
-			traceback.print_exc()
-			continue
+					samples += 1
+			except AttributeError as e:
+				print (e)
+				traceback.print_exc()
+				continue
+	finally:
+		thotlog.close()
 
 	print ("Finished test with {} samples.".format(samples))
+	return thotlog.results(start_time, samples)
 	
-def characterise_generator_at_rpm(driver, generator, test_rpm, start_current = 0, end_current = 60, test_duration = 30, filename = None):
+def characterise_generator_at_rpm(driver, generator, test_rpm, start_current = 0, end_current = 60, test_duration = 30, filename = None, rate = 50):
 
 	wait_for_motor_temp(driver)
 	wait_for_motor_temp(generator)
 
 	if filename is None:
 		filename = "output/generator_rpm_{:.0f}_{:.0f}A_to_{:.0f}A_{:.0f}s.csv".format(test_rpm, start_current, end_current, test_duration)
-		raw_filename = "output/raw_generator_rpm_{:.0f}_{:.0f}A_to_{:.0f}A_{:.0f}s.csv".format(test_rpm, start_current, end_current, test_duration)
+		raw_filename = "output/raw_generator_rpm_{:.0f}_{:.0f}A_to_{:.0f}A_{:.0f}s.bin".format(test_rpm, start_current, end_current, test_duration)
 	
 	thotlog = ThotLogger(filename, raw_filename)
 
@@ -296,66 +396,83 @@ def characterise_generator_at_rpm(driver, generator, test_rpm, start_current = 0
 	wait_for_rpm(driver, test_rpm)
 
 	start_time = time.time()
-	next_display_time = start_time + 0.25
-	end_time = start_time + test_duration
 	samples = 0
+	missed = 0
 
-	while time.time() <= end_time:
-		#set our brake current to be proportional based on time
-		current_range = end_current - start_current
-		brake_current = start_current + current_range - current_range * ((end_time - time.time()) / test_duration)
-		generator.set_brake_current(brake_current)
+	#control ticks at a fixed rate, averages on a slower grid
+	schedule = RateScheduler(rate, report_rate = 4)
 
-		try:
-			thotlog.new_log()
+	#poll both controllers in the background
+	pair = start_pair(generator, driver)
 
-			thotlog.log('target_rpm', test_rpm)
-			thotlog.log('brake_current', brake_current)
-			thotlog.log_motor(generator, 'gen')
-			thotlog.log_motor(driver, 'drv')
-			thotlog.log_efficiency()
+	try:
+		for t in schedule.run(test_duration):
+			#set our brake current to be proportional based on time
+			current_range = end_current - start_current
+			brake_current = start_current + current_range * (t / test_duration)
+			pair.generator.send('set_brake_current', brake_current)
+
+			try:
+				sample = pair.next_sample()
+				if sample is None:
+					#one of them didn't answer in time
+					missed += 1
+					if pair.consecutive_missed >= MAX_MISSED:
+						raise IOError("no reply from the VESCs {} times in a row ({} poll errors)".format(pair.consecutive_missed, pair.errors()))
+					continue
+
+				thotlog.new_log()
+
+				thotlog.log('target_rpm', test_rpm)
+				thotlog.log('brake_current', brake_current)
+				thotlog.log_motor(generator, 'gen', sample.gen)
+				thotlog.log_motor(driver, 'drv', sample.drv)
+				thotlog.log_efficiency()
 			
-			thotlog.write_raw_csv()
-
-			#do we want to display it?
-			if time.time() > next_display_time:
-				avg = thotlog.get_averages()
-				thotlog.print_line()
-				thotlog.write_avg_csv()
-				thotlog.clear_averages()
+				thotlog.write_raw_csv(sample.time)
 
-				next_display_time = time.time() + 0.25
+				#do we want to display it?
+				if schedule.report_due():
+					avg = thotlog.get_averages()
+					thotlog.print_line()
+					thotlog.write_avg_csv()
+					thotlog.clear_averages()
 				
-				#if we hit the end of the power curve, exit
-				if time.time() - start_time > test_duration/2 and (avg['gen_wattage'] < 0):
-					print ("End of power curve.")					
-					break
-
-				#if we pull the battery too low, exit
-				if avg['drv_voltage'] < 24:
-					print ("Battery voltage too low")
-					break;
+					#if we hit the end of the power curve, exit
+					if t > test_duration/2 and (avg['gen_wattage'] < 0):
+						print ("End of power curve.")					
+						break
+
+					#if we pull the battery too low, exit
+					if avg['drv_voltage'] < 24:
+						print ("Battery voltage too low")
+						break;
 				
-			samples += 1
+				samples += 1
 
-		except AttributeError as e:
-			print (e)
-			continue
+			except AttributeError as e:
+				print (e)
+				continue
+	finally:
+		pair.stop()
+		thotlog.close()
 
 	driver.set_rpm(0)
 	generator.set_brake_current(0)
 
-	print ("Finished test with {} samples.".format(samples))
+	print ("Finished test with {} samples, {} missed.".format(samples, missed))
+	print ("Schedule:", schedule.summary())
+	return thotlog.results(start_time, samples, schedule, missed, pair)
 
 
-def characterise_generator_at_brake_current(driver, generator, test_current, start_rpm = 500, end_rpm = 3000, test_duration = 60, filename = None):
+def characterise_generator_at_brake_current(driver, generator, test_current, start_rpm = 500, end_rpm = 3000, test_duration = 60, filename = None, rate = 50):
 
 	wait_for_motor_temp(driver)
 	wait_for_motor_temp(generator)
 
 	if filename is None:
 		filename = "output/generator_current_{:.0f}_{:.0f}RPM_to_{:.0f}RPM_{:.0f}s.csv".format(test_current, start_rpm, end_rpm, test_duration)
-		raw_filename = "output/raw_generator_current_{:.0f}_{:.0f}RPM_to_{:.0f}RPM_{:.0f}s.csv".format(test_current, start_rpm, end_rpm, test_duration)
+		raw_filename = "output/raw_generator_current_{:.0f}_{:.0f}RPM_to_{:.0f}RPM_{:.0f}s.bin".format(test_current, start_rpm, end_rpm, test_duration)
 	
 	thotlog = ThotLogger(filename, raw_filename)
 	
@@ -368,68 +485,86 @@ def characterise_generator_at_brake_current(driver, generator, test_current, sta
 	wait_for_rpm(driver, start_rpm)
 	
 	start_time = time.time()
-	end_time = start_time + test_duration
-	next_display_time = start_time + 0.5
 	samples = 0
-	
-	while time.time() <= end_time:
-		#set our brake current to be proportional based on time
-		rpm_range = end_rpm - start_rpm
-		test_rpm = start_rpm + rpm_range - rpm_range * ((end_time - time.time()) / test_duration)
+	missed = 0
 
-		driver.set_rpm(int(test_rpm))
+	#control ticks at a fixed rate, averages on a slower grid
+	schedule = RateScheduler(rate, report_rate = 4, first_report = 0.5)
 
-		try:
-			thotlog.new_log()
+	#poll both controllers in the background
+	pair = start_pair(generator, driver)
 
-			thotlog.log('brake_current', test_current)
-			thotlog.log('target_rpm', test_rpm)
-			thotlog.log_motor(generator, 'gen')
-			thotlog.log_motor(driver, 'drv')
-			thotlog.log_efficiency()
+	try:
+		for t in schedule.run(test_duration):
+			#set our rpm to be proportional based on time
+			rpm_range = end_rpm - start_rpm
+			test_rpm = start_rpm + rpm_range * (t / test_duration)
+
+			pair.driver.send('set_rpm', int(test_rpm))
+
+			try:
+				sample = pair.next_sample()
+				if sample is None:
+					#one of them didn't answer in time
+					missed += 1
+					if pair.consecutive_missed >= MAX_MISSED:
+						raise IOError("no reply from the VESCs {} times in a row ({} poll errors)".format(pair.consecutive_missed, pair.errors()))
+					continue
+
+				thotlog.new_log()
+
+				thotlog.log('brake_current', test_current)
+				thotlog.log('target_rpm', test_rpm)
+				thotlog.log_motor(generator, 'gen', sample.gen)
+				thotlog.log_motor(driver, 'drv', sample.drv)
+				thotlog.log_efficiency()
 			
-			thotlog.write_raw_csv()
-
-			#do we want to display it?
-			if time.time() > next_display_time:
-				avg = thotlog.get_averages()
-				thotlog.print_line()
-				thotlog.write_avg_csv()
-				thotlog.clear_averages()
+				thotlog.write_raw_csv(sample.time)
 
-				next_display_time = time.time() + 0.25
+				#do we want to display it?
+				if schedule.report_due():
+					avg = thotlog.get_averages()
+					thotlog.print_line()
+					thotlog.write_avg_csv()
+					thotlog.clear_averages()
 				
-				#if we hit the end of the power curve, exit
-				if avg['gen_wattage'] < 0 and time.time() - start_time > test_duration/2:
-					print ("End of power curve.")					
-					break
+					#if we hit the end of the power curve, exit
+					if avg['gen_wattage'] < 0 and t > test_duration/2:
+						print ("End of power curve.")					
+						break
 
-				#if we pull the battery too low, exit
-				if avg['drv_voltage'] < 24:
-					print ("Battery voltage too low")
-					break;
+					#if we pull the battery too low, exit
+					if avg['drv_voltage'] < 24:
+						print ("Battery voltage too low")
+						break;
 
-			samples += 1
+				samples += 1
 
-			#okay, write it to our csv...
-		except AttributeError as e:
-			print (e)
-			continue
+				#okay, write it to our csv...
+			except AttributeError as e:
+				print (e)
+				continue
 					
+	finally:
+		pair.stop()
+		thotlog.close()
+
 	#turn it off
 	driver.set_rpm(0)
 	generator.set_brake_current(0)
 
-	print ("Finished test with {} samples.".format(samples))
+	print ("Finished test with {} samples, {} missed.".format(samples, missed))
+	print ("Schedule:", schedule.summary())
+	return thotlog.results(start_time, samples, schedule, missed, pair)
 
-def characterise_generator_at_drive_current(driver, generator, drive_current, start_brake_current = 0, end_brake_current = 60, test_duration = 60, filename = None):
+def characterise_generator_at_drive_current(driver, generator, drive_current, start_brake_current = 0, end_brake_current = 60, test_duration = 60, filename = None, rate = 50):
 
 	wait_for_motor_temp(driver)
 	wait_for_motor_temp(generator)
 
 	if filename is None:
 		filename = "output/generator_drive_current_{:.0f}_{:.0f}A_to_{:.0f}A_{:.0f}s.csv".format(drive_current, start_brake_current, end_brake_current, test_duration)
-		raw_filename = "output/raw_generator_drive_current_{:.0f}_{:.0f}A_to_{:.0f}A_{:.0f}s.csv".format(drive_current, start_brake_current, end_brake_current, test_duration)
+		raw_filename = "output/raw_generator_drive_current_{:.0f}_{:.0f}A_to_{:.0f}A_{:.0f}s.bin".format(drive_current, start_brake_current, end_brake_current, test_duration)
 	
 	thotlog = ThotLogger(filename, raw_filename)
 	
@@ -442,67 +577,274 @@ def characterise_generator_at_drive_current(driver, generator, drive_current, st
 	generator.set_brake_current(start_brake_current)
 	
 	start_time = time.time()
-	end_time = start_time + test_duration
-	next_display_time = start_time + 0.5
 	samples = 0
+	missed = 0
 
-	while time.time() <= end_time:
-		#set our brake current to be proportional based on time
-		brake_current_range = end_brake_current - start_brake_current
-		brake_current = start_brake_current + brake_current_range - brake_current_range * ((end_time - time.time()) / test_duration)
+	#control ticks at a fixed rate, averages on a slower grid
+	schedule = RateScheduler(rate, report_rate = 4, first_report = 0.5)
 
-		generator.set_brake_current(brake_current)
-
-		try:
-			thotlog.new_log()
+	#poll both controllers in the background
+	pair = start_pair(generator, driver)
 
-			thotlog.log('brake_current', brake_current)
-			thotlog.log_motor(generator, 'gen')
-			thotlog.log_motor(driver, 'drv')
-			thotlog.log_efficiency()
+	try:
+		for t in schedule.run(test_duration):
+			#set our brake current to be proportional based on time
+			brake_current_range = end_brake_current - start_brake_current
+			brake_current = start_brake_current + brake_current_range * (t / test_duration)
+
+			pair.generator.send('set_brake_current', brake_current)
+
+			try:
+				sample = pair.next_sample()
+				if sample is None:
+					#one of them didn't answer in time
+					missed += 1
+					if pair.consecutive_missed >= MAX_MISSED:
+						raise IOError("no reply from the VESCs {} times in a row ({} poll errors)".format(pair.consecutive_missed, pair.errors()))
+					continue
+
+				thotlog.new_log()
+
+				thotlog.log('brake_current', brake_current)
+				thotlog.log_motor(generator, 'gen', sample.gen)
+				thotlog.log_motor(driver, 'drv', sample.drv)
+				thotlog.log_efficiency()
 			
-			thotlog.write_raw_csv()
-
-			#do we want to display it?
-			if time.time() > next_display_time:
-				avg = thotlog.get_averages()
-				thotlog.print_line()
-				thotlog.write_avg_csv()
-				thotlog.clear_averages()
+				thotlog.write_raw_csv(sample.time)
 
-				next_display_time = time.time() + 0.25
+				#do we want to display it?
+				if schedule.report_due():
+					avg = thotlog.get_averages()
+					thotlog.print_line()
+					thotlog.write_avg_csv()
+					thotlog.clear_averages()
 				
-				#if we hit the end of the power curve, exit
-				if avg['gen_wattage'] < 0 and time.time() - start_time > test_duration/2:
-					print ("End of power curve.")					
-					break
+					#if we hit the end of the power curve, exit
+					if avg['gen_wattage'] < 0 and t > test_duration/2:
+						print ("End of power curve.")					
+						break
 
-				#if we pull the battery too low, exit
-				if avg['drv_voltage'] < 24:
-					print ("Battery voltage too low")
-					break;
+					#if we pull the battery too low, exit
+					if avg['drv_voltage'] < 24:
+						print ("Battery voltage too low")
+						break;
 
-			samples += 1
+				samples += 1
 
-			#okay, write it to our csv...
-		except AttributeError as e:
-			print (e)
-			continue
+				#okay, write it to our csv...
+			except AttributeError as e:
+				print (e)
+				continue
 					
+	finally:
+		pair.stop()
+		thotlog.close()
+
 	#turn it off
 	driver.set_rpm(0)
 	generator.set_brake_current(0)
 
-	print ("Finished test with {} samples.".format(samples))
+	print ("Finished test with {} samples, {} missed.".format(samples, missed))
+	print ("Schedule:", schedule.summary())
+	return thotlog.results(start_time, samples, schedule, missed, pair)
 
-def test_mppt(driver, generator, drive_current, test_duration = None, filename = None):
+def characterise_generator_at_setpoint(driver, generator, test_rpm, brake_current, hold = 5, timeout = 60, confidence = 0.95, filename = None, rate = 50):
+
+	#holds one operating point until rpm, power and temperatures have settled, then records
+	#hold more seconds of it.  ends at timeout either way, the result says if it ever settled.
+
+	wait_for_motor_temp(driver)
+	wait_for_motor_temp(generator)
+
+	if filename is None:
+		filename = "output/generator_setpoint_{:.0f}RPM_{:.1f}A.csv".format(test_rpm, brake_current)
+		raw_filename = "output/raw_generator_setpoint_{:.0f}RPM_{:.1f}A.bin".format(test_rpm, brake_current)
+
+	thotlog = ThotLogger(filename, raw_filename)
+
+	print ("Test Setpoint: {} RPM, {}A".format(test_rpm, brake_current))
+
+	driver.set_rpm(test_rpm)
+	generator.set_brake_current(brake_current)
+
+	detector = SteadyState({
+		'gen_rpm': 0.01,
+		'gen_wattage': 0.02,
+		'drv_wattage': 0.02,
+		'gen_fet_temp': 0,
+		'gen_motor_temp': 0
+	}, confidence = confidence, absolute = {'gen_wattage': 1.0, 'drv_wattage': 1.0, 'gen_fet_temp': 0.5, 'gen_motor_temp': 0.5})
+	steady = RingStats(thotlog.names.keys())
+
+	start_time = time.time()
+	samples = 0
+	missed = 0
+	settled_at = None
+
+	#control ticks at a fixed rate, averages on a slower grid
+	schedule = RateScheduler(rate, report_rate = 4)
+
+	#poll both controllers in the background
+	pair = start_pair(generator, driver)
+
+	try:
+		for t in schedule.run(timeout):
+			pair.driver.send('set_rpm', int(test_rpm))
+			pair.generator.send('set_brake_current', brake_current)
+
+			try:
+				sample = pair.next_sample()
+				if sample is None:
+					#one of them didn't answer in time
+					missed += 1
+					if pair.consecutive_missed >= MAX_MISSED:
+						raise IOError("no reply from the VESCs {} times in a row ({} poll errors)".format(pair.consecutive_missed, pair.errors()))
+					continue
+
+				thotlog.new_log()
+
+				thotlog.log('target_rpm', test_rpm)
+				thotlog.log('brake_current', brake_current)
+				thotlog.log_motor(generator, 'gen', sample.gen)
+				thotlog.log_motor(driver, 'drv', sample.drv)
+				thotlog.log_efficiency()
+
+				thotlog.write_raw_csv(sample.time)
+
+				detector.push(t, thotlog.lastlog)
+				if settled_at is not None:
+					for key, value in thotlog.lastlog.items():
+						steady.push(key, value)
+
+				#do we want to display it?
+				if schedule.report_due():
+					avg = thotlog.get_averages()
+					thotlog.print_line()
+					thotlog.write_avg_csv()
+					thotlog.clear_averages()
+
+					if settled_at is None and detector.stable():
+						settled_at = t
+						print ("Settled after {:.1f}s".format(t))
+
+					if settled_at is not None and t - settled_at >= hold:
+						break
+
+					#if we pull the battery too low, exit
+					if avg['drv_voltage'] < 24:
+						print ("Battery voltage too low")
+						break;
+
+				samples += 1
+
+			except AttributeError as e:
+				print (e)
+				continue
+	finally:
+		pair.stop()
+		thotlog.close()
+
+	if settled_at is None:
+		print ("Never settled: {}".format(detector.status()))
+
+	print ("Finished test with {} samples, {} missed.".format(samples, missed))
+	print ("Schedule:", schedule.summary())
+
+	results = thotlog.results(start_time, samples, schedule, missed, pair)
+	results['setpoint'] = (test_rpm, brake_current)
+	results['settled'] = settled_at is not None
+	results['settle_time'] = settled_at
+	results['steady'] = {key: steady.mean(key) for key in thotlog.names.keys()} if settled_at is not None else None
+	return results
+
+def sweep_setpoints(driver, generator, setpoints, **kwargs):
+	#(rpm, brake current) pairs, each held until it settles.  much quicker than fixed durations
+	#when things settle fast, and the ones that never did get listed at the end.
+	results = []
+	for test_rpm, brake_current in setpoints:
+		results.append(characterise_generator_at_setpoint(driver, generator, test_rpm, brake_current, **kwargs))
+
+	driver.set_rpm(0)
+	generator.set_brake_current(0)
+
+	unsettled = [r['setpoint'] for r in results if not r['settled']]
+	print ("{} setpoints, {} never settled{}".format(len(results), len(unsettled), ": " + ", ".join("{} RPM / {}A".format(*s) for s in unsettled) if unsettled else ""))
+	return results
+
+def read_temps(driver, generator):
+	#the four temperatures under thermal.py's names, leaving out a motor without a sensor
+	temps = {}
+	for motor, mt in ((generator, 'gen'), (driver, 'drv')):
+		measurements = motor.get_measurements()
+		if measurements is None:
+			continue
+		temps[mt + '_fet_temp'] = measurements.temp_fet
+		if measurements.temp_motor < 150:
+			temps[mt + '_motor_temp'] = measurements.temp_motor
+	return temps
+
+def run_setpoints(driver, generator, setpoints, thermal = None, limit = 46, peak_limit = None):
+	#runs thermal.py setpoints in the order that waits least for cooldowns, replanned from the
+	#measured temperatures before each one.  the thermal models come from the logs already in output/
+	if thermal is None:
+		thermal = RigThermal.fit(sorted(glob.glob("output/raw_generator_*.bin")))
+	planner = Planner(thermal, limit, peak_limit)
+
+	remaining = list(setpoints)
+	temps = read_temps(driver, generator)
+	before = planner.simulate(remaining, temps)
+	after = planner.simulate(planner.plan(remaining, temps), temps)
+	print ("{} setpoints, predicted {:.0f} min cooling down in the given order, {:.0f} min planned".format(
+		len(remaining), before['waiting'] / 60, after['waiting'] / 60))
+
+	results = []
+	while remaining:
+		setpoint = planner.plan(remaining, read_temps(driver, generator))[0]
+		remaining.remove(setpoint)
+
+		#with a peak limit the hot setpoints need to start cooler than the test itself waits for
+		limits = planner.prepare(setpoint)
+		wait_for_motor_temp(generator, min(limits['gen_fet_temp'][2], limits['gen_motor_temp'][2]))
+		wait_for_motor_temp(driver, min(limits['drv_fet_temp'][2], limits['drv_motor_temp'][2]))
+
+		results.append(globals()[setpoint.test](driver, generator, **setpoint.kwargs))
+		time.sleep(0.5)
+
+	return results
+
+def adaptive_sweep(driver, generator, rpms, low = 1, high = 60, tolerance = 1.0, max_runs = 15, **kwargs):
+	#instead of every brake current on a grid: a few coarse setpoints per rpm, then more only where
+	#they narrow down the current giving the most power, until that is known to +-tolerance
+	peaks = {}
+	for test_rpm in rpms:
+		search = AdaptivePeak(low, high, tolerance, max_runs = max_runs, resolution = 0.1)
+		while True:
+			brake_current = search.next()
+			if brake_current is None:
+				break
+			results = characterise_generator_at_setpoint(driver, generator, test_rpm, brake_current, **kwargs)
+			search.add(brake_current, results['steady']['gen_wattage'] if results['settled'] else None)
+
+		peak, sd = search.peak()
+		peaks[test_rpm] = {'brake_current': peak, 'sd': sd, 'runs': len(search.x), 'reason': search.reason}
+		if peak is None:
+			#nothing settled or gave a power reading, carry on with the next rpm
+			print ("No peak found at {} RPM after {} runs ({})".format(test_rpm, len(search.x), search.reason))
+			continue
+		print ("{} RPM: peak at {:.1f}A +-{:.2f}A after {} runs ({})".format(test_rpm, peak, sd, len(search.x), search.reason))
+
+	driver.set_rpm(0)
+	generator.set_brake_current(0)
+	return peaks
+
+def test_mppt(driver, generator, drive_current, test_duration = None, filename = None, map_filename = None, controller = None, rate = 50):
 
 	wait_for_motor_temp(driver)
 	wait_for_motor_temp(generator)
 
 	if filename is None:
 		filename = "output/mppt_{:.0f}A.csv".format(drive_current)
-		raw_filename = "output/raw_mppt_{:.0f}A.csv".format(drive_current)
+		raw_filename = "output/raw_mppt_{:.0f}A.bin".format(drive_current)
 	
 	thotlog = ThotLogger(filename, raw_filename)
 	
@@ -512,129 +854,123 @@ def test_mppt(driver, generator, drive_current, test_duration = None, filename =
 	driver.set_rpm(1000)
 	wait_for_rpm(driver, 1000)
 	driver.set_current(drive_current)
-	time.sleep(5)
+	#no rpm target in current mode, give it up to what the old fixed sleep was to stop moving
+	wait_for_rpm(driver, timeout = 5, tolerance = 0.02)
 	generator.set_brake_current(0)
 	
 	start_time = time.time()
-	if test_duration is not None:
-		end_time = start_time + test_duration
-	next_display_time = start_time + 0.50
 	samples = 0
+	missed = 0
+
+	#control ticks at a fixed rate, the controller runs once a second on the averages
+	schedule = RateScheduler(rate, report_rate = 1, first_report = 0.5)
+
+	#the algorithm lives in mppt.py.  with a generator map (genmap.py) the table driven one
+	#jumps straight to the best brake current for the rpm and perturb and observe only trims it
+	if controller is None:
+		if map_filename is not None:
+			#the map is by generator (mechanical) rpm, get_rpm is electrical
+			genmap = GeneratorMap.load(map_filename)
+			gen_rpm = abs(generator.get_rpm() / (generator.conf.motor_poles / 2))
+			controller = TableDriven(genmap, start_current = genmap.optimal_current(gen_rpm))
+			print ("Using generator map {}".format(map_filename))
+		else:
+			controller = PerturbObserve(drive_current * 0.3)
+	controller.reset()
+	print ("MPPT controller:", controller.name)
 
-	brake_current = 0
-	brake_current = drive_current * 0.3
-	last_brake_current = brake_current
+	brake_current = controller.brake_current
 	generator.set_brake_current(brake_current)
 
-	last_rpm = 0
-	last_wattage = 0
-	last_current_change = time.time()
-	first_time = True
-	
-	orig_send_interval = 5
-	send_interval = orig_send_interval
+	#poll both controllers in the background
+	pair = start_pair(generator, driver)
 
-	while test_duration is None or time.time() <= end_time:
-		try:
-			thotlog.new_log()
-
-			thotlog.log_motor(generator, 'gen')
-			thotlog.log_motor(driver, 'drv')
-			thotlog.log_efficiency()
-			thotlog.log('brake_current', brake_current)
+	try:
+		for t in schedule.run(test_duration):
+			try:
+				sample = pair.next_sample()
+				if sample is None:
+					#one of them didn't answer in time
+					missed += 1
+					if pair.consecutive_missed >= MAX_MISSED:
+						raise IOError("no reply from the VESCs {} times in a row ({} poll errors)".format(pair.consecutive_missed, pair.errors()))
+					continue
+
+				thotlog.new_log()
+
+				thotlog.log_motor(generator, 'gen', sample.gen)
+				thotlog.log_motor(driver, 'drv', sample.drv)
+				thotlog.log_efficiency()
+				thotlog.log('brake_current', brake_current)
+
+				thotlog.write_raw_csv(sample.time)
 			
-			#do we want to display it?
-			if time.time() > next_display_time:
-				avg = thotlog.get_averages()
-				thotlog.print_line()
-				thotlog.write_avg_csv()
-
-				brake_current = last_brake_current
-
-				percent = 0.005
-				big_wattage = last_wattage * (1.0 + percent)
-				big_rpm = last_rpm * (1.0 + percent)
-				lil_wattage = last_wattage * (1.0 - percent)
-				lil_rpm = last_rpm * (1.0 - percent)
-
-				try:
-					#print("Watts: {:6.2f} < {:6.2f} < {:6.2f}  RPM: {:4.0f} < {:4.0f} < {:4.0f}".format(lil_wattage, avg['gen_wattage'], big_wattage, lil_rpm, avg['gen_rpm'], big_rpm))
-
-					#wattage up and rpm up - increase
-					#if avg['gen_wattage'] >= big_wattage and avg['gen_rpm'] >= big_rpm:
-					#	brake_current += 0.1
-					#	last_current_change = time.time()
-					#	last_rpm = avg['gen_rpm']
-					#	last_wattage = avg['gen_wattage']
-						#print ("full send")
-
-					#wattage down or rpm down - decrease
-					if avg['gen_wattage'] < lil_wattage or avg['gen_rpm'] < lil_rpm:
-						brake_current -= 0.02
-						last_current_change = time.time()
-						last_rpm = avg['gen_rpm']
-						last_wattage = avg['gen_wattage']
-						#print ("chill bro")
-						send_interval = orig_send_interval
-
-					#has it been too long since we tried to increase				
-					if time.time() - last_current_change > send_interval:
-						brake_current += 0.01
-						last_current_change = time.time()
-						last_rpm = avg['gen_rpm']
-						last_wattage = avg['gen_wattage']
-						#print ("lets get it")
-						send_interval = send_interval - 1
-						send_interval = max(1, send_interval)
-						
-						
-					generator.set_brake_current(brake_current)
-					last_brake_current = brake_current
-
-					thotlog.clear_averages()
-
-					next_display_time = time.time() + 1
+				#do we want to display it?
+				if schedule.report_due():
+					avg = thotlog.get_averages()
+					thotlog.print_line()
+					thotlog.write_avg_csv()
+
+					try:
+						reading = Reading(time.time(), avg['gen_rpm'], avg['gen_wattage'], avg['gen_voltage'], avg['gen_amperage'])
+						brake_current = controller.update(reading)
+						pair.generator.send('set_brake_current', brake_current)
+
+						thotlog.clear_averages()
 					
-					#if we hit the end of the power curve, exit
-					if avg['gen_wattage'] < 0 and time.time() - start_time > test_duration/2:
-						print ("End of power curve.")					
-						break
-
-					#if we pull the battery too low, exit
-					if avg['drv_voltage'] < 24:
-						print ("Battery voltage too low")
-						break;
-
-
-					samples += 1
-
-				except TypeError as e:
-					print ("yarr.")
-			#okay, write it to our csv...
-		except AttributeError as e:
-			print (e)
-			traceback.print_exc()
-			continue
+						#if we hit the end of the power curve, exit
+						if avg['gen_wattage'] < 0 and t > test_duration/2:
+							print ("End of power curve.")					
+							break
+
+						#if we pull the battery too low, exit
+						if avg['drv_voltage'] < 24:
+							print ("Battery voltage too low")
+							break;
+
+
+						samples += 1
+
+					except TypeError as e:
+						print ("yarr.")
+				#okay, write it to our csv...
+			except AttributeError as e:
+				print (e)
+				traceback.print_exc()
+				continue
 					
+	finally:
+		pair.stop()
+		thotlog.close()
+
 	#turn it off
 	driver.set_rpm(0)
 	generator.set_brake_current(0)
 
-	print ("Finished test with {} samples.".format(samples))
+	print ("Finished test with {} samples, {} missed.".format(samples, missed))
+	print ("Schedule:", schedule.summary())
+	return thotlog.results(start_time, samples, schedule, missed, pair)
 
-def wait_for_rpm(motor, target_rpm):
+def wait_for_rpm(motor, target_rpm = None, timeout = 30, tolerance = 0.01):
+	#until the rpm is within tolerance of target_rpm (when given) and has stopped moving
+	detector = SteadyState({'rpm': tolerance}, window = 1.0)
 	start_time = time.time()
-	current_rpm = 0
-	ratio = 0
-	while ratio < .99 or ratio > 1.01:
+	while True:
 		current_rpm = motor.get_rpm()
-		ratio = current_rpm / target_rpm
+		detector.push(time.time(), {'rpm': current_rpm})
 
-		time.sleep(0.1)
+		on_target = target_rpm is None or abs(current_rpm / target_rpm - 1) <= tolerance
+		if on_target and detector.stable():
+			return True
 
-		if (time.time() > start_time + 30):
-			print ("Error: timeout exceeded")
-			break
+		if (time.time() > start_time + timeout):
+			if target_rpm is None:
+				print ("RPM still moving after {}s".format(timeout))
+			else:
+				print ("Error: timeout exceeded")
+			return False
+
+		time.sleep(0.05)
 	
 def duty_cycle_ramp(motor):
 	print ("Duty Cycle Ramp Up")
@@ -681,6 +1017,15 @@ def servo_test(motor):
 	motor.set_duty_cycle(0)
 
 if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Generator test rig experiments')
+	simvesc.add_arguments(parser)
+	args = parser.parse_args()
+
+	if args.sim:
+		VESC = simvesc.install(args.sim_speed, args.sim_latency, args.sim_timeouts, args.sim_faults)
+	else:
+		from pyvesc import VESC
+
 	test_generator_motor()
 	
 #print ("Driver Measurements:");
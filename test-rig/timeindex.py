@@ -0,0 +1,152 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import argparse
+import bisect
+import csv
+import io
+import os
+import numpy as np
+
+#sidecar index for the append-only logs (shunts, load cell, ...).  <log>.idx is a text file
+#with a "time,offset" line for every Nth row, offset being where that row starts in the log.
+#a time window can then be cut out with a binary search and one seek instead of a full parse.
+
+DEFAULT_EVERY = 1000
+
+def index_filename(filename):
+	return filename + ".idx"
+
+class IndexedCsv():
+
+	#csv writer + file in one, so it can be handed straight to BackgroundWriter.wrap()
+
+	def __init__(self, filename, header, every = DEFAULT_EVERY):
+		self.every = every
+		self.rows = 0
+		self.offset = 0
+
+		self.file = open(filename, "wb")
+		self.index = open(index_filename(filename), "w")
+		self.writer = csv.writer(self)
+		self.writer.writerow(header)
+
+	def write(self, s):
+		b = s.encode('utf-8')
+		self.file.write(b)
+		self.offset += len(b)
+
+	def writerow(self, row):
+		if self.rows % self.every == 0:
+			self.index.write("{!r},{}\n".format(float(row[0]), self.offset))
+		self.writer.writerow(row)
+		self.rows += 1
+
+	def writerows(self, rows):
+		for row in rows:
+			self.writerow(row)
+
+	def flush(self):
+		self.file.flush()
+		self.index.flush()
+
+	def fileno(self):
+		return self.file.fileno()
+
+	def close(self):
+		self.file.close()
+		self.index.close()
+
+def build_index(filename, every = DEFAULT_EVERY):
+	#one pass over an existing log to write its sidecar
+	count = 0
+	with open(filename, "rb") as f, open(index_filename(filename), "w") as index:
+		f.readline()
+		offset = f.tell()
+		for line in f:
+			if count % every == 0:
+				try:
+					index.write("{!r},{}\n".format(float(line.split(b',', 1)[0]), offset))
+				except ValueError:
+					#a garbled row just doesn't get an entry, the ones after it still count
+					pass
+			offset += len(line)
+			count += 1
+	return count
+
+def load_index(filename):
+	#returns (times, offsets), or None if there is no usable index
+	idx = index_filename(filename)
+	if not os.path.isfile(idx):
+		return None
+
+	try:
+		index = np.loadtxt(idx, delimiter=',', ndmin=2)
+	except ValueError:
+		return None
+	if len(index) == 0:
+		return None
+
+	times = index[:, 0]
+	offsets = index[:, 1].astype(np.int64)
+
+	#entries can point past the end if the log wasn't flushed before a crash
+	keep = offsets < os.path.getsize(filename)
+	times = times[keep]
+	offsets = offsets[keep]
+	if len(offsets) == 0:
+		return None
+
+	#make sure the index belongs to this log and not to an earlier file of the same name
+	with open(filename, "rb") as f:
+		f.seek(offsets[-1])
+		try:
+			if float(f.readline().split(b',', 1)[0]) != times[-1]:
+				return None
+		except ValueError:
+			return None
+
+	return (times, offsets)
+
+def read_window(filename, start_time, end_time):
+	#rows with start_time <= Time <= end_time as a DataFrame (Time in epoch seconds),
+	#or None if the log has no index
+	import pandas as pd
+
+	index = load_index(filename)
+	if index is None:
+		return None
+	times, offsets = index
+
+	with open(filename, "rb") as f:
+		header = f.readline()
+		columns = header.decode('utf-8').strip().split(',')
+
+		#last indexed row at or before start, first indexed row after end
+		i = bisect.bisect_right(times, start_time) - 1
+		j = bisect.bisect_right(times, end_time)
+
+		begin = offsets[i] if i >= 0 else len(header)
+		f.seek(begin)
+		if j < len(offsets):
+			data = f.read(offsets[j] - begin)
+		else:
+			data = f.read()
+
+	dtypes = {name: 'float64' for name in columns}
+	if not data.strip():
+		return pd.DataFrame({name: pd.Series(dtype='float64') for name in columns})
+
+	df = pd.read_csv(io.BytesIO(data), names=columns, header=None, dtype=dtypes)
+	return df[(df.Time >= start_time) & (df.Time <= end_time)].reset_index(drop=True)
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Build time index sidecars for existing logs')
+	parser.add_argument('filenames', nargs='+', help='CSV logs to index')
+	parser.add_argument('--every', help='Index every N rows', type=int, default=DEFAULT_EVERY)
+
+	args = parser.parse_args()
+
+	for filename in args.filenames:
+		rows = build_index(filename, args.every)
+		print ("{}: indexed {} rows".format(filename, rows))
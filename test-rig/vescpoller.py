@@ -0,0 +1,156 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+from collections import namedtuple
+
+#one synchronised reading from both controllers
+PairedSample = namedtuple('PairedSample', ['time', 'gen', 'drv', 'skew'])
+
+class VescPoller():
+
+	#polls a single VESC from its own thread so there is always one get_measurements() in flight.
+	#setpoints are handed over with send() and written by the poll thread between requests,
+	#so only one thread ever talks to the serial port.
+
+	def __init__(self, motor, name = None, clock = None):
+		self.motor = motor
+		self.name = name
+		#looked up at call time by default, so a patched time.time (simvesc) is picked up
+		self.clock = clock if clock is not None else lambda: time.time()
+		self.listeners = []
+
+		self.cond = threading.Condition()
+		self.pending = {}
+		self.measurements = None
+		self.timestamp = None
+		self.sequence = 0
+		self.errors = 0
+		self.backoff = 0.05
+
+		self.running = False
+		self.thread = None
+
+	def start(self):
+		if self.running:
+			return
+		self.running = True
+		self.thread = threading.Thread(target=self.run, name="poll-{}".format(self.name), daemon=True)
+		self.thread.start()
+
+	def stop(self):
+		self.running = False
+		if self.thread is not None:
+			self.thread.join(timeout = 2)
+			if self.thread.is_alive():
+				#still stuck in a read, the port isn't ours to write to
+				print ("{} poll thread didn't stop, {} setpoints not sent".format(self.name, len(self.pending)))
+				return
+			self.thread = None
+
+		#anything still queued goes out now so the final setpoint is never lost
+		self.send_pending()
+
+	def send(self, command, *args):
+		#latest value wins, we only care about the newest setpoint
+		with self.cond:
+			self.pending[command] = args
+
+	def send_pending(self):
+		with self.cond:
+			commands = self.pending
+			self.pending = {}
+
+		for command, args in commands.items():
+			try:
+				getattr(self.motor, command)(*args)
+			except Exception as e:
+				self.errors += 1
+				print ("{} {} failed: {}".format(self.name, command, e))
+
+	def run(self):
+		while self.running:
+			self.send_pending()
+
+			sent = self.clock()
+			try:
+				measurements = self.motor.get_measurements()
+			except Exception as e:
+				#a closed / unplugged port fails straight away, don't spin on it
+				self.errors += 1
+				time.sleep(self.backoff)
+				continue
+			received = self.clock()
+
+			#pyvesc hands back None when the reply times out
+			if measurements is None:
+				self.errors += 1
+				continue
+
+			timestamp = (sent + received) / 2
+			with self.cond:
+				self.measurements = measurements
+				self.timestamp = timestamp
+				self.sequence += 1
+				self.cond.notify_all()
+
+			for listener in self.listeners:
+				listener(timestamp, measurements)
+
+	def wait(self, sequence, timeout = 1.0):
+		#block until there is a reply newer than sequence
+		with self.cond:
+			self.cond.wait_for(lambda: self.sequence > sequence or not self.running, timeout)
+			if self.sequence > sequence:
+				return (self.sequence, self.timestamp, self.measurements)
+		return (sequence, None, None)
+
+class VescPair():
+
+	#polls the generator and driver concurrently and hands back readings taken at (nearly) the same moment.
+
+	def __init__(self, generator, driver, clock = None):
+		self.generator = VescPoller(generator, 'gen', clock)
+		self.driver = VescPoller(driver, 'drv', clock)
+		self.gen_sequence = 0
+		self.drv_sequence = 0
+		self.pairs = 0
+		self.missed = 0
+		self.consecutive_missed = 0
+
+	def start(self):
+		self.generator.start()
+		self.driver.start()
+
+	def stop(self):
+		self.generator.stop()
+		self.driver.stop()
+
+	def __enter__(self):
+		self.start()
+		return self
+
+	def __exit__(self, *args):
+		self.stop()
+
+	def errors(self):
+		#failed or timed out reads on either controller
+		return self.generator.errors + self.driver.errors
+
+	def next_sample(self, timeout = 1.0):
+		#returns None if either controller didn't answer in time
+		gen_sequence, gen_time, gen = self.generator.wait(self.gen_sequence, timeout)
+		drv_sequence, drv_time, drv = self.driver.wait(self.drv_sequence, timeout)
+
+		if gen is None or drv is None:
+			self.missed += 1
+			self.consecutive_missed += 1
+			return None
+
+		self.gen_sequence = gen_sequence
+		self.drv_sequence = drv_sequence
+		self.pairs += 1
+		self.consecutive_missed = 0
+
+		return PairedSample((gen_time + drv_time) / 2, gen, drv, abs(gen_time - drv_time))
@@ -0,0 +1,143 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import atexit
+import os
+import queue
+import threading
+import time
+
+class QueuedWriter():
+
+	#looks like a csv.writer, but only drops the row on the queue
+
+	def __init__(self, background, writer, file):
+		self.background = background
+		self.writer = writer
+		self.file = file
+
+	def writerow(self, row):
+		self.background.put(self, row)
+
+	def writerows(self, rows):
+		for row in rows:
+			self.background.put(self, row)
+
+class BackgroundWriter():
+
+	#owns a bounded queue and a thread that drains it in batches, so a slow SD card
+	#never holds up the thread that is talking to the VESCs.  if the queue fills up
+	#rows are dropped (and counted) rather than blocking the caller.
+
+	STOP = object()
+
+	def __init__(self, max_rows = 20000, batch_size = 500, fsync_interval = 2.0):
+		self.queue = queue.Queue(maxsize=max_rows)
+		self.batch_size = batch_size
+		self.fsync_interval = fsync_interval
+
+		self.writers = []
+		self.dirty = set()
+
+		self.written = 0
+		self.dropped = 0
+		self.max_depth = 0
+		self.fsyncs = 0
+		self.error = None
+
+		self.closed = False
+		self.thread = threading.Thread(target=self.run, name="writer", daemon=True)
+		self.thread.start()
+
+		#make sure the files get closed even if nobody calls close()
+		atexit.register(self.close)
+
+	def wrap(self, writer, file):
+		qw = QueuedWriter(self, writer, file)
+		self.writers.append(qw)
+		return qw
+
+	def put(self, qw, row):
+		try:
+			self.queue.put_nowait((qw, row))
+		except queue.Full:
+			self.dropped += 1
+			return
+
+		depth = self.queue.qsize()
+		if depth > self.max_depth:
+			self.max_depth = depth
+
+	def run(self):
+		next_fsync = time.monotonic() + self.fsync_interval
+		running = True
+
+		while running:
+			try:
+				batch = [self.queue.get(timeout = self.fsync_interval)]
+			except queue.Empty:
+				batch = []
+
+			while len(batch) < self.batch_size:
+				try:
+					batch.append(self.queue.get_nowait())
+				except queue.Empty:
+					break
+
+			for item in batch:
+				if item is self.STOP:
+					running = False
+					continue
+
+				qw, row = item
+				try:
+					qw.writer.writerow(row)
+					self.written += 1
+					self.dirty.add(qw)
+				except Exception as e:
+					self.error = e
+
+			if not running or time.monotonic() >= next_fsync:
+				self.sync()
+				next_fsync = time.monotonic() + self.fsync_interval
+
+	def sync(self):
+		for qw in self.dirty:
+			try:
+				qw.file.flush()
+				os.fsync(qw.file.fileno())
+				self.fsyncs += 1
+			except Exception as e:
+				self.error = e
+		self.dirty = set()
+
+	def depth(self):
+		return self.queue.qsize()
+
+	def get_stats(self):
+		return {
+			'written': self.written,
+			'dropped': self.dropped,
+			'depth': self.depth(),
+			'max_depth': self.max_depth,
+			'fsyncs': self.fsyncs
+		}
+
+	def close(self):
+		if self.closed:
+			return
+		self.closed = True
+		atexit.unregister(self.close)
+
+		#blocking put, we want every queued row on disk before the files close
+		self.queue.put(self.STOP)
+		self.thread.join()
+
+		for qw in self.writers:
+			try:
+				qw.file.close()
+			except Exception as e:
+				self.error = e
+
+		if self.error is not None:
+			print ("Writer error: {}".format(self.error))